@@ -111,3 +111,15 @@ class ReportCreationRequest(BaseModel):
     description: str
     created: AwareDatetime
     voucher_instance: int
+
+################################################################################
+#################################      Mail     ################################
+################################################################################
+
+class MailCreationRequest(BaseModel):
+    dedupe_key: str
+    to_email: str
+    to_name: str
+    subject: str
+    text: str
+    html_text: str
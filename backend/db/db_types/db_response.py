@@ -1,5 +1,5 @@
 from datetime import timedelta
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, AwareDatetime
 
 from db.db_types.db_request import VoucherStatusType
@@ -14,6 +14,10 @@ class SessionDetailsResponse(BaseModel):
     eatery: Optional[int] = None
     customer: Optional[int] = None
 
+class SessionUserResponse(BaseModel):
+    user_type: Literal["customer", "eatery"]
+    user_id: int
+
 ################################################################################
 #################################    Address    ################################
 ################################################################################
@@ -45,8 +49,48 @@ class EateryDetailsResponse(BaseModel):
     address: AddressDetailsResponse
     description: str
     thumbnail: str
+    thumbnail_card: Optional[str] = None
+    thumbnail_detail: Optional[str] = None
     menu: Optional[str] = None
 
+class EaterySummaryResponse(BaseModel):
+    business_name: str
+    thumbnail: str
+    date_joined: AwareDatetime
+
+class RatingDetailsResponse(BaseModel):
+    review_count: int
+    rating_total: float
+
+class EateryCardVoucherResponse(BaseModel):
+    voucher_id: int
+    name: str
+    expiry: AwareDatetime
+    total: int
+    unclaimed: int
+    rating: RatingDetailsResponse
+
+class EateryCardDetailsResponse(BaseModel):
+    business_name: str
+    thumbnail: str
+    date_joined: AwareDatetime
+    rating: RatingDetailsResponse
+    vouchers: List[EateryCardVoucherResponse]
+
+class EateryFeaturesResponse(BaseModel):
+    latitude: float
+    longitude: float
+    date_joined: AwareDatetime
+    active_vouchers: int
+    rating: RatingDetailsResponse
+    keyword_ids: List[int]
+
+class EaterySearchDocumentResponse(BaseModel):
+    business_name: str
+    description: str
+    postcode: str
+    keywords: List[str]
+
 ################################################################################
 #################################   Customer   #################################
 ################################################################################
@@ -90,6 +134,13 @@ class VoucherDetailsResponse(BaseModel):
     expiry_date: AwareDatetime
     quantity: int
 
+class VoucherCountsResponse(BaseModel):
+    total: int
+    unclaimed: int
+    claimed: int
+    redeemed: int
+    reserved: int
+
 class VoucherInstanceDetailsResponse(BaseModel):
     status: VoucherStatusType
     redemption_code: Optional[str] = None
@@ -116,3 +167,16 @@ class ReportDetailsResponse(BaseModel):
     description: str
     created: AwareDatetime
     voucher_instance: int
+
+################################################################################
+#################################      Mail     ################################
+################################################################################
+
+class MailDetailsResponse(BaseModel):
+    id: int
+    to_email: str
+    to_name: str
+    subject: str
+    text: str
+    html_text: str
+    attempts: int
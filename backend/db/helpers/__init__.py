@@ -1,10 +1,14 @@
 import os
-import sys
 import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Iterator, List, Optional, TypeVar
+import anyio
 import psycopg2
-from psycopg2 import pool
 
-from logger import log_red
+from db.pool import ConnectionPool
 
 # getting credentials to access the database, default values provided if they are not set
 USER = os.environ.get("POSTGRES_USER", "postgres")
@@ -13,35 +17,197 @@ DB_NAME = os.environ.get("POSTGRES_DB", "dream")
 DB_PORT = os.environ.get("POSTGRES_PORT", "5432")
 MIN_CONN = int(os.environ.get("POSTGRES_MINCONN", "1"))
 MAX_CONN = int(os.environ.get("POSTGRES_MAXCONN", "10"))
+POOL_TIMEOUT = float(os.environ.get("POSTGRES_POOL_TIMEOUT", "10"))
+POOL_MAX_IDLE = float(os.environ.get("POSTGRES_POOL_MAX_IDLE", "300"))
+POOL_VALIDATE_AFTER = float(os.environ.get("POSTGRES_POOL_VALIDATE_AFTER", "30"))
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class DeferredConnection(psycopg2.extensions.connection):
+    """
+    A connection whose commit and rollback are deferred while a unit of work owns it
+    """
+    deferred = False
+
+    def commit(self):
+        """
+        Commits unless a unit of work will commit on our behalf
+        """
+        if not self.deferred:
+            super().commit()
 
-connection_pool = pool.ThreadedConnectionPool(
-    minconn=1,
-    maxconn=10,
+    def rollback(self):
+        """
+        Rolls back unless a unit of work will roll back on our behalf
+        """
+        if not self.deferred:
+            super().rollback()
+
+connection_pool = ConnectionPool(
+    minconn=MIN_CONN,
+    maxconn=MAX_CONN,
+    timeout=POOL_TIMEOUT,
+    max_idle=POOL_MAX_IDLE,
+    validate_after=POOL_VALIDATE_AFTER,
     user=USER,
     password=PASSWORD,
     database=DB_NAME,
     host="host.docker.internal",
-    port=DB_PORT
+    port=DB_PORT,
+    connection_factory=DeferredConnection
 )
 
+class UnitOfWork:
+    """
+    Tracks the single connection shared by every helper call within a unit of work
+    """
+    def __init__(self):
+        self.conn: Optional[DeferredConnection] = None
+        self.lock = threading.Lock()
+        self.after_commit: List[Callable[[], None]] = []
+
+    def begin(self):
+        """
+        Checks out the unit of work's connection up front, waiting for the pool if needed
+        """
+        with self.lock:
+            if self.conn is None:
+                self.conn = connection_pool.getconn()
+                self.conn.deferred = True
+
+    def finish(self, commit: bool):
+        """
+        Commits or rolls back the unit of work and hands its connection back to the pool
+
+        Callbacks registered with on_commit run only once the commit has succeeded
+        """
+        with self.lock:
+            conn = self.conn
+            self.conn = None
+            callbacks, self.after_commit = self.after_commit, []
+
+        if conn is not None:
+            conn.deferred = False
+            try:
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            finally:
+                connection_pool.putconn(conn)
+
+        if commit:
+            # Callbacks run on their own, anything they write is not part of the finished unit of work
+            token = _unit_of_work.set(None)
+            try:
+                for callback in callbacks:
+                    callback()
+            finally:
+                _unit_of_work.reset(token)
+
+_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar("unit_of_work", default=None)
+
 def connect() -> psycopg2.extensions.connection:
     """
-    Gets a database connection from pool
+    Gets a database connection from pool, or the unit of work's connection if one is active
     """
-    try:
-        conn = connection_pool.getconn()
-        return conn
-    except psycopg2.Error as err:
-        log_red(f"Database connection error: {err}")
-        sys.exit(1)
+    unit_of_work = _unit_of_work.get()
+    if unit_of_work is None:
+        return connection_pool.getconn()
+
+    unit_of_work.begin()
+    assert unit_of_work.conn is not None
+    return unit_of_work.conn
 
 def disconnect(conn: psycopg2.extensions.connection):
     """
     Release the database connection after use back to the pool
     """
+    unit_of_work = _unit_of_work.get()
+    if unit_of_work is not None and conn is unit_of_work.conn:
+        return
+
     connection_pool.putconn(conn)
+
+def on_commit(callback: Callable[[], None]):
+    """
+    Runs the callback once the current unit of work commits, or straight away if there isn't one
+    """
+    unit_of_work = _unit_of_work.get()
+    if unit_of_work is None:
+        callback()
+        return
+
+    with unit_of_work.lock:
+        unit_of_work.after_commit.append(callback)
+
+@contextmanager
+def use_unit_of_work(unit_of_work: UnitOfWork) -> Iterator[None]:
+    """
+    Makes helper calls in the current context share the given unit of work's connection
+    """
+    token = _unit_of_work.set(unit_of_work)
+    try:
+        yield
+    finally:
+        _unit_of_work.reset(token)
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """
+    Runs every helper call inside the block on one connection as a single transaction
+
+    Commits once when the block exits and rolls everything back if it raises, nested calls join the outer unit of work
+    """
+    if _unit_of_work.get() is not None:
+        yield
+        return
+
+    unit_of_work = UnitOfWork()
+    with use_unit_of_work(unit_of_work):
+        try:
+            yield
+        except BaseException:
+            unit_of_work.finish(commit=False)
+            raise
+        unit_of_work.finish(commit=True)
+
+@contextmanager
+def savepoint() -> Iterator[None]:
+    """
+    Lets the caller recover from a failed helper call without aborting the surrounding unit of work
+    """
+    unit_of_work = _unit_of_work.get()
+    if unit_of_work is None:
+        yield
+        return
+
+    conn = connect()
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT helper_call;")
+    try:
+        yield
+    except BaseException:
+        with conn.cursor() as cur:
+            cur.execute("ROLLBACK TO SAVEPOINT helper_call;")
+        raise
+    with conn.cursor() as cur:
+        cur.execute("RELEASE SAVEPOINT helper_call;")
+
+T = TypeVar("T")
+
+_blocking_limiter: Optional[anyio.CapacityLimiter] = None
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking call (e.g. psycopg2 helpers) on a worker thread so the event loop is never stalled
+
+    At most MAX_CONN calls run at once since each of them may be holding a pooled connection
+    """
+    global _blocking_limiter
+    if _blocking_limiter is None:
+        _blocking_limiter = anyio.CapacityLimiter(MAX_CONN)
+
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=_blocking_limiter)
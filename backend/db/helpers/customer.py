@@ -170,6 +170,30 @@ def get_customer_preferences_by_id(customer_id: int) -> Optional[List[str]]:
 
     return [preference[0] for preference in preferences_raw]
 
+def get_customer_preference_keyword_ids(customer_id: int) -> Optional[List[int]]:
+    """
+    Gets the IDs of the keywords matching the customer's preferences by title
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT k.id FROM customer_likes cl
+                JOIN preferences p ON p.id = cl.preference
+                JOIN keywords k ON k.title = p.title
+                WHERE cl.customer = %(id)s;
+            """, {"id": customer_id})
+            keywords_raw = cur.fetchall()
+        log_green("Finished getting preference keywords for the Customer in Database")
+    except Error as e:
+        log_red(f"Error getting preference keywords for the Customer: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return [keyword[0] for keyword in keywords_raw]
+
 def get_customer_current_password_by_id(customer_id: int) -> Optional[str]:
     """
     Gets the current password that the customer has
@@ -194,16 +218,16 @@ def get_customer_current_password_by_id(customer_id: int) -> Optional[str]:
 
     return None
 
-def get_customer_old_passwords_by_id(customer_id: int) -> Optional[List[str]]:
+def get_customer_old_passwords_by_id(customer_id: int, limit: Optional[int] = None) -> Optional[List[str]]:
     """
-    Gets all the old passwords that the customer has had from most recent to least recent
+    Gets the old passwords that the customer has had from most recent to least recent, at most `limit` of them if given
     """
     try:
         conn = connect()
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT password FROM passwords WHERE customer = %(id)s AND pass_type = 'old' ORDER BY time_created DESC;",
-                {"id": customer_id})
+                "SELECT password FROM passwords WHERE customer = %(id)s AND pass_type = 'old' ORDER BY time_created DESC, id DESC LIMIT %(limit)s;",
+                {"id": customer_id, "limit": limit})
             passwords_raw = cur.fetchall()
 
         log_green("Finished getting old passwords for the Customer in Database")
@@ -494,9 +518,11 @@ def update_customer_phone(customer_id: int, phone_number: str):
     finally:
         disconnect(conn)
 
-def update_customer_password(customer_id: int, password: str, time_created: datetime):
+def update_customer_password(customer_id: int, password: str, time_created: datetime, history_size: Optional[int] = None):
     """
     Updates a customers password
+
+    When history_size is given only that many old passwords are kept, older ones are deleted
     """
     try:
         conn = connect()
@@ -523,6 +549,18 @@ def update_customer_password(customer_id: int, password: str, time_created: date
                     "timez": time_created,
                     "customer": customer_id
                 })
+
+            if history_size is not None:
+                cur.execute(
+                    """
+                    DELETE FROM passwords WHERE id IN (
+                        SELECT id FROM passwords WHERE customer = %(id)s AND pass_type = 'old'
+                        ORDER BY time_created DESC, id DESC OFFSET %(keep)s
+                    );
+                """, {
+                        "id": customer_id,
+                        "keep": history_size
+                    })
         conn.commit()
 
         log_green("Finished updating the password for the Customer in Database")
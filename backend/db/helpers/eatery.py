@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from psycopg2 import Error
 
@@ -6,8 +6,10 @@ from logger import log_red, log_green
 
 from db.helpers import connect, disconnect
 from db.db_types.db_request import EateryCreationRequest, AddressCreationRequest
-from db.db_types.db_response import EateryDetailsResponse
-from db.helpers.address import insert_address, get_address_by_id
+from db.db_types.db_response import AddressDetailsResponse, EateryDetailsResponse, EateryCardDetailsResponse, EateryCardVoucherResponse, \
+    EateryFeaturesResponse, EaterySummaryResponse, RatingDetailsResponse
+from db.helpers.address import insert_address
+from db.helpers.search_index import add_search_terms, remove_search_terms, replace_search_terms, index_eatery_name, index_eatery_postcode
 
 def insert_eatery(eatery: EateryCreationRequest) -> Optional[int]:
     """
@@ -48,6 +50,9 @@ def insert_eatery(eatery: EateryCreationRequest) -> Optional[int]:
 
         conn.commit()
 
+        index_eatery_name(eatery_id, eatery.business_name)
+        index_eatery_postcode(eatery_id, eatery.address.postcode)
+
         update_eatery_password(eatery_id, eatery.password, eatery.date_joined)
 
         if eatery.description:
@@ -102,6 +107,8 @@ def add_eatery_keywords(eatery_id: int, keywords: List[str]):
         finally:
             disconnect(conn)
 
+    add_search_terms(eatery_id, "keyword", keywords)
+
 def get_all_eateries() -> Optional[List[int]]:
     """
     Fetches all eateries
@@ -121,55 +128,315 @@ def get_all_eateries() -> Optional[List[int]]:
 
     return [eatery[0] for eatery in all_eateries]
 
+# The address columns every projection that includes an address selects, in the order address_from_row reads them
+ADDRESS_COLUMNS = "a.unit_number, a.house_number, a.street_addr, a.city, a.state, a.country, a.postcode, a.longitude, a.latitude, a.formatted_str"
+
+def address_from_row(row: Tuple) -> AddressDetailsResponse:
+    """
+    Builds an address from the ADDRESS_COLUMNS of a row
+    """
+    unit_number, house_number, street_addr, city, state, country, postcode, long, lat, formatted = row
+
+    return AddressDetailsResponse(
+        unit_number=unit_number,
+        house_number=house_number,
+        street_addr=street_addr,
+        city=city,
+        state=state,
+        country=country,
+        postcode=postcode,
+        longitude=long,
+        latitude=lat,
+        formatted_str=formatted
+    )
+
 def get_eatery_by_id(eatery_id: int) -> Optional[EateryDetailsResponse]:
     """
     Fetches eatery's private details from DB given eatery ID
     """
+    return get_eateries_by_ids([eatery_id]).get(eatery_id)
+
+def get_eateries_by_ids(eatery_ids: List[int]) -> Dict[int, EateryDetailsResponse]:
+    """
+    Fetches the full details of many eateries in one query, keyed by ID
+
+    Only needed for an eatery's own pages and profile edits, prefer a smaller projection elsewhere
+    """
     try:
         conn = connect()
         with conn.cursor() as cur:
-            cur.execute("SELECT eatery_name FROM eateries WHERE id = %(id)s;",
-                        {"id": eatery_id})
-            name = cur.fetchone()
+            cur.execute(
+                f"""
+                SELECT e.id, e.eatery_name, ed.email, ed.phone_number, ed.abn, ed.manager, ed.date_joined, ed.description,
+                    ed.thumbnail, ed.thumbnail_card, ed.thumbnail_detail, ed.menu, {ADDRESS_COLUMNS}
+                FROM eateries e
+                JOIN eatery_details ed ON ed.eatery = e.id
+                JOIN addresses a ON a.id = ed.address
+                WHERE e.id = ANY(%(ids)s);
+            """, {"ids": eatery_ids})
+            eateries_raw = cur.fetchall()
+
+        log_green("Finished getting information for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error displaying Eateries\' information: {e}")
+        raise e
+    finally:
+        disconnect(conn)
 
-            if name is None:
-                return None
+    eateries: Dict[int, EateryDetailsResponse] = {}
+    for row in eateries_raw:
+        eatery_id, name, email, phone, abn, manager_name, date_joined, description, thumbnail, thumbnail_card, thumbnail_detail, menu = row[:12]
+        manager_name = manager_name.strip("()")
+
+        eateries[eatery_id] = EateryDetailsResponse(
+            business_name=name,
+            email=email,
+            phone=phone,
+            manager_first_name=manager_name.split(",")[1],
+            manager_last_name=manager_name.split(",")[0],
+            abn=abn,
+            date_joined=date_joined,
+            address=address_from_row(row[12:]),
+            description=description if description else "",
+            thumbnail=thumbnail,
+            thumbnail_card=thumbnail_card,
+            thumbnail_detail=thumbnail_detail,
+            menu=menu
+        )
+
+    return eateries
+
+def get_eatery_summary_by_id(eatery_id: int) -> Optional[EaterySummaryResponse]:
+    """
+    Fetches just the name, card thumbnail and join date of an eatery
+    """
+    return get_eatery_summaries_by_ids([eatery_id]).get(eatery_id)
 
+def get_eatery_summaries_by_ids(eatery_ids: List[int]) -> Dict[int, EaterySummaryResponse]:
+    """
+    Fetches the name, card thumbnail and join date of many eateries in one query, keyed by ID
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
             cur.execute(
-                "SELECT email, phone_number, abn, manager, date_joined, address, description, thumbnail, menu FROM eatery_details WHERE eatery = %(id)s;",
-                {"id": eatery_id})
-            res = cur.fetchone()
+                """
+                SELECT e.id, e.eatery_name, COALESCE(ed.thumbnail_card, ed.thumbnail), ed.date_joined
+                FROM eateries e
+                JOIN eatery_details ed ON ed.eatery = e.id
+                WHERE e.id = ANY(%(ids)s);
+            """, {"ids": eatery_ids})
+            summaries_raw = cur.fetchall()
+
+        log_green("Finished getting summaries for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting summaries for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
 
-            if res is None:
-                return None
+    return {
+        eatery_id: EaterySummaryResponse(
+            business_name=name,
+            thumbnail=thumbnail,
+            date_joined=date_joined
+        ) for eatery_id, name, thumbnail, date_joined in summaries_raw
+    }
 
-            email, phone, abn, manager_name, date_joined, address_id, description, thumbnail, menu = res
-            manager_name = manager_name.strip("()")
+def get_eatery_location_by_id(eatery_id: int) -> Optional[Tuple[float, float]]:
+    """
+    Fetches just the (latitude, longitude) of an eatery
+    """
+    return get_eatery_locations_by_ids([eatery_id]).get(eatery_id)
 
-        log_green("Finished getting information for the specified Eatery in Database")
+def get_eatery_locations_by_ids(eatery_ids: List[int]) -> Dict[int, Tuple[float, float]]:
+    """
+    Fetches the (latitude, longitude) of many eateries in one query, keyed by ID
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT ed.eatery, a.latitude, a.longitude
+                FROM eatery_details ed
+                JOIN addresses a ON a.id = ed.address
+                WHERE ed.eatery = ANY(%(ids)s);
+            """, {"ids": eatery_ids})
+            locations_raw = cur.fetchall()
+
+        log_green("Finished getting locations for the specified Eateries in Database")
     except Error as e:
-        log_red(f"Error displaying Eatery\'s information: {e}")
+        log_red(f"Error getting locations for Eateries: {e}")
         raise e
     finally:
         disconnect(conn)
 
-    address = get_address_by_id(address_id)
-    if address is None:
-        return None
+    return {eatery_id: (lat, lon) for eatery_id, lat, lon in locations_raw}
 
-    return EateryDetailsResponse(
-        business_name=name[0],
-        email=email,
-        phone=phone,
-        manager_first_name=manager_name.split(",")[1],
-        manager_last_name=manager_name.split(",")[0],
-        abn=abn,
-        date_joined=date_joined,
-        address=address,
-        description=description if description else "",
-        thumbnail=thumbnail,
-        menu=menu
-    )
+def get_eatery_address_by_id(eatery_id: int) -> Optional[AddressDetailsResponse]:
+    """
+    Fetches just the address of an eatery
+    """
+    return get_eatery_addresses_by_ids([eatery_id]).get(eatery_id)
+
+def get_eatery_addresses_by_ids(eatery_ids: List[int]) -> Dict[int, AddressDetailsResponse]:
+    """
+    Fetches the addresses of many eateries in one query, keyed by ID
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT ed.eatery, {ADDRESS_COLUMNS}
+                FROM eatery_details ed
+                JOIN addresses a ON a.id = ed.address
+                WHERE ed.eatery = ANY(%(ids)s);
+            """, {"ids": eatery_ids})
+            addresses_raw = cur.fetchall()
+
+        log_green("Finished getting addresses for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting addresses for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {row[0]: address_from_row(row[1:]) for row in addresses_raw}
+
+def get_eatery_cards_by_ids(eatery_ids: List[int]) -> Optional[Dict[int, EateryCardDetailsResponse]]:
+    """
+    Fetches the homepage card details (name, thumbnail, active vouchers and ratings) for many eateries at once
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                    SELECT e.id, e.eatery_name, COALESCE(ed.thumbnail_card, ed.thumbnail), ed.date_joined,
+                        COALESCE(er.review_count, 0), COALESCE(er.rating_total, 0)
+                    FROM eateries e
+                    JOIN eatery_details ed ON ed.eatery = e.id
+                    LEFT JOIN eatery_ratings er ON er.eatery = e.id
+                    WHERE e.id = ANY(%(ids)s);
+                """,
+                {"ids": eatery_ids})
+            eateries_raw = cur.fetchall()
+
+            cur.execute(
+                """
+                    SELECT vt.eatery, v.id, vt.title, v.expiry_date, COALESCE(SUM(vc.total), 0),
+                        COALESCE(SUM(vc.unclaimed), 0),
+                        COALESCE(vtr.review_count, 0), COALESCE(vtr.rating_total, 0)
+                    FROM voucher_templates vt
+                    JOIN vouchers v ON v.voucher_template = vt.id
+                    LEFT JOIN voucher_counts vc ON vc.voucher = v.id
+                    LEFT JOIN voucher_template_ratings vtr ON vtr.voucher_template = vt.id
+                    WHERE vt.eatery = ANY(%(ids)s) AND vt.is_deleted = FALSE
+                    GROUP BY vt.eatery, vt.id, v.id, vtr.review_count, vtr.rating_total
+                    ORDER BY vt.id, v.id;
+                """,
+                {"ids": eatery_ids})
+            vouchers_raw = cur.fetchall()
+
+        log_green("Finished getting card details for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting card details for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    eatery_vouchers: Dict[int, List[EateryCardVoucherResponse]] = {}
+    for eatery_id, voucher_id, name, expiry, total, unclaimed, review_count, rating_total in vouchers_raw:
+        eatery_vouchers.setdefault(eatery_id, []).append(EateryCardVoucherResponse(
+            voucher_id=voucher_id,
+            name=name,
+            expiry=expiry,
+            total=total,
+            unclaimed=unclaimed,
+            rating=RatingDetailsResponse(review_count=review_count, rating_total=rating_total)
+        ))
+
+    cards: Dict[int, EateryCardDetailsResponse] = {}
+    for eatery_id, name, thumbnail, date_joined, review_count, rating_total in eateries_raw:
+        cards[eatery_id] = EateryCardDetailsResponse(
+            business_name=name,
+            thumbnail=thumbnail,
+            date_joined=date_joined,
+            rating=RatingDetailsResponse(review_count=review_count, rating_total=rating_total),
+            vouchers=eatery_vouchers.get(eatery_id, [])
+        )
+
+    return cards
+
+def get_eatery_features_by_ids(eatery_ids: List[int]) -> Dict[int, EateryFeaturesResponse]:
+    """
+    Fetches the precomputed recommendation features of many eateries in one query, keyed by ID
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT eatery, latitude, longitude, date_joined, active_vouchers, review_count, rating_total, keyword_ids
+                FROM eatery_features
+                WHERE eatery = ANY(%(ids)s);
+            """, {"ids": eatery_ids})
+            features_raw = cur.fetchall()
+
+        log_green("Finished getting features for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting features for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {
+        eatery_id: EateryFeaturesResponse(
+            latitude=latitude,
+            longitude=longitude,
+            date_joined=date_joined,
+            active_vouchers=active_vouchers,
+            rating=RatingDetailsResponse(review_count=review_count, rating_total=rating_total),
+            keyword_ids=keyword_ids
+        ) for eatery_id, latitude, longitude, date_joined, active_vouchers, review_count, rating_total, keyword_ids in features_raw
+    }
+
+def get_eatery_locations_in_box(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> Dict[int, Tuple[float, float]]:
+    """
+    Gets the (latitude, longitude) of every eatery inside a bounding box
+
+    A box with min_lon greater than max_lon wraps around the antimeridian
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT ed.eatery, a.latitude, a.longitude FROM addresses a
+                JOIN eatery_details ed ON ed.address = a.id
+                WHERE a.latitude BETWEEN %(min_lat)s AND %(max_lat)s
+                AND CASE WHEN %(min_lon)s <= %(max_lon)s
+                    THEN a.longitude BETWEEN %(min_lon)s AND %(max_lon)s
+                    ELSE a.longitude >= %(min_lon)s OR a.longitude <= %(max_lon)s
+                END;
+            """, {
+                    "min_lat": min_lat,
+                    "max_lat": max_lat,
+                    "min_lon": min_lon,
+                    "max_lon": max_lon
+                })
+            locations_raw = cur.fetchall()
+
+        log_green("Finished getting Eatery locations in the bounding box from Database")
+    except Error as e:
+        log_red(f"Error getting Eatery locations in the bounding box: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {eatery_id: (lat, lon) for eatery_id, lat, lon in locations_raw}
 
 def get_eatery_keywords_by_id(eatery_id: int) -> Optional[List[str]]:
     """
@@ -192,6 +459,31 @@ def get_eatery_keywords_by_id(eatery_id: int) -> Optional[List[str]]:
 
     return [keyword[0] for keyword in keywords_raw]
 
+def get_eatery_keywords_by_ids(eatery_ids: List[int]) -> Optional[Dict[int, List[str]]]:
+    """
+    Gets all keywords for many eateries in one query, keyed by ID
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT ea.eatery, k.title FROM keywords k JOIN eatery_atoms ea ON k.id = ea.keyword WHERE ea.eatery = ANY(%(ids)s);",
+                {"ids": eatery_ids})
+            keywords_raw = cur.fetchall()
+
+        log_green("Finished getting keywords for the specified Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting keywords for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    keywords: Dict[int, List[str]] = {eatery_id: [] for eatery_id in eatery_ids}
+    for eatery_id, title in keywords_raw:
+        keywords[eatery_id].append(title)
+
+    return keywords
+
 def get_eatery_current_password_by_id(eatery_id: int) -> Optional[str]:
     """
     Gets the current password that the eatery has
@@ -216,16 +508,16 @@ def get_eatery_current_password_by_id(eatery_id: int) -> Optional[str]:
 
     return None
 
-def get_eatery_old_passwords_by_id(eatery_id: int) -> Optional[List[str]]:
+def get_eatery_old_passwords_by_id(eatery_id: int, limit: Optional[int] = None) -> Optional[List[str]]:
     """
-    Gets all the old passwords that the eatery has had from most recent to least recent
+    Gets the old passwords that the eatery has had from most recent to least recent, at most `limit` of them if given
     """
     try:
         conn = connect()
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT password FROM passwords WHERE eatery = %(id)s AND pass_type = 'old' ORDER BY time_created DESC;",
-                {"id": eatery_id})
+                "SELECT password FROM passwords WHERE eatery = %(id)s AND pass_type = 'old' ORDER BY time_created DESC, id DESC LIMIT %(limit)s;",
+                {"id": eatery_id, "limit": limit})
             passwords_raw = cur.fetchall()
 
         log_green("Finished getting old passwords for the Customer in Database")
@@ -404,6 +696,8 @@ def delete_eatery_keywords(eatery_id: int, keywords: List[str]):
         finally:
             disconnect(conn)
 
+    remove_search_terms(eatery_id, "keyword", keywords)
+
 def delete_all_eatery_keywords(eatery_id: int):
     """
     Delete all keywords from an eatery
@@ -424,6 +718,8 @@ def delete_all_eatery_keywords(eatery_id: int):
     finally:
         disconnect(conn)
 
+    replace_search_terms(eatery_id, "keyword", [])
+
 def update_eatery_name(eatery_id: int, eatery_name: str):
     """
     Updates an eatery's name
@@ -447,6 +743,8 @@ def update_eatery_name(eatery_id: int, eatery_name: str):
     finally:
         disconnect(conn)
 
+    index_eatery_name(eatery_id, eatery_name)
+
 def update_eatery_email(eatery_id: int, email: str):
     """
     Updates a eatery's email
@@ -517,9 +815,11 @@ def update_eatery_manager_name(eatery_id: int, first_name: str, last_name: str):
     finally:
         disconnect(conn)
 
-def update_eatery_password(eatery_id: int, password: str, time_created: datetime):
+def update_eatery_password(eatery_id: int, password: str, time_created: datetime, history_size: Optional[int] = None):
     """
     Updates an eatery's password
+
+    When history_size is given only that many old passwords are kept, older ones are deleted
     """
     try:
         conn = connect()
@@ -546,6 +846,18 @@ def update_eatery_password(eatery_id: int, password: str, time_created: datetime
                     "timez": time_created,
                     "eatery": eatery_id
                 })
+
+            if history_size is not None:
+                cur.execute(
+                    """
+                    DELETE FROM passwords WHERE id IN (
+                        SELECT id FROM passwords WHERE eatery = %(id)s AND pass_type = 'old'
+                        ORDER BY time_created DESC, id DESC OFFSET %(keep)s
+                    );
+                """, {
+                        "id": eatery_id,
+                        "keep": history_size
+                    })
         conn.commit()
 
         log_green("Finished updating the password for the Eatery in Database")
@@ -599,17 +911,23 @@ def update_eatery_description(eatery_id: int, description: str):
     finally:
         disconnect(conn)
 
-def update_eatery_thumbnail(eatery_id: int, thumbnail: str):
+def update_eatery_thumbnail(eatery_id: int, thumbnail: str, renditions_pending: bool = False):
     """
-    Updates an eatery's thumbnail
+    Updates an eatery's thumbnail, dropping the renditions of the old one
+
+    renditions_pending marks the new thumbnail for the rendition worker
     """
     try:
         conn = connect()
         with conn.cursor() as cur:
             cur.execute(
-                "UPDATE eatery_details SET thumbnail = %(thumbnail)s WHERE eatery = %(id)s;",
-                {
+                """
+                UPDATE eatery_details
+                SET thumbnail = %(thumbnail)s, thumbnail_card = NULL, thumbnail_detail = NULL, renditions_pending = %(pending)s
+                WHERE eatery = %(id)s;
+            """, {
                     "thumbnail": thumbnail,
+                    "pending": renditions_pending,
                     "id": eatery_id
                 })
         conn.commit()
@@ -622,6 +940,74 @@ def update_eatery_thumbnail(eatery_id: int, thumbnail: str):
     finally:
         disconnect(conn)
 
+def get_pending_thumbnail_renditions(limit: int) -> Dict[int, str]:
+    """
+    Fetches up to limit thumbnails still waiting to be rendered, keyed by eatery
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT eatery, thumbnail FROM eatery_details WHERE renditions_pending ORDER BY eatery LIMIT %(limit)s;",
+                {"limit": limit})
+            pending_raw = cur.fetchall()
+
+        log_green("Finished getting pending Thumbnail Renditions in Database")
+    except Error as e:
+        log_red(f"Error getting pending Thumbnail Renditions: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return dict(pending_raw)
+
+def update_eatery_thumbnail_renditions(eatery_id: int, thumbnail: str, thumbnail_card: Optional[str], thumbnail_detail: Optional[str]):
+    """
+    Saves the renditions of an eatery's thumbnail, unless the thumbnail has changed since they were rendered
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE eatery_details
+                SET thumbnail_card = %(card)s, thumbnail_detail = %(detail)s, renditions_pending = FALSE
+                WHERE eatery = %(id)s AND thumbnail = %(thumbnail)s;
+            """, {
+                    "card": thumbnail_card,
+                    "detail": thumbnail_detail,
+                    "id": eatery_id,
+                    "thumbnail": thumbnail
+                })
+        conn.commit()
+
+        log_green("Finished updating the Thumbnail Renditions for the Eatery in Database")
+    except Error as e:
+        log_red(f"Error updating the Thumbnail Renditions for the Eatery: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def get_eateries_with_inline_media() -> List[int]:
+    """
+    Fetches the eateries whose thumbnail or menu is still stored in the database as a data URL
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute("SELECT eatery FROM eatery_details WHERE thumbnail LIKE 'data:%' OR menu LIKE 'data:%' ORDER BY eatery;")
+            eateries_raw = cur.fetchall()
+
+        log_green("Finished getting Eateries with inline media in Database")
+    except Error as e:
+        log_red(f"Error getting Eateries with inline media: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return [eatery[0] for eatery in eateries_raw]
+
 def update_eatery_menu(eatery_id: int, menu: str):
     """
     Updates an eatery's menu
@@ -673,6 +1059,8 @@ def update_eatery_address(eatery_id: int, address: AddressCreationRequest):
     finally:
         disconnect(conn)
 
+    index_eatery_postcode(eatery_id, address.postcode)
+
 def get_all_blocked_customers(eatery_id: int) -> Optional[List[int]]:
     """
     Gets all blocked customers for an Eatery
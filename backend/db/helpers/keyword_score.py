@@ -0,0 +1,70 @@
+from typing import Dict, List
+from datetime import datetime
+from psycopg2 import Error
+
+from logger import log_red, log_green
+
+from db.helpers import connect, disconnect
+
+def get_keyword_scores(prompt_word: str, keywords: List[str], model: str, scored_after: datetime) -> Dict[str, int]:
+    """
+    Gets the stored scores of keywords against a prompt word for a model, ignoring any scored before the cutoff
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT keyword, score FROM keyword_scores
+                WHERE prompt_word = %(prompt_word)s AND keyword = ANY(%(keywords)s) AND model = %(model)s AND scored_at > %(after)s;
+            """, {
+                    "prompt_word": prompt_word,
+                    "keywords": keywords,
+                    "model": model,
+                    "after": scored_after
+                })
+            scores_raw = cur.fetchall()
+
+        log_green(f"Finished getting keyword scores for \"{prompt_word}\" in Database")
+    except Error as e:
+        log_red(f"Error getting keyword scores for \"{prompt_word}\": {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return dict(scores_raw)
+
+def upsert_keyword_scores(prompt_word: str, scores: Dict[str, int], model: str, scored_at: datetime):
+    """
+    Stores the scores of keywords against a prompt word for a model, replacing any older scores
+    """
+    if not scores:
+        return
+
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO keyword_scores (keyword, prompt_word, model, score, scored_at)
+                SELECT keyword, %(prompt_word)s, %(model)s, score, %(scored_at)s
+                FROM UNNEST(%(keywords)s::VARCHAR[], %(scores)s::INTEGER[]) AS s (keyword, score)
+                ON CONFLICT (keyword, prompt_word, model) DO UPDATE
+                SET score = EXCLUDED.score, scored_at = EXCLUDED.scored_at;
+            """, {
+                    "prompt_word": prompt_word,
+                    "model": model,
+                    "scored_at": scored_at,
+                    # Sorted so concurrent writers lock rows in the same order
+                    "keywords": sorted(scores),
+                    "scores": [scores[keyword] for keyword in sorted(scores)]
+                })
+        conn.commit()
+
+        log_green(f"Finished storing keyword scores for \"{prompt_word}\" in Database")
+    except Error as e:
+        log_red(f"Error storing keyword scores for \"{prompt_word}\": {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
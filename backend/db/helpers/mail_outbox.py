@@ -0,0 +1,182 @@
+from datetime import datetime
+from typing import List, Optional
+from psycopg2 import Error
+
+from logger import log_red, log_green
+
+from db.helpers import connect, disconnect
+from db.db_types.db_request import MailCreationRequest
+from db.db_types.db_response import MailDetailsResponse
+
+def enqueue_mail(mail: MailCreationRequest) -> Optional[int]:
+    """
+    Queues an email to be sent, returns None if an email with the same dedupe key is already queued
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO mail_outbox (dedupe_key, to_email, to_name, subject, text, html_text)
+                VALUES (%(dedupe_key)s, %(to_email)s, %(to_name)s, %(subject)s, %(text)s, %(html_text)s)
+                ON CONFLICT (dedupe_key) DO NOTHING
+                RETURNING id;
+            """, {
+                    "dedupe_key": mail.dedupe_key,
+                    "to_email": mail.to_email,
+                    "to_name": mail.to_name,
+                    "subject": mail.subject,
+                    "text": mail.text,
+                    "html_text": mail.html_text
+                })
+            mail_id = cur.fetchone()
+        conn.commit()
+
+        log_green("Finished queueing the Email in Database")
+    except Error as e:
+        log_red(f"Error queueing Email: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+    if mail_id:
+        return mail_id[0]
+
+    return None
+
+def claim_mail_batch(limit: int, max_attempts: int, lease_until: datetime) -> List[MailDetailsResponse]:
+    """
+    Takes up to `limit` emails that are due to be sent, leasing them until the given time so no other worker sends them
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE mail_outbox SET next_attempt = %(lease_until)s
+                WHERE id IN (
+                    SELECT id FROM mail_outbox
+                    WHERE sent_at IS NULL AND next_attempt <= NOW() AND attempts < %(max_attempts)s
+                    ORDER BY next_attempt
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, to_email, to_name, subject, text, html_text, attempts;
+            """, {
+                    "lease_until": lease_until,
+                    "max_attempts": max_attempts,
+                    "limit": limit
+                })
+            mail_raw = cur.fetchall()
+        conn.commit()
+
+        log_green("Finished claiming a batch of Emails in Database")
+    except Error as e:
+        log_red(f"Error claiming a batch of Emails: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+    return [
+        MailDetailsResponse(
+            id=mail_id,
+            to_email=to_email,
+            to_name=to_name,
+            subject=subject,
+            text=text,
+            html_text=html_text,
+            attempts=attempts
+        ) for mail_id, to_email, to_name, subject, text, html_text, attempts in sorted(mail_raw)
+    ]
+
+def extend_mail_lease(mail_ids: List[int], lease_until: datetime):
+    """
+    Pushes back the lease on claimed emails that haven't been sent yet, so a slow batch isn't claimed again by another worker
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE mail_outbox SET next_attempt = %(lease_until)s WHERE id = ANY(%(ids)s) AND sent_at IS NULL;",
+                {
+                    "ids": mail_ids,
+                    "lease_until": lease_until
+                })
+        conn.commit()
+
+        log_green("Finished extending the lease on Emails in Database")
+    except Error as e:
+        log_red(f"Error extending the lease on Emails: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def mark_mail_sent(mail_ids: List[int]):
+    """
+    Marks emails as sent so they are never sent again
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE mail_outbox SET sent_at = NOW(), attempts = attempts + 1 WHERE id = ANY(%(ids)s);",
+                {"ids": mail_ids})
+        conn.commit()
+
+        log_green("Finished marking Emails as sent in Database")
+    except Error as e:
+        log_red(f"Error marking Emails as sent: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def mark_mail_failed(mail_id: int, error: str, next_attempt: datetime):
+    """
+    Records a failed send of an email and when it should next be tried
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE mail_outbox SET attempts = attempts + 1, last_error = %(error)s, next_attempt = %(next_attempt)s
+                WHERE id = %(id)s;
+            """, {
+                    "id": mail_id,
+                    "error": error,
+                    "next_attempt": next_attempt
+                })
+        conn.commit()
+
+        log_green("Finished recording a failed Email in Database")
+    except Error as e:
+        log_red(f"Error recording a failed Email: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def count_pending_mail(max_attempts: int) -> int:
+    """
+    Counts the emails still waiting to be sent
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT COUNT(*) FROM mail_outbox WHERE sent_at IS NULL AND attempts < %(max_attempts)s;",
+                {"max_attempts": max_attempts})
+            count = cur.fetchone()
+
+        log_green("Finished counting pending Emails in Database")
+    except Error as e:
+        log_red(f"Error counting pending Emails: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return count[0] if count else 0
@@ -1,11 +1,11 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from psycopg2 import Error
 
 from logger import log_red, log_green
 
 from db.helpers import connect, disconnect
 from db.db_types.db_request import ReviewCreationRequest
-from db.db_types.db_response import ReviewDetailsResponse
+from db.db_types.db_response import ReviewDetailsResponse, RatingDetailsResponse
 
 def create_review(review: ReviewCreationRequest) -> Optional[int]:
     """
@@ -31,6 +31,36 @@ def create_review(review: ReviewCreationRequest) -> Optional[int]:
             if review_id is None:
                 return None
 
+            # Keep the rating aggregates in step with the reviews table
+            cur.execute(
+                """
+                INSERT INTO voucher_template_ratings (voucher_template, review_count, rating_total)
+                SELECT v.voucher_template, 1, %(rating)s FROM voucher_instances vi
+                JOIN vouchers v ON vi.voucher = v.id
+                WHERE vi.id = %(instance)s
+                ON CONFLICT (voucher_template) DO UPDATE
+                SET review_count = voucher_template_ratings.review_count + 1,
+                    rating_total = voucher_template_ratings.rating_total + EXCLUDED.rating_total;
+            """, {
+                    "rating": review.rating,
+                    "instance": review.voucher_instance
+                })
+
+            cur.execute(
+                """
+                INSERT INTO eatery_ratings (eatery, review_count, rating_total)
+                SELECT vt.eatery, 1, %(rating)s FROM voucher_instances vi
+                JOIN vouchers v ON vi.voucher = v.id
+                JOIN voucher_templates vt ON v.voucher_template = vt.id
+                WHERE vi.id = %(instance)s
+                ON CONFLICT (eatery) DO UPDATE
+                SET review_count = eatery_ratings.review_count + 1,
+                    rating_total = eatery_ratings.rating_total + EXCLUDED.rating_total;
+            """, {
+                    "rating": review.rating,
+                    "instance": review.voucher_instance
+                })
+
         conn.commit()
 
         log_green("Finished inserting the Review in Database")
@@ -189,3 +219,52 @@ def get_reviews_by_eatery(eatery_id: int) -> Optional[List[int]]:
         disconnect(conn)
 
     return [review_id[0] for review_id in review_ids]
+
+def get_eatery_ratings_by_ids(eatery_ids: List[int]) -> Optional[Dict[int, RatingDetailsResponse]]:
+    """
+    Fetches the rating aggregates for many eateries at once, eateries without reviews have a zero count
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT eatery, review_count, rating_total FROM eatery_ratings WHERE eatery = ANY(%(ids)s);",
+                {"ids": eatery_ids})
+            ratings_raw = cur.fetchall()
+
+        log_green("Finished getting rating aggregates for Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting rating aggregates for Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    ratings = {eatery_id: RatingDetailsResponse(review_count=0, rating_total=0) for eatery_id in eatery_ids}
+    for eatery_id, review_count, rating_total in ratings_raw:
+        ratings[eatery_id] = RatingDetailsResponse(review_count=review_count, rating_total=rating_total)
+
+    return ratings
+
+def get_voucher_template_rating_by_id(voucher_template_id: int) -> Optional[RatingDetailsResponse]:
+    """
+    Fetches the rating aggregate for a voucher template
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT review_count, rating_total FROM voucher_template_ratings WHERE voucher_template = %(id)s;",
+                {"id": voucher_template_id})
+            rating = cur.fetchone()
+
+        log_green("Finished getting rating aggregate for Voucher Template in Database")
+    except Error as e:
+        log_red(f"Error getting rating aggregate for Voucher Template: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    if rating is None:
+        return RatingDetailsResponse(review_count=0, rating_total=0)
+
+    return RatingDetailsResponse(review_count=rating[0], rating_total=rating[1])
@@ -0,0 +1,227 @@
+import re
+from typing import Dict, List, Set
+from psycopg2 import Error
+
+from logger import log_red, log_green
+
+from db.helpers import connect, disconnect
+from db.db_types.db_response import EaterySearchDocumentResponse
+
+# Terms from these sources must match a prompt word exactly, name tokens may be matched by prefix
+EXACT_SOURCES = ["keyword", "postcode", "title"]
+
+def normalise_term(term: str) -> str:
+    """
+    Normalises a term so that lookups are case and whitespace insensitive
+    """
+    return term.strip().lower()
+
+def eatery_name_terms(eatery_name: str) -> Set[str]:
+    """
+    Gets the name tokens for an eatery, including the full name with whitespace removed
+    """
+    terms = {normalise_term(word) for word in eatery_name.split()}
+    terms.add(normalise_term(re.sub(r'\s*', '', eatery_name)))
+    terms.discard("")
+
+    return terms
+
+def add_search_terms(eatery_id: int, source: str, terms: List[str]):
+    """
+    Adds terms from the given source to an eatery's search index entries
+    """
+    terms = list({normalise_term(term) for term in terms} - {""})
+    if not terms:
+        return
+
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO eatery_search_terms (term, eatery, source)
+                SELECT term, %(eatery)s, %(source)s FROM UNNEST(%(terms)s::VARCHAR[]) AS term
+                ON CONFLICT DO NOTHING;
+            """, {
+                    "eatery": eatery_id,
+                    "source": source,
+                    "terms": terms
+                })
+        conn.commit()
+
+        log_green(f"Finished indexing {source} terms for the Eatery in Database")
+    except Error as e:
+        log_red(f"Error indexing {source} terms for the Eatery: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def remove_search_terms(eatery_id: int, source: str, terms: List[str]):
+    """
+    Removes terms from the given source from an eatery's search index entries
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM eatery_search_terms WHERE eatery = %(eatery)s AND source = %(source)s AND term = ANY(%(terms)s);",
+                {
+                    "eatery": eatery_id,
+                    "source": source,
+                    "terms": [normalise_term(term) for term in terms]
+                })
+        conn.commit()
+
+        log_green(f"Finished removing {source} terms for the Eatery from Database")
+    except Error as e:
+        log_red(f"Error removing {source} terms for the Eatery: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def replace_search_terms(eatery_id: int, source: str, terms: List[str]):
+    """
+    Replaces all of an eatery's search index entries from the given source
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM eatery_search_terms WHERE eatery = %(eatery)s AND source = %(source)s;",
+                {
+                    "eatery": eatery_id,
+                    "source": source
+                })
+        conn.commit()
+    except Error as e:
+        log_red(f"Error clearing {source} terms for the Eatery: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+    add_search_terms(eatery_id, source, terms)
+
+def index_eatery_name(eatery_id: int, eatery_name: str):
+    """
+    Indexes an eatery's name tokens and full name
+    """
+    replace_search_terms(eatery_id, "name", list(eatery_name_terms(eatery_name)))
+    replace_search_terms(eatery_id, "title", [eatery_name])
+
+def index_eatery_postcode(eatery_id: int, postcode: str):
+    """
+    Indexes an eatery's postcode
+    """
+    replace_search_terms(eatery_id, "postcode", [postcode])
+
+def search_eatery_ids(prompt_words: List[str]) -> List[int]:
+    """
+    Gets the eateries whose keywords, postcode or full name match a prompt word, or whose name has a token starting with one
+    """
+    terms = list({normalise_term(word) for word in prompt_words} - {""})
+    if not terms:
+        return []
+
+    # Prompt words are matched literally so escape anything LIKE would treat as a wildcard
+    prefixes = [re.sub(r'([\\%_])', r'\\\1', term) + "%" for term in terms]
+
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT eatery FROM eatery_search_terms WHERE source = ANY(%(exact_sources)s) AND term = ANY(%(terms)s)
+                UNION
+                SELECT eatery FROM eatery_search_terms WHERE source = 'name' AND term LIKE ANY(%(prefixes)s)
+                ORDER BY eatery;
+            """, {
+                    "exact_sources": EXACT_SOURCES,
+                    "terms": terms,
+                    "prefixes": prefixes
+                })
+            eateries_raw = cur.fetchall()
+
+        log_green("Finished searching the Eatery index in Database")
+    except Error as e:
+        log_red(f"Error searching the Eatery index: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return [eatery[0] for eatery in eateries_raw]
+
+def rebuild_search_index():
+    """
+    Rebuilds the whole search index from the eateries, their keywords and their addresses
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM eatery_search_terms;")
+            cur.execute(
+                r"""
+                INSERT INTO eatery_search_terms (term, eatery, source)
+                SELECT DISTINCT term, eatery, source FROM (
+                    SELECT LOWER(TRIM(k.title)) AS term, ea.eatery, 'keyword' AS source
+                    FROM eatery_atoms ea JOIN keywords k ON k.id = ea.keyword
+                    UNION ALL
+                    SELECT LOWER(TRIM(a.postcode)), ed.eatery, 'postcode'
+                    FROM eatery_details ed JOIN addresses a ON a.id = ed.address
+                    UNION ALL
+                    SELECT LOWER(TRIM(e.eatery_name)), e.id, 'title' FROM eateries e
+                    UNION ALL
+                    SELECT LOWER(REGEXP_REPLACE(e.eatery_name, '\s', '', 'g')), e.id, 'name' FROM eateries e
+                    UNION ALL
+                    SELECT LOWER(word), e.id, 'name' FROM eateries e, REGEXP_SPLIT_TO_TABLE(e.eatery_name, '\s+') AS word
+                ) terms
+                WHERE term <> '';
+            """)
+        conn.commit()
+
+        log_green("Finished rebuilding the Eatery search index in Database")
+    except Error as e:
+        log_red(f"Error rebuilding the Eatery search index: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def get_eatery_search_documents() -> Dict[int, EaterySearchDocumentResponse]:
+    """
+    Gets the name, description, postcode and keywords of every eatery in one query
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT e.id, e.eatery_name, COALESCE(ed.description, ''), a.postcode,
+                       COALESCE(ARRAY_AGG(k.title) FILTER (WHERE k.title IS NOT NULL), '{}')
+                FROM eateries e
+                JOIN eatery_details ed ON ed.eatery = e.id
+                JOIN addresses a ON a.id = ed.address
+                LEFT JOIN eatery_atoms ea ON ea.eatery = e.id
+                LEFT JOIN keywords k ON k.id = ea.keyword
+                GROUP BY e.id, e.eatery_name, ed.description, a.postcode
+                ORDER BY e.id;
+            """)
+            documents_raw = cur.fetchall()
+
+        log_green("Finished getting search documents for all Eateries in Database")
+    except Error as e:
+        log_red(f"Error getting search documents for all Eateries: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {
+        eatery_id: EaterySearchDocumentResponse(
+            business_name=name,
+            description=description,
+            postcode=postcode,
+            keywords=keywords
+        ) for eatery_id, name, description, postcode, keywords in documents_raw
+    }
@@ -1,12 +1,27 @@
-from typing import List, Literal, Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Literal, Optional, Tuple
 from datetime import datetime
 from psycopg2 import Error
 
 from logger import log_red, log_green
 
-from db.helpers import connect, disconnect
+import metrics
+from db.helpers import connect, disconnect, on_commit
 from db.db_types.db_request import SessionCreationRequest
-from db.db_types.db_response import SessionDetailsResponse
+from db.db_types.db_response import SessionDetailsResponse, SessionUserResponse
+
+# How long a session's user is trusted from memory before the session is looked up again
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL_SECONDS", "30"))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+
+cache_hits = metrics.counter("session_cache_hits", "Session lookups answered from memory")
+cache_misses = metrics.counter("session_cache_misses", "Session lookups that went to the database")
+
+_session_users: OrderedDict[int, Tuple[SessionUserResponse, float]] = OrderedDict()
+_session_users_lock = threading.Lock()
 
 def create_session(session: SessionCreationRequest) -> Optional[int]:
     """
@@ -193,6 +208,7 @@ def delete_session(session_id: int):
         with conn.cursor() as cur:
             cur.execute("DELETE FROM all_sessions WHERE id = %(id)s;", {"id": session_id})
         conn.commit()
+        invalidate_session_user(session_id)
 
         log_green("Finished deleting the Session from Database")
     except Error as e:
@@ -216,6 +232,7 @@ def update_refresh_token_in_session(session_id: int, refresh_token: str, time_la
                     "updated": time_last_updated
                 })
         conn.commit()
+        invalidate_session_user(session_id)
 
         log_green("Finished updating refresh id for the Session in Database")
     except Error as e:
@@ -224,3 +241,55 @@ def update_refresh_token_in_session(session_id: int, refresh_token: str, time_la
         raise e
     finally:
         disconnect(conn)
+
+def get_session_user(session_id: int) -> Optional[SessionUserResponse]:
+    """
+    Gets the type and id of the user a session belongs to, from memory if it was looked up recently
+    """
+    now = time.monotonic()
+    with _session_users_lock:
+        entry = _session_users.get(session_id)
+        if entry is not None and entry[1] > now:
+            _session_users.move_to_end(session_id)
+            cache_hits.inc()
+            return entry[0]
+
+    cache_misses.inc()
+    session = view_session(session_id)
+    if session is None:
+        return None
+
+    if session.customer is not None:
+        user = SessionUserResponse(user_type="customer", user_id=session.customer)
+    elif session.eatery is not None:
+        user = SessionUserResponse(user_type="eatery", user_id=session.eatery)
+    else:
+        return None
+
+    with _session_users_lock:
+        _session_users[session_id] = (user, time.monotonic() + SESSION_CACHE_TTL)
+        _session_users.move_to_end(session_id)
+
+        while len(_session_users) > SESSION_CACHE_SIZE:
+            _session_users.popitem(last=False)
+
+    return user
+
+def invalidate_session_user(session_id: int):
+    """
+    Drops a session from memory now and again once the change is committed,
+    so a lookup racing the commit can't keep serving the old session
+    """
+    def forget():
+        with _session_users_lock:
+            _session_users.pop(session_id, None)
+
+    forget()
+    on_commit(forget)
+
+def clear_session_cache():
+    """
+    Drops every session from memory
+    """
+    with _session_users_lock:
+        _session_users.clear()
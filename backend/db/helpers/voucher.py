@@ -1,11 +1,11 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from psycopg2 import Error
 
 from logger import log_red, log_green
 
 from db.helpers import connect, disconnect
 from db.db_types.db_request import VoucherCreationRequest
-from db.db_types.db_response import VoucherDetailsResponse
+from db.db_types.db_response import VoucherDetailsResponse, VoucherCountsResponse
 
 def insert_voucher(voucher: VoucherCreationRequest) -> Optional[int]:
     """
@@ -42,6 +42,45 @@ def insert_voucher(voucher: VoucherCreationRequest) -> Optional[int]:
 
     return voucher_id
 
+def insert_vouchers(vouchers: List[VoucherCreationRequest]) -> Dict[int, int]:
+    """
+    Inserts many vouchers into DB in one statement, returns the new voucher id for each voucher template
+
+    Releases that already have a voucher are skipped and left out of the result
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO vouchers (voucher_template, release_date, expiry_date)
+                SELECT * FROM UNNEST(%(voucher_templates)s::BIGINT[], %(release_dates)s::TIMESTAMPTZ[], %(expiry_dates)s::TIMESTAMPTZ[])
+                    AS release(voucher_template, release_date, expiry_date)
+                -- Checked up front as well so releases made long ago don't use up ids, the conflict clause covers races
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM vouchers v
+                    WHERE v.voucher_template = release.voucher_template AND v.release_date = release.release_date
+                )
+                ON CONFLICT (voucher_template, release_date) DO NOTHING
+                RETURNING voucher_template, id;
+            """, {
+                    "voucher_templates": [voucher.voucher_template for voucher in vouchers],
+                    "release_dates": [voucher.release_date for voucher in vouchers],
+                    "expiry_dates": [voucher.expiry_date for voucher in vouchers]
+                })
+            voucher_ids = dict(cur.fetchall())
+        conn.commit()
+
+        log_green(f"Finished inserting \"{len(voucher_ids)}\" of \"{len(vouchers)}\" Vouchers in Database")
+    except Error as e:
+        log_red(f"Error inserting Vouchers: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+    return voucher_ids
+
 def get_voucher_by_id(voucher_id: int) -> Optional[VoucherDetailsResponse]:
     """
     Fetches information about a voucher from DB
@@ -81,31 +120,45 @@ def get_voucher_quantity(voucher_id: int) -> Optional[int]:
     """
     Fetches count of instances for a voucher in DB
     """
+    counts = get_voucher_counts_by_ids([voucher_id])
+
+    if counts is None:
+        return None
+
+    return counts[voucher_id].total
+
+def get_voucher_counts_by_ids(voucher_ids: List[int]) -> Optional[Dict[int, VoucherCountsResponse]]:
+    """
+    Fetches the total, unclaimed, claimed, redeemed and reserved instance counts for each voucher in DB
+
+    Vouchers without any instances get zero counts
+    """
     try:
         conn = connect()
         with conn.cursor() as cur:
-            # Get all voucher batches
-            # Get count of each voucher batch
-
             cur.execute(
                 """
-                SELECT COUNT(*) FROM voucher_instances WHERE voucher = %(id)s;
+                SELECT voucher, SUM(total), SUM(unclaimed), SUM(claimed), SUM(redeemed), SUM(reserved)
+                FROM voucher_counts
+                WHERE voucher = ANY(%(ids)s)
+                GROUP BY voucher;
                 """, {
-                    "id": voucher_id
+                    "ids": voucher_ids
                 })
-            qty = cur.fetchone()
+            counts_raw = cur.fetchall()
 
-        log_green("Finished getting Voucher for the Eatery in Database")
+        log_green("Finished getting instance counts for the Vouchers in Database")
     except Error as e:
-        log_red(f"Error getting Voucher for the Eatery: {e}")
+        log_red(f"Error getting instance counts for the Vouchers: {e}")
         raise e
     finally:
         disconnect(conn)
 
-    if qty:
-        return qty[0]
+    counts = {voucher_id: VoucherCountsResponse(total=0, unclaimed=0, claimed=0, redeemed=0, reserved=0) for voucher_id in voucher_ids}
+    for voucher_id, total, unclaimed, claimed, redeemed, reserved in counts_raw:
+        counts[voucher_id] = VoucherCountsResponse(total=total, unclaimed=unclaimed, claimed=claimed, redeemed=redeemed, reserved=reserved)
 
-    return None
+    return counts
 
 def get_vouchers_by_voucher_template(voucher_template: int) -> Optional[List[int]]:
     """
@@ -10,29 +10,26 @@ from db.db_types.db_response import VoucherInstanceDetailsResponse
 def insert_voucher_instance(voucher_instance: VoucherInstanceCreationRequest) -> Optional[List[int]]:
     """
     Inserts instances of a voucher into DB
+
+    The whole batch is inserted with its initial status in a single statement
     """
-    instance_ids: List[int] = []
     try:
         conn = connect()
         with conn.cursor() as cur:
-            for _ in range(voucher_instance.qty):
-                cur.execute(
-                    """
-                    INSERT INTO voucher_instances (voucher, customer)
-                    VALUES (%(voucher)s, NULL)
-                    RETURNING id;
-                """, {
-                        "voucher": voucher_instance.voucher,
-                    })
-                instance_id = cur.fetchone()
-                if instance_id:
-                    instance_ids.append(instance_id[0])
+            cur.execute(
+                """
+                INSERT INTO voucher_instances (voucher, customer, status)
+                SELECT %(voucher)s, NULL, COALESCE(%(status)s, 'unpublished')::STATUS_TYPE
+                FROM GENERATE_SERIES(1, %(qty)s)
+                RETURNING id;
+            """, {
+                    "voucher": voucher_instance.voucher,
+                    "status": voucher_instance.status,
+                    "qty": voucher_instance.qty
+                })
+            instance_ids = sorted(instance_id[0] for instance_id in cur.fetchall())
         conn.commit()
 
-        if voucher_instance.status and voucher_instance.status != 'unpublished':
-            for instance_id in instance_ids:
-                update_voucher_instance_status(instance_id, voucher_instance.status)
-
         log_green(f"Finished inserting the \"{voucher_instance.qty}\" Voucher Instances in Database")
     except Error as e:
         log_red(f"Error inserting Voucher Instances: {e}")
@@ -43,6 +40,34 @@ def insert_voucher_instance(voucher_instance: VoucherInstanceCreationRequest) ->
 
     return instance_ids
 
+def insert_voucher_instance_batches(voucher_instances: List[VoucherInstanceCreationRequest]):
+    """
+    Inserts the instances of many vouchers into DB in a single statement
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO voucher_instances (voucher, customer, status)
+                SELECT batch.voucher, NULL, COALESCE(batch.status, 'unpublished')::STATUS_TYPE
+                FROM UNNEST(%(vouchers)s::BIGINT[], %(statuses)s::VARCHAR[], %(qtys)s::INTEGER[]) AS batch(voucher, status, qty),
+                    GENERATE_SERIES(1, batch.qty);
+            """, {
+                    "vouchers": [voucher_instance.voucher for voucher_instance in voucher_instances],
+                    "statuses": [voucher_instance.status for voucher_instance in voucher_instances],
+                    "qtys": [voucher_instance.qty for voucher_instance in voucher_instances]
+                })
+        conn.commit()
+
+        log_green(f"Finished inserting Voucher Instances for \"{len(voucher_instances)}\" Vouchers in Database")
+    except Error as e:
+        log_red(f"Error inserting Voucher Instances: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
 def get_voucher_instance_by_id(voucher_instance_id: int) -> Optional[VoucherInstanceDetailsResponse]:
     """
     Fetches information about a voucher instance from DB
@@ -246,6 +271,43 @@ def allocate_voucher_instance(voucher_instance_id: int, customer_id: int):
     finally:
         disconnect(conn)
 
+def claim_voucher_instance(voucher_id: int, customer_id: int) -> Optional[int]:
+    """
+    Claims one unclaimed instance of a voucher for a customer in a single statement
+
+    Instances locked by concurrent claimers are skipped rather than waited on, returns None if none are left
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE voucher_instances SET status = 'claimed', customer = %(customer)s
+                WHERE id = (
+                    SELECT id FROM voucher_instances
+                    WHERE voucher = %(voucher)s AND status = 'unclaimed'
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id;
+            """, {
+                    "voucher": voucher_id,
+                    "customer": customer_id
+                })
+            instance_id = cur.fetchone()
+        conn.commit()
+
+        log_green("Finished claiming a Voucher Instance in Database for the customer")
+    except Error as e:
+        log_red(f"Error claiming a Voucher Instance for the customer: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+    return instance_id[0] if instance_id else None
+
 def deallocate_voucher_instance(voucher_instance_id: int):
     """
     Deallocates the voucher instance to a customer
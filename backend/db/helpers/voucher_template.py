@@ -1,5 +1,5 @@
 from datetime import timedelta, datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from psycopg2 import Error
 
 from logger import log_red, log_green
@@ -8,6 +8,9 @@ from db.helpers import connect, disconnect
 from db.db_types.db_request import VoucherTemplateCreationRequest
 from db.db_types.db_response import VoucherTemplateDetailsResponse, VoucherTemplateScheduleDetailsResponse
 
+# The channel the process holding the scheduler lease listens on for new and changed templates
+SCHEDULER_CHANNEL = "voucher_scheduler"
+
 def insert_voucher_template(voucher_template: VoucherTemplateCreationRequest) -> Optional[int]:
     """
     Inserts a voucher into DB
@@ -416,6 +419,93 @@ def get_voucher_template_schedule_by_id(voucher_template_id: int) -> Optional[Vo
         last_release=last_release
     )
 
+def get_voucher_template_schedules_by_ids(voucher_template_ids: List[int]) -> Dict[int, VoucherTemplateScheduleDetailsResponse]:
+    """
+    Fetch the scheduling details of many voucher templates in one query, keyed by id
+
+    Templates that don't exist are left out
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, is_deleted, release_date, release_schedule, release_duration, release_size, last_release
+                FROM voucher_templates WHERE id = ANY(%(ids)s);
+            """, {"ids": voucher_template_ids})
+            schedules_raw = cur.fetchall()
+
+        log_green("Finished getting Voucher Template Schedules in Database")
+    except Error as e:
+        log_red(f"Error getting Voucher Template Schedules: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {
+        voucher_template_id: VoucherTemplateScheduleDetailsResponse(
+            is_deleted=is_deleted,
+            release_date=release_date,
+            release_schedule=release_schedule,
+            release_duration=release_duration,
+            release_size=release_size,
+            last_release=last_release
+        ) for voucher_template_id, is_deleted, release_date, release_schedule, release_duration, release_size, last_release in schedules_raw
+    }
+
+def get_all_voucher_template_schedules() -> Dict[int, VoucherTemplateScheduleDetailsResponse]:
+    """
+    Fetch the scheduling details of every voucher template that hasn't been deleted, keyed by id
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, is_deleted, release_date, release_schedule, release_duration, release_size, last_release
+                FROM voucher_templates WHERE NOT is_deleted;
+            """)
+            schedules_raw = cur.fetchall()
+
+        log_green("Finished getting all Voucher Template Schedules in Database")
+    except Error as e:
+        log_red(f"Error getting all Voucher Template Schedules: {e}")
+        raise e
+    finally:
+        disconnect(conn)
+
+    return {
+        voucher_template_id: VoucherTemplateScheduleDetailsResponse(
+            is_deleted=is_deleted,
+            release_date=release_date,
+            release_schedule=release_schedule,
+            release_duration=release_duration,
+            release_size=release_size,
+            last_release=last_release
+        ) for voucher_template_id, is_deleted, release_date, release_schedule, release_duration, release_size, last_release in schedules_raw
+    }
+
+def notify_voucher_template_scheduled(voucher_template_id: int):
+    """
+    Tells the process running voucher releases that a template's schedule changed, delivered once the transaction commits
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%(channel)s, %(payload)s);", {
+                "channel": SCHEDULER_CHANNEL,
+                "payload": str(voucher_template_id)
+            })
+        conn.commit()
+
+        log_green("Finished notifying the Voucher Scheduler in Database")
+    except Error as e:
+        log_red(f"Error notifying the Voucher Scheduler: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
 def update_voucher_template_last_release(voucher_template_id: int, last_release: datetime):
     """
     Updates last release for a voucher
@@ -437,3 +527,25 @@ def update_voucher_template_last_release(voucher_template_id: int, last_release:
         raise e
     finally:
         disconnect(conn)
+
+def update_voucher_templates_last_release(voucher_template_ids: List[int], last_release: datetime):
+    """
+    Updates last release for many voucher templates at once
+    """
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE voucher_templates SET last_release = %(release)s WHERE id = ANY(%(ids)s);", {
+                    "release": last_release,
+                    "ids": voucher_template_ids
+                })
+        conn.commit()
+
+        log_green("Finished updating last release for the Voucher Templates in Database")
+    except Error as e:
+        log_red(f"Error updating last release for the Voucher Templates: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
@@ -0,0 +1,104 @@
+from typing import Any, List, Optional
+import psycopg2
+from psycopg2 import extensions
+
+from logger import log_red
+
+class AdvisoryLease:
+    """
+    A Postgres session level advisory lock held on a connection of its own, outside the pool
+
+    Only one process can hold the lease at a time. If the holder dies or its connection drops the server frees the lock,
+    so another process picks it up the next time it tries. The holder also listens on `channel` for work from other processes.
+    """
+    def __init__(self, key: int, channel: str, **kwargs: Any):
+        self.key = key
+        self.channel = channel
+        self.kwargs = kwargs
+
+        self._conn: Optional[extensions.connection] = None
+
+    @property
+    def held(self) -> bool:
+        """
+        Whether this process believes it holds the lease, call renew to make sure
+        """
+        return self._conn is not None
+
+    def acquire(self) -> bool:
+        """
+        Tries to take the lease without waiting, returning whether it is now held
+        """
+        if self.held:
+            return True
+
+        conn = psycopg2.connect(**self.kwargs)
+        try:
+            # Session level locks and LISTEN both need statements to take effect straight away
+            conn.set_session(autocommit=True)
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%(key)s);", {"key": self.key})
+                if not cur.fetchone()[0]:
+                    conn.close()
+                    return False
+
+                cur.execute(f"LISTEN {self.channel};")
+        except psycopg2.Error:
+            conn.close()
+            raise
+
+        self._conn = conn
+        return True
+
+    def renew(self) -> bool:
+        """
+        Checks the lease's connection is still alive, returning whether the lease is still held
+        """
+        if self._conn is None:
+            return False
+
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except psycopg2.Error as err:
+            log_red(f"Lost advisory lease {self.key}: {err}")
+            self._close()
+            return False
+
+    def notifications(self) -> List[str]:
+        """
+        Takes the payloads of notifications received since last asked, renew picks them up from the server
+        """
+        if self._conn is None:
+            return []
+
+        payloads = [notify.payload for notify in self._conn.notifies]
+        self._conn.notifies.clear()
+
+        return payloads
+
+    def release(self):
+        """
+        Gives up the lease so another process can take over straight away
+        """
+        if self._conn is None:
+            return
+
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%(key)s);", {"key": self.key})
+        except psycopg2.Error as err:
+            log_red(f"Error releasing advisory lease {self.key}: {err}")
+        finally:
+            self._close()
+
+    def _close(self):
+        """
+        Closes the lease's connection, which frees the lock on the server if it is still held
+        """
+        conn, self._conn = self._conn, None
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
@@ -1,10 +1,19 @@
 import os
+import re
 import argparse
 from typing import List, Tuple, Optional, Any
 from psycopg2 import Error, sql
 
 from logger import log_red, log_green
 from db.helpers import connect, disconnect
+from db.helpers.search_index import rebuild_search_index
+from db.helpers.session import clear_session_cache
+
+# Migrations are named <version>_<name>.sql and applied in version order
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Held while migrating so that two processes starting at once don't both apply the same migration
+MIGRATION_LOCK = 0x6d696772
 
 class DatabaseSetup:
     def __init__(self):
@@ -28,6 +37,7 @@ class DatabaseSetup:
             with conn.cursor() as cur:
                 with open(os.path.join(os.getcwd(), "db/schema.sql"), encoding="utf8") as file:
                     cur.execute(file.read())
+            conn.commit()
 
             log_green("done injecting schema")
         except Error as err:
@@ -36,10 +46,99 @@ class DatabaseSetup:
         finally:
             disconnect(conn)
 
+    def list_migrations(self) -> List[Tuple[int, str, str]]:
+        """
+
+        List the migrations in db/migrations in the order they are applied
+
+        Returns:
+            List[Tuple[int, str, str]]: list of (version, name, path) for each migration
+        """
+        migrations_dir = os.path.join(os.getcwd(), "db/migrations")
+
+        migrations = []
+        for file_name in os.listdir(migrations_dir):
+            match = MIGRATION_FILE.match(file_name)
+            if match:
+                migrations.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, file_name)))
+
+        return sorted(migrations)
+
+    def applied_migrations(self) -> List[int]:
+        """
+
+        List the versions of the migrations already applied to the database
+
+        Returns:
+            List[int]: list of applied migration versions
+        """
+        try:
+            conn = connect()
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM schema_migrations ORDER BY version;")
+                versions = cur.fetchall()
+        except Error as err:
+            log_red(f"database error while listing migrations: {err}")
+            raise err
+        finally:
+            disconnect(conn)
+
+        return [version[0] for version in versions]
+
+    def migrate(self) -> List[int]:
+        """
+
+        Applies every migration that hasn't been applied yet, each in its own transaction
+
+        Returns:
+            List[int]: list of the migration versions applied by this call
+        """
+        applied = []
+        for version, name, path in self.list_migrations():
+            try:
+                conn = connect()
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(%(lock)s);", {"lock": MIGRATION_LOCK})
+
+                    # Databases set up before migrations existed won't have the table yet
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            name VARCHAR(255) NOT NULL,
+                            applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+                        );
+                    """)
+
+                    cur.execute("SELECT EXISTS(SELECT 1 FROM schema_migrations WHERE version = %(version)s);", {"version": version})
+                    if cur.fetchone()[0]:
+                        conn.rollback()
+                        continue
+
+                    with open(path, encoding="utf8") as file:
+                        cur.execute(file.read())
+
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%(version)s, %(name)s);", {
+                        "version": version,
+                        "name": name
+                    })
+                conn.commit()
+
+                applied.append(version)
+                log_green(f"applied migration {version} \"{name}\"")
+            except Error as err:
+                log_red(f"database error while applying migration {version} \"{name}\": {err}")
+                conn.rollback()
+                raise err
+            finally:
+                disconnect(conn)
+
+        return applied
+
     def list_tables(self) -> List[str]:
         """
 
-        List all tables in the public schema of the database
+        List all tables in the public schema of the database, other than the migration history
 
         Returns:
             List[str]: list of all table names
@@ -48,7 +147,8 @@ class DatabaseSetup:
             conn = connect()
             with conn.cursor() as cur:
                 # Get a list of tables in the public schema
-                cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_type = 'BASE TABLE';")
+                cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_type = 'BASE TABLE' "
+                            "AND table_name <> 'schema_migrations';")
                 tables = cur.fetchall()
 
             log_green("done listing tables")
@@ -100,6 +200,9 @@ class DatabaseSetup:
                     cur.execute(sql.SQL("TRUNCATE {} CASCADE;").format(sql.Identifier(table)))
                 conn.commit()
 
+                if table == "all_sessions":
+                    clear_session_cache()
+
                 log_green(f"truncated table \"{table}\"")
             except Error as err:
                 log_red(f"error truncating table \"{table}\": {err}")
@@ -113,14 +216,21 @@ class DatabaseSetup:
         """
         parser = argparse.ArgumentParser(description="Setting up the skeleton of the database with schema and dummy data")
         parser.add_argument("--load_db", help="Flag indicating whether to load the database (default is True)", action="store_false")
+        parser.add_argument("--migrate", help="Flag indicating whether to apply pending migrations without reloading (default is False)", action="store_true")
+        parser.add_argument("--rebuild_search", help="Flag indicating whether to rebuild the eatery search index (default is False)", action="store_true")
         namespace = parser.parse_args()
         load_db = namespace.load_db
 
         try:
             if load_db:
                 self.inject_schema()
+                self.migrate()
                 tables = self.list_tables()
                 self.clear_tables(tables)
+            elif namespace.migrate:
+                self.migrate()
+            if namespace.rebuild_search:
+                rebuild_search_index()
         finally:
             log_green("Finished with the database")
 
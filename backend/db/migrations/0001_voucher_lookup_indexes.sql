@@ -0,0 +1,16 @@
+-- Indexes for the voucher access paths
+--
+-- voucher_instances is looked up by voucher (optionally with a status)
+--   when listing, counting and claiming instances, and by customer when
+--   listing a customer's wallet;
+-- vouchers are looked up by their template when listing an eatery's vouchers;
+
+CREATE INDEX IF NOT EXISTS voucher_instances_voucher_status_idx
+    ON voucher_instances (voucher, status) INCLUDE (id, customer);
+
+CREATE INDEX IF NOT EXISTS voucher_instances_customer_idx
+    ON voucher_instances (customer) INCLUDE (id, voucher, status)
+    WHERE customer IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS vouchers_voucher_template_idx
+    ON vouchers (voucher_template) INCLUDE (id, release_date, expiry_date);
@@ -0,0 +1,29 @@
+-- Indexes for the eatery, review, session and password access paths
+--
+-- eatery_atoms is keyed (keyword, eatery) so lookups by eatery alone
+--   need their own index;
+-- reviews are looked up by the voucher instance they were left for;
+-- sessions and passwords belong to exactly one of an eatery or a customer,
+--   so each side gets a partial index;
+
+CREATE INDEX IF NOT EXISTS eatery_atoms_eatery_idx
+    ON eatery_atoms (eatery) INCLUDE (keyword);
+
+CREATE INDEX IF NOT EXISTS reviews_voucher_instance_idx
+    ON reviews (voucher_instance) INCLUDE (id);
+
+CREATE INDEX IF NOT EXISTS all_sessions_eatery_idx
+    ON all_sessions (eatery) INCLUDE (id)
+    WHERE eatery IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS all_sessions_customer_idx
+    ON all_sessions (customer) INCLUDE (id)
+    WHERE customer IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS passwords_eatery_idx
+    ON passwords (eatery, pass_type, time_created DESC) INCLUDE (id, password)
+    WHERE eatery IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS passwords_customer_idx
+    ON passwords (customer, pass_type, time_created DESC) INCLUDE (id, password)
+    WHERE customer IS NOT NULL;
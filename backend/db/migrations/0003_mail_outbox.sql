@@ -0,0 +1,25 @@
+-- Outbound email queue
+--
+-- Messages are written in the same transaction as the change they describe
+--   and sent later by the mail worker;
+-- dedupe_key stops the same message being queued twice;
+-- next_attempt doubles as a lease, the worker pushes it forward while sending;
+
+CREATE TABLE IF NOT EXISTS mail_outbox (
+    id                      BIGSERIAL,
+    dedupe_key              VARCHAR(255) UNIQUE NOT NULL,
+    to_email                VARCHAR(255) NOT NULL,
+    to_name                 VARCHAR(255) NOT NULL,
+    subject                 VARCHAR(255) NOT NULL,
+    text                    TEXT NOT NULL,
+    html_text               TEXT NOT NULL,
+    attempts                INTEGER DEFAULT 0 NOT NULL,
+    last_error              TEXT,
+    next_attempt            TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    created_at              TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    sent_at                 TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY             (id)
+);
+
+CREATE INDEX IF NOT EXISTS mail_outbox_pending_idx
+    ON mail_outbox (next_attempt) WHERE sent_at IS NULL;
@@ -0,0 +1,13 @@
+-- One voucher per template per release
+--
+-- Every API worker runs a scheduler and only the one holding the lease
+--   releases on a timer, but a handover or an inline release can still race;
+-- the key lets a second insert of the same release be skipped instead of
+--   duplicating the batch;
+-- it leads with voucher_template and covers the same columns, so it replaces
+--   vouchers_voucher_template_idx;
+
+CREATE UNIQUE INDEX IF NOT EXISTS vouchers_voucher_template_release_idx
+    ON vouchers (voucher_template, release_date) INCLUDE (id, expiry_date);
+
+DROP INDEX IF EXISTS vouchers_voucher_template_idx;
@@ -0,0 +1,16 @@
+-- Resized WebP renditions of eatery thumbnails
+--
+-- thumbnail_card is shown on homepage and search cards, thumbnail_detail on
+--   the eatery's page, both are NULL until rendered and the original is
+--   shown in the meantime;
+-- renditions_pending marks thumbnails the rendition worker still has to
+--   render, the partial index keeps finding them cheap;
+
+ALTER TABLE eatery_details
+    ADD COLUMN IF NOT EXISTS thumbnail_card TEXT,
+    ADD COLUMN IF NOT EXISTS thumbnail_detail TEXT,
+    ADD COLUMN IF NOT EXISTS renditions_pending BOOLEAN DEFAULT FALSE NOT NULL;
+
+CREATE INDEX IF NOT EXISTS eatery_details_renditions_pending_idx
+    ON eatery_details (eatery) INCLUDE (thumbnail)
+    WHERE renditions_pending;
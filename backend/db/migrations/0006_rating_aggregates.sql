@@ -0,0 +1,43 @@
+-- Running review count and rating total per eatery and per voucher template
+--
+-- Kept in step by create_review in the same transaction as each review, so
+--   average ratings never have to walk the reviews;
+-- Existing reviews are folded in below, reviews is locked while they are so
+--   none can be written between the backfill and the commit;
+
+CREATE TABLE IF NOT EXISTS eatery_ratings (
+    eatery                  BIGINT,
+    review_count            INTEGER DEFAULT 0 NOT NULL,
+    rating_total            FLOAT DEFAULT 0 NOT NULL,
+    PRIMARY KEY             (eatery),
+    FOREIGN KEY             (eatery) REFERENCES eateries(id)
+);
+
+CREATE TABLE IF NOT EXISTS voucher_template_ratings (
+    voucher_template        BIGINT,
+    review_count            INTEGER DEFAULT 0 NOT NULL,
+    rating_total            FLOAT DEFAULT 0 NOT NULL,
+    PRIMARY KEY             (voucher_template),
+    FOREIGN KEY             (voucher_template) REFERENCES voucher_templates(id)
+);
+
+LOCK TABLE reviews IN SHARE MODE;
+
+INSERT INTO voucher_template_ratings (voucher_template, review_count, rating_total)
+SELECT v.voucher_template, COUNT(*), SUM(r.rating) FROM reviews r
+JOIN voucher_instances vi ON vi.id = r.voucher_instance
+JOIN vouchers v ON v.id = vi.voucher
+GROUP BY v.voucher_template
+ON CONFLICT (voucher_template) DO UPDATE
+SET review_count = EXCLUDED.review_count,
+    rating_total = EXCLUDED.rating_total;
+
+INSERT INTO eatery_ratings (eatery, review_count, rating_total)
+SELECT vt.eatery, COUNT(*), SUM(r.rating) FROM reviews r
+JOIN voucher_instances vi ON vi.id = r.voucher_instance
+JOIN vouchers v ON v.id = vi.voucher
+JOIN voucher_templates vt ON vt.id = v.voucher_template
+GROUP BY vt.eatery
+ON CONFLICT (eatery) DO UPDATE
+SET review_count = EXCLUDED.review_count,
+    rating_total = EXCLUDED.rating_total;
@@ -0,0 +1,37 @@
+-- Inverted index of the terms dumb search matches eateries on
+--
+-- source is one of keyword, postcode, title (the full name) or name (name
+--   tokens and the name without whitespace), the helpers in
+--   db/helpers/search_index.py keep it in step with every write;
+-- Existing eateries are indexed below with the same query as
+--   rebuild_search_index, their tables are locked while they are;
+
+CREATE TABLE IF NOT EXISTS eatery_search_terms (
+    term                    VARCHAR(255),
+    eatery                  BIGINT,
+    source                  VARCHAR(10),
+    PRIMARY KEY             (term, eatery, source),
+    FOREIGN KEY             (eatery) REFERENCES eateries(id)
+);
+
+CREATE INDEX IF NOT EXISTS search_terms_prefix_idx ON eatery_search_terms(term varchar_pattern_ops);
+
+LOCK TABLE eateries, eatery_details, addresses, eatery_atoms, keywords IN SHARE MODE;
+
+DELETE FROM eatery_search_terms;
+
+INSERT INTO eatery_search_terms (term, eatery, source)
+SELECT DISTINCT term, eatery, source FROM (
+    SELECT LOWER(TRIM(k.title)) AS term, ea.eatery, 'keyword' AS source
+    FROM eatery_atoms ea JOIN keywords k ON k.id = ea.keyword
+    UNION ALL
+    SELECT LOWER(TRIM(a.postcode)), ed.eatery, 'postcode'
+    FROM eatery_details ed JOIN addresses a ON a.id = ed.address
+    UNION ALL
+    SELECT LOWER(TRIM(e.eatery_name)), e.id, 'title' FROM eateries e
+    UNION ALL
+    SELECT LOWER(REGEXP_REPLACE(e.eatery_name, '\s', '', 'g')), e.id, 'name' FROM eateries e
+    UNION ALL
+    SELECT LOWER(word), e.id, 'name' FROM eateries e, REGEXP_SPLIT_TO_TABLE(e.eatery_name, '\s+') AS word
+) terms
+WHERE term <> '';
@@ -0,0 +1,13 @@
+-- GPT relatedness scores of keywords against prompt words, kept across
+--   smart searches and restarts
+--
+-- Only a cache, so it starts empty and fills as searches are made;
+
+CREATE TABLE IF NOT EXISTS keyword_scores (
+    keyword                 VARCHAR(255),
+    prompt_word             VARCHAR(255),
+    model                   VARCHAR(50),
+    score                   INTEGER NOT NULL,
+    scored_at               TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY             (keyword, prompt_word, model)
+);
@@ -0,0 +1,99 @@
+-- Per-voucher instance counts by status
+--
+-- Kept in step by statement level triggers on voucher_instances, so listing
+--   vouchers never counts their instances;
+-- Existing instances are counted below, voucher_instances is locked while
+--   they are so no status change slips between the count and the commit;
+
+-- Spread over slots by instance id so concurrent claims on one voucher don't all queue on the same row
+-- Every status but unpublished has its own counter, unpublished instances are total less the others
+CREATE TABLE IF NOT EXISTS voucher_counts (
+    voucher                 BIGINT,
+    slot                    SMALLINT,
+    total                   INTEGER DEFAULT 0 NOT NULL,
+    unclaimed               INTEGER DEFAULT 0 NOT NULL,
+    claimed                 INTEGER DEFAULT 0 NOT NULL,
+    redeemed                INTEGER DEFAULT 0 NOT NULL,
+    reserved                INTEGER DEFAULT 0 NOT NULL,
+    PRIMARY KEY             (voucher, slot),
+    FOREIGN KEY             (voucher) REFERENCES vouchers(id)
+);
+
+-- Keeps voucher_counts in step with every insert, status change and delete of voucher instances
+CREATE OR REPLACE FUNCTION update_voucher_counts() RETURNS TRIGGER AS $$
+DECLARE
+    ids                     BIGINT[];
+    vouchers                BIGINT[];
+    statuses                STATUS_TYPE[];
+    deltas                  INTEGER[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT ARRAY_AGG(id), ARRAY_AGG(voucher), ARRAY_AGG(status), ARRAY_AGG(1)
+        INTO ids, vouchers, statuses, deltas FROM new_instances;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT ARRAY_AGG(id), ARRAY_AGG(voucher), ARRAY_AGG(status), ARRAY_AGG(-1)
+        INTO ids, vouchers, statuses, deltas FROM old_instances;
+    ELSE
+        -- Only rows whose voucher or status actually changed move between counters
+        SELECT ARRAY_AGG(id), ARRAY_AGG(voucher), ARRAY_AGG(status), ARRAY_AGG(delta)
+        INTO ids, vouchers, statuses, deltas FROM (
+            SELECT o.id, o.voucher, o.status, -1 AS delta FROM old_instances o JOIN new_instances n ON n.id = o.id
+            WHERE (o.voucher, o.status) IS DISTINCT FROM (n.voucher, n.status)
+            UNION ALL
+            SELECT n.id, n.voucher, n.status, 1 FROM old_instances o JOIN new_instances n ON n.id = o.id
+            WHERE (o.voucher, o.status) IS DISTINCT FROM (n.voucher, n.status)
+        ) changed;
+    END IF;
+
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO voucher_counts (voucher, slot, total, unclaimed, claimed, redeemed, reserved)
+    SELECT voucher, id % 16, SUM(delta),
+           COALESCE(SUM(delta) FILTER (WHERE status = 'unclaimed'), 0),
+           COALESCE(SUM(delta) FILTER (WHERE status = 'claimed'), 0),
+           COALESCE(SUM(delta) FILTER (WHERE status = 'redeemed'), 0),
+           COALESCE(SUM(delta) FILTER (WHERE status = 'reserved'), 0)
+    FROM UNNEST(ids, vouchers, statuses, deltas) AS d (id, voucher, status, delta)
+    GROUP BY voucher, id % 16
+    ORDER BY voucher, id % 16
+    ON CONFLICT (voucher, slot) DO UPDATE
+    SET total = voucher_counts.total + EXCLUDED.total,
+        unclaimed = voucher_counts.unclaimed + EXCLUDED.unclaimed,
+        claimed = voucher_counts.claimed + EXCLUDED.claimed,
+        redeemed = voucher_counts.redeemed + EXCLUDED.redeemed,
+        reserved = voucher_counts.reserved + EXCLUDED.reserved;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER voucher_counts_insert AFTER INSERT ON voucher_instances
+REFERENCING NEW TABLE AS new_instances FOR EACH STATEMENT EXECUTE FUNCTION update_voucher_counts();
+
+DROP TRIGGER IF EXISTS voucher_counts_insert ON voucher_instances;
+DROP TRIGGER IF EXISTS voucher_counts_update ON voucher_instances;
+DROP TRIGGER IF EXISTS voucher_counts_delete ON voucher_instances;
+
+CREATE TRIGGER voucher_counts_insert AFTER INSERT ON voucher_instances
+REFERENCING NEW TABLE AS new_instances FOR EACH STATEMENT EXECUTE FUNCTION update_voucher_counts();
+
+CREATE TRIGGER voucher_counts_update AFTER UPDATE ON voucher_instances
+REFERENCING OLD TABLE AS old_instances NEW TABLE AS new_instances FOR EACH STATEMENT EXECUTE FUNCTION update_voucher_counts();
+
+CREATE TRIGGER voucher_counts_delete AFTER DELETE ON voucher_instances
+REFERENCING OLD TABLE AS old_instances FOR EACH STATEMENT EXECUTE FUNCTION update_voucher_counts();
+
+LOCK TABLE voucher_instances IN SHARE MODE;
+
+DELETE FROM voucher_counts;
+
+INSERT INTO voucher_counts (voucher, slot, total, unclaimed, claimed, redeemed, reserved)
+SELECT voucher, id % 16, COUNT(*),
+       COUNT(*) FILTER (WHERE status = 'unclaimed'),
+       COUNT(*) FILTER (WHERE status = 'claimed'),
+       COUNT(*) FILTER (WHERE status = 'redeemed'),
+       COUNT(*) FILTER (WHERE status = 'reserved')
+FROM voucher_instances
+GROUP BY voucher, id % 16;
@@ -0,0 +1,176 @@
+-- Per-eatery features that personalised recommendations are sorted on
+--
+-- One row per eatery holding its coordinates, date joined, the number of
+--   vouchers of its templates that aren't deleted, its rating aggregate and
+--   the ids of its keywords, so recommending never walks templates, vouchers
+--   or keywords per eatery;
+-- Rows are derived from other tables and kept in step by triggers on every
+--   write that changes them, each write recomputes the rows of just the
+--   eateries it touched;
+-- The table only ever holds derived data so it is safe to drop and rebuild;
+
+DROP TABLE IF EXISTS eatery_features CASCADE;
+
+CREATE TABLE eatery_features (
+    eatery                  BIGINT,
+    latitude                FLOAT NOT NULL,
+    longitude               FLOAT NOT NULL,
+    date_joined             TIMESTAMP WITH TIME ZONE NOT NULL,
+    active_vouchers         INTEGER DEFAULT 0 NOT NULL,
+    review_count            INTEGER DEFAULT 0 NOT NULL,
+    rating_total            FLOAT DEFAULT 0 NOT NULL,
+    keyword_ids             BIGINT[] DEFAULT '{}' NOT NULL,
+    PRIMARY KEY             (eatery),
+    FOREIGN KEY             (eatery) REFERENCES eateries(id)
+);
+
+-- Recomputes the feature rows of the given eateries from their source tables
+CREATE OR REPLACE FUNCTION refresh_eatery_features(eatery_ids BIGINT[]) RETURNS VOID AS $$
+BEGIN
+    IF eatery_ids IS NULL OR CARDINALITY(eatery_ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Waits out any other transaction refreshing the same eateries, the recompute
+    --   below then runs on a snapshot that includes what it committed
+    PERFORM 1 FROM eatery_features WHERE eatery = ANY(eatery_ids) ORDER BY eatery FOR UPDATE;
+
+    INSERT INTO eatery_features (eatery, latitude, longitude, date_joined, active_vouchers, review_count, rating_total, keyword_ids)
+    SELECT ed.eatery, a.latitude, a.longitude, ed.date_joined,
+           (SELECT COUNT(*) FROM voucher_templates vt JOIN vouchers v ON v.voucher_template = vt.id
+            WHERE vt.eatery = ed.eatery AND vt.is_deleted = FALSE),
+           COALESCE(er.review_count, 0), COALESCE(er.rating_total, 0),
+           ARRAY(SELECT ea.keyword FROM eatery_atoms ea WHERE ea.eatery = ed.eatery ORDER BY ea.keyword)
+    FROM eatery_details ed
+    JOIN addresses a ON a.id = ed.address
+    LEFT JOIN eatery_ratings er ON er.eatery = ed.eatery
+    WHERE ed.eatery = ANY(eatery_ids)
+    ORDER BY ed.eatery
+    ON CONFLICT (eatery) DO UPDATE
+    SET latitude = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude,
+        date_joined = EXCLUDED.date_joined,
+        active_vouchers = EXCLUDED.active_vouchers,
+        review_count = EXCLUDED.review_count,
+        rating_total = EXCLUDED.rating_total,
+        keyword_ids = EXCLUDED.keyword_ids;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Eateries that joined or moved, or whose date joined changed
+CREATE OR REPLACE FUNCTION eatery_features_details() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_eatery_features(ARRAY(SELECT eatery FROM new_rows));
+    ELSE
+        PERFORM refresh_eatery_features(ARRAY(
+            SELECT n.eatery FROM old_rows o JOIN new_rows n ON n.eatery = o.eatery
+            WHERE (o.address, o.date_joined) IS DISTINCT FROM (n.address, n.date_joined)
+        ));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Addresses whose coordinates were corrected in place
+CREATE OR REPLACE FUNCTION eatery_features_addresses() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_eatery_features(ARRAY(
+        SELECT ed.eatery FROM old_rows o JOIN new_rows n ON n.id = o.id
+        JOIN eatery_details ed ON ed.address = n.id
+        WHERE (o.latitude, o.longitude) IS DISTINCT FROM (n.latitude, n.longitude)
+    ));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keywords added to or removed from eateries
+CREATE OR REPLACE FUNCTION eatery_features_atoms() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_eatery_features(ARRAY(SELECT DISTINCT eatery FROM new_rows));
+    ELSE
+        PERFORM refresh_eatery_features(ARRAY(SELECT DISTINCT eatery FROM old_rows));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reviews left for eateries, through their rating aggregates
+CREATE OR REPLACE FUNCTION eatery_features_ratings() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_eatery_features(ARRAY(SELECT DISTINCT eatery FROM new_rows));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Vouchers released or removed
+CREATE OR REPLACE FUNCTION eatery_features_vouchers() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_eatery_features(ARRAY(
+            SELECT DISTINCT vt.eatery FROM new_rows n JOIN voucher_templates vt ON vt.id = n.voucher_template
+        ));
+    ELSE
+        PERFORM refresh_eatery_features(ARRAY(
+            SELECT DISTINCT vt.eatery FROM old_rows o JOIN voucher_templates vt ON vt.id = o.voucher_template
+        ));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Voucher templates deleted, restored or moved between eateries, other edits don't change any counts
+CREATE OR REPLACE FUNCTION eatery_features_templates() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_eatery_features(ARRAY(
+        SELECT DISTINCT eatery FROM (
+            SELECT o.eatery FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE (o.is_deleted, o.eatery) IS DISTINCT FROM (n.is_deleted, n.eatery)
+            UNION ALL
+            SELECT n.eatery FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE (o.is_deleted, o.eatery) IS DISTINCT FROM (n.is_deleted, n.eatery)
+        ) changed
+    ));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER eatery_features_details_insert AFTER INSERT ON eatery_details
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_details();
+
+CREATE TRIGGER eatery_features_details_update AFTER UPDATE ON eatery_details
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_details();
+
+CREATE TRIGGER eatery_features_addresses_update AFTER UPDATE ON addresses
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_addresses();
+
+CREATE TRIGGER eatery_features_atoms_insert AFTER INSERT ON eatery_atoms
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_atoms();
+
+CREATE TRIGGER eatery_features_atoms_delete AFTER DELETE ON eatery_atoms
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_atoms();
+
+CREATE TRIGGER eatery_features_ratings_insert AFTER INSERT ON eatery_ratings
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_ratings();
+
+CREATE TRIGGER eatery_features_ratings_update AFTER UPDATE ON eatery_ratings
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_ratings();
+
+CREATE TRIGGER eatery_features_vouchers_insert AFTER INSERT ON vouchers
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_vouchers();
+
+CREATE TRIGGER eatery_features_vouchers_delete AFTER DELETE ON vouchers
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_vouchers();
+
+CREATE TRIGGER eatery_features_templates_update AFTER UPDATE ON voucher_templates
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION eatery_features_templates();
+
+-- Eateries that already exist
+SELECT refresh_eatery_features(ARRAY(SELECT eatery FROM eatery_details));
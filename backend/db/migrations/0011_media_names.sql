@@ -0,0 +1,22 @@
+-- Stored media is saved by name rather than by URL
+--
+-- The URL media is served from is built from MEDIA_BASE_URL when responding,
+--   so moving the media behind a CDN doesn't leave stale URLs in the database;
+-- only URLs ending in a content-addressed name are media store URLs, the
+--   default thumbnail and inline data are left as they are;
+
+UPDATE eatery_details
+SET thumbnail = substring(thumbnail FROM '/([0-9a-f]{64}\.\w+)$')
+WHERE thumbnail ~ '^https?://.+/[0-9a-f]{64}\.\w+$';
+
+UPDATE eatery_details
+SET thumbnail_card = substring(thumbnail_card FROM '/([0-9a-f]{64}\.\w+)$')
+WHERE thumbnail_card ~ '^https?://.+/[0-9a-f]{64}\.\w+$';
+
+UPDATE eatery_details
+SET thumbnail_detail = substring(thumbnail_detail FROM '/([0-9a-f]{64}\.\w+)$')
+WHERE thumbnail_detail ~ '^https?://.+/[0-9a-f]{64}\.\w+$';
+
+UPDATE eatery_details
+SET menu = substring(menu FROM '/([0-9a-f]{64}\.\w+)$')
+WHERE menu ~ '^https?://.+/[0-9a-f]{64}\.\w+$';
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+import psycopg2
+from psycopg2 import extensions
+
+from logger import log_red
+
+import metrics
+
+wait_time = metrics.histogram("db_pool_wait_seconds", "Time spent waiting to check out a connection")
+checkout_failures = metrics.counter("db_pool_checkout_failures", "Checkouts that timed out or could not connect")
+recycled = metrics.counter("db_pool_recycled", "Connections closed because they were broken or idle for too long")
+
+class PoolTimeoutError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+class ConnectionPool:
+    """
+    A thread safe pool of psycopg2 connections
+
+    Checkouts wait up to `timeout` seconds for a free connection instead of failing straight away.
+    Idle connections are validated before being handed out and closed once idle for longer than `max_idle`.
+    """
+    def __init__(self, minconn: int, maxconn: int, timeout: float, max_idle: float, validate_after: float, **kwargs: Any):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.validate_after = validate_after
+        self.kwargs = kwargs
+
+        self._idle: Deque[Tuple[extensions.connection, float]] = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        metrics.gauge("db_pool_in_use", "Connections currently checked out", lambda: self.stats()["in_use"])
+        metrics.gauge("db_pool_idle", "Connections currently idle in the pool", lambda: self.stats()["idle"])
+
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self) -> extensions.connection:
+        """
+        Checks out a connection, waiting up to the pool timeout for one to free up
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            conn, idle_since = self._reserve(deadline)
+
+            if conn is None:
+                # We reserved a slot for a brand new connection
+                try:
+                    conn = self._open()
+                except psycopg2.Error:
+                    self._release_slot()
+                    checkout_failures.inc()
+                    raise
+            elif not self._usable(conn, idle_since):
+                self._discard(conn)
+                continue
+
+            wait_time.observe(time.monotonic() - start)
+            return conn
+
+    def putconn(self, conn: extensions.connection, close: bool = False):
+        """
+        Returns a connection to the pool, discarding it if it is broken
+        """
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        if close or conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """
+        Closes every idle connection and stops handing out new ones
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the number of connections in use and idle
+        """
+        with self._cond:
+            return {
+                "in_use": self._size - len(self._idle),
+                "idle": len(self._idle),
+                "max": self.maxconn
+            }
+
+    def _reserve(self, deadline: float) -> Tuple[Any, float]:
+        """
+        Takes an idle connection or a slot to open a new one, waiting until the deadline if the pool is full
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+
+                if self._idle:
+                    # Most recently used first so that rarely used connections go idle and get recycled
+                    return self._idle.pop()
+
+                if self._size < self.maxconn:
+                    self._size += 1
+                    return None, 0
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    checkout_failures.inc()
+                    log_red(f"Timed out after {self.timeout}s waiting for a database connection")
+                    raise PoolTimeoutError("Timed out waiting for a database connection")
+
+                self._cond.wait(remaining)
+
+    def _usable(self, conn: extensions.connection, idle_since: float) -> bool:
+        """
+        Checks that an idle connection is still worth handing out
+        """
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        idle_for = time.monotonic() - idle_since
+        if idle_for > self.max_idle:
+            return False
+
+        # Only ping connections that have been sitting around, the server may have dropped them
+        if idle_for > self.validate_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def _open(self) -> extensions.connection:
+        """
+        Opens a new connection to the database
+        """
+        try:
+            return psycopg2.connect(**self.kwargs)
+        except psycopg2.Error as err:
+            log_red(f"Database connection error: {err}")
+            raise err
+
+    def _discard(self, conn: extensions.connection):
+        """
+        Closes a connection and frees its slot in the pool
+        """
+        recycled.inc()
+        try:
+            conn.close()
+        finally:
+            self._release_slot()
+
+    def _release_slot(self):
+        """
+        Frees a slot so that a waiting checkout can open a new connection
+        """
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
@@ -23,6 +23,8 @@ DROP TYPE IF EXISTS PASS_TYPE CASCADE;
 DROP TYPE IF EXISTS STATUS_TYPE CASCADE;
 DROP TYPE IF EXISTS PERSON_NAME CASCADE;
 
+DROP FUNCTION IF EXISTS update_voucher_counts CASCADE;
+
 DROP TABLE IF EXISTS fav_eateries CASCADE;
 DROP TABLE IF EXISTS blocked_eateries CASCADE;
 DROP TABLE IF EXISTS passwords CASCADE;
@@ -34,11 +36,17 @@ DROP TABLE IF EXISTS customers CASCADE;
 DROP TABLE IF EXISTS preferences CASCADE;
 DROP TABLE IF EXISTS eatery_details CASCADE;
 DROP TABLE IF EXISTS reviews CASCADE;
+DROP TABLE IF EXISTS eatery_ratings CASCADE;
+DROP TABLE IF EXISTS voucher_template_ratings CASCADE;
+DROP TABLE IF EXISTS voucher_counts CASCADE;
 DROP TABLE IF EXISTS reports CASCADE;
 DROP TABLE IF EXISTS eateries CASCADE;
 DROP TABLE IF EXISTS addresses CASCADE;
 DROP TABLE IF EXISTS eatery_atoms CASCADE;
+DROP TABLE IF EXISTS eatery_search_terms CASCADE;
+DROP TABLE IF EXISTS keyword_scores CASCADE;
 DROP TABLE IF EXISTS customer_likes CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 -- Types / Domains;
 
@@ -230,6 +238,14 @@ CREATE TABLE reviews (
     FOREIGN KEY             (voucher_instance) REFERENCES voucher_instances(id)
 );
 
+-- Migrations in db/migrations that have been applied on top of this schema
+CREATE TABLE schema_migrations (
+    version                 INTEGER,
+    name                    VARCHAR(255) NOT NULL,
+    applied_at              TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    PRIMARY KEY             (version)
+);
+
 -- Indexes;
 
 CREATE INDEX vouchers_idx ON voucher_templates(eatery);
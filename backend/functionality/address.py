@@ -3,7 +3,7 @@ from pydantic import AwareDatetime
 
 from functionality.errors import ValidationError
 
-from db.helpers.eatery import get_eatery_by_id
+from db.helpers.eatery import get_eatery_location_by_id, get_eatery_summary_by_id
 from db.helpers.customer import get_customer_by_id
 from db.db_types.db_request import AddressCreationRequest
 
@@ -95,22 +95,20 @@ def get_eatery_location(eatery_id) -> Tuple[float,float]:
     """
     gets long and lat coords for eatery
     """
-    eatery = get_eatery_by_id(eatery_id)
-
-    if eatery is None:
-        raise ValueError("Error fetching customer")
+    location = get_eatery_location_by_id(eatery_id)
 
+    if location is None:
+        raise ValueError("Error fetching eatery")
 
-    return (eatery.address.latitude, eatery.address.longitude)
+    return location
 
 def get_eatery_date_joined(eatery_id) -> AwareDatetime:
     """
     gets registry date for eatery
     """
-    eatery = get_eatery_by_id(eatery_id)
+    eatery = get_eatery_summary_by_id(eatery_id)
 
     if eatery is None:
-        raise ValueError("Error fetching customer")
-
+        raise ValueError("Error fetching eatery")
 
     return eatery.date_joined
@@ -1,39 +1,52 @@
 """
 A module which authorises customer and eatery registration
 """
+import os
 import re
 from datetime import datetime, timezone
-from typing import Dict, Union, Optional
-from passlib.context import CryptContext
+from typing import Dict, List, Literal, Union, Optional
 
-from functionality.errors import DuplicationError, ValidationError
+from functionality.errors import AuthorisationError, DuplicationError, ValidationError
 from functionality.helpers import validate_regex_email, validate_regex_phone, validate_regex_password
 from functionality.address import valid_address
+from functionality.password_hashing import password_hasher
 from functionality.message import send_customer_welcome_email, send_eatery_welcome_email
-from functionality.token import create_access_token, create_refresh_token_and_new_session, get_session_id_from_access_token
+from functionality.token import create_access_token, create_refresh_token_and_new_session, create_refresh_token_and_update_session, \
+    get_session_id_from_access_token, get_session_id_from_refresh_token, refresh_token_valid
 
 from db.db_types.db_request import AddressCreationRequest, CustomerCreationRequest, EateryCreationRequest
 from db.helpers.customer import get_customer_by_email, get_customer_by_phone_number, get_customer_current_password_by_id, insert_customer
 from db.helpers.eatery import get_eatery_by_email, get_eatery_by_phone_number, get_eatery_by_abn, get_eatery_current_password_by_id, insert_eatery
-from db.helpers.session import delete_session, view_session
+from db.helpers.session import delete_session, get_user_type_by_session, view_session
+
+from db.helpers import run_blocking
 
 from router.api_types.api_request import AddressCreateRequest
 
 USER_REGISTRATION_DEFAULT_VALUE = None
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# How many previous passwords are kept to stop a user going back to one
+PASSWORD_HISTORY_SIZE = int(os.environ.get("PASSWORD_HISTORY_SIZE", "5"))
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes a password on the hashing worker processes
+
+    Awaited outside run_blocking, so no database thread waits on the hash
+    """
+    return await password_hasher.hash(password)
 
-def hash_password(password: str) -> str:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Hashes a password
+    Verifies against a hashed password on the hashing worker processes
     """
-    return pwd_context.hash(password)
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_any_password(plain_password: str, hashed_passwords: List[str]) -> bool:
     """
-    Verifies against a hashed password
+    Verifies against several hashed passwords in parallel, stopping at the first match
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_hasher.verify_any(plain_password, hashed_passwords)
 
 class RegistrationForm:
     """
@@ -166,7 +179,7 @@ class RegistrationForm:
         if user_type == "Eatery":
             self.validate_abn()
 
-    def database_transfer(self) -> int:
+    def database_transfer(self, hashed_password: str) -> int:
         """
         Up to subclasses to transfer to DB
         """
@@ -186,13 +199,12 @@ class CustomerRegistrationForm(RegistrationForm):
         self.address = kwargs["address"]
         self.phone = kwargs["phone_number"]
 
-    def database_transfer(self) -> Optional[int]:
+    def database_transfer(self, hashed_password: str) -> Optional[int]:
         """
         A function to input the form into the database
 
         Returns: The user id of the user
         """
-        hashed_password = hash_password(self.password)
         customer = CustomerCreationRequest(
             first_name=self.first_name,
             last_name=self.last_name,
@@ -229,12 +241,11 @@ class EateryRegistrationForm(RegistrationForm):
         self.manager_last_name = kwargs["manager_last_name"]
         self.abn = kwargs["abn"]
 
-    def database_transfer(self) -> Optional[int]:
+    def database_transfer(self, hashed_password: str) -> Optional[int]:
         """
         A function to input the form into the database
         Returns: The user id of the user
         """
-        hashed_password = hash_password(self.password)
         details = EateryCreationRequest(
             business_name=self.business_name,
             email=self.email,
@@ -261,7 +272,7 @@ class EateryRegistrationForm(RegistrationForm):
 
         return insert_eatery(details)
 
-def customer_registration(customer_form: CustomerRegistrationForm) -> Optional[Dict[str, Union[str, int]]]:
+async def customer_registration(customer_form: CustomerRegistrationForm) -> Optional[Dict[str, Union[str, int]]]:
     """
     A function used to perform customer registration logic
 
@@ -276,27 +287,29 @@ def customer_registration(customer_form: CustomerRegistrationForm) -> Optional[D
     Return: The refresh and access tokens
     """
     # Validate the form
-    customer_form.validate_form()
+    await run_blocking(customer_form.validate_form)
+
+    hashed_password = await hash_password(customer_form.password)
 
     # Input into database
-    uid = customer_form.database_transfer()
+    return await run_blocking(_customer_registration_transfer, customer_form, hashed_password)
+
+def _customer_registration_transfer(customer_form: CustomerRegistrationForm, hashed_password: str) -> Optional[Dict[str, Union[str, int]]]:
+    """
+    Inputs a validated customer form into the database and creates their session
+    """
+    uid = customer_form.database_transfer(hashed_password)
 
     if uid is None:
         return None
 
-    # Create a refresh token and access token for the user
-    refresh_token, sid = create_refresh_token_and_new_session("customer", uid)
-    access_token = create_access_token(sid)
+    tokens = _create_session("customer", uid)
 
-    send_customer_welcome_email(customer_form.email, customer_form.first_name)
+    send_customer_welcome_email(customer_form.email, customer_form.first_name, f"customer-welcome:{uid}")
 
-    return {
-        "user_id": uid,
-        "access_token": access_token,
-        "refresh_token": refresh_token
-    }
+    return tokens
 
-def eatery_registration(eatery_form: EateryRegistrationForm) -> Optional[Dict[str, Union[str, int]]]:
+async def eatery_registration(eatery_form: EateryRegistrationForm) -> Optional[Dict[str, Union[str, int]]]:
     """
     A function used to perform eatery registration logic
 
@@ -311,64 +324,66 @@ def eatery_registration(eatery_form: EateryRegistrationForm) -> Optional[Dict[st
     Return: The refresh and access tokens
     """
     # Validate the form
-    eatery_form.validate_form("Eatery")
+    await run_blocking(eatery_form.validate_form, "Eatery")
+
+    hashed_password = await hash_password(eatery_form.password)
 
     # Input into database
-    uid = eatery_form.database_transfer()
+    return await run_blocking(_eatery_registration_transfer, eatery_form, hashed_password)
+
+def _eatery_registration_transfer(eatery_form: EateryRegistrationForm, hashed_password: str) -> Optional[Dict[str, Union[str, int]]]:
+    """
+    Inputs a validated eatery form into the database and creates their session
+    """
+    uid = eatery_form.database_transfer(hashed_password)
 
     if uid is None:
         return None
 
-    # Create a refresh token and access token for the user
-    refresh_token, sid = create_refresh_token_and_new_session("eatery", uid)
-    access_token = create_access_token(sid)
+    tokens = _create_session("eatery", uid)
 
-    send_eatery_welcome_email(eatery_form.email, eatery_form.manager_first_name)
+    send_eatery_welcome_email(eatery_form.email, eatery_form.manager_first_name, f"eatery-welcome:{uid}")
 
-    return {
-        "user_id": uid,
-        "access_token": access_token,
-        "refresh_token": refresh_token
-    }
+    return tokens
 
-def customer_login_auth(email: str, password: str) -> Dict[str, Union[str, int]]:
+async def customer_login_auth(email: str, password: str) -> Dict[str, Union[str, int]]:
     """
     A function to login a user
 
     email is the email of the user, password is the password of the user
     """
-    uid = get_customer_by_email(email.lower())
+    uid = await run_blocking(get_customer_by_email, email.lower())
     if uid is None:
         raise ValueError("Email does not exist for customer")
 
-    curr_password = get_customer_current_password_by_id(uid)
-    if not curr_password or not verify_password(password, curr_password):
+    curr_password = await run_blocking(get_customer_current_password_by_id, uid)
+    if not curr_password or not await verify_password(password, curr_password):
         raise ValueError("Passwords do not match")
 
-    refresh_token, sid = create_refresh_token_and_new_session("customer", uid)
-    access_token = create_access_token(sid)
-
-    return {
-        "user_id": uid,
-        "access_token": access_token,
-        "refresh_token": refresh_token
-    }
+    return await run_blocking(_create_session, "customer", uid)
 
-def eatery_login_auth(email: str, password: str) -> Dict[str, Union[str, int]]:
+async def eatery_login_auth(email: str, password: str) -> Dict[str, Union[str, int]]:
     """
     A function to login a user
 
     email is the email of the user, password is the password of the user
     """
-    uid = get_eatery_by_email(email.lower())
+    uid = await run_blocking(get_eatery_by_email, email.lower())
     if uid is None:
         raise ValueError("Email does not exist for eatery")
 
-    curr_password = get_eatery_current_password_by_id(uid)
-    if not curr_password or not verify_password(password, curr_password):
+    curr_password = await run_blocking(get_eatery_current_password_by_id, uid)
+    if not curr_password or not await verify_password(password, curr_password):
         raise ValueError("Passwords do not match")
 
-    refresh_token, sid = create_refresh_token_and_new_session("eatery", uid)
+    return await run_blocking(_create_session, "eatery", uid)
+
+def _create_session(user_type: Literal["customer", "eatery"], uid: int) -> Dict[str, Union[str, int]]:
+    """
+    Creates a new session for a user, returning their refresh and access tokens
+    """
+    # Create a refresh token and access token for the user
+    refresh_token, sid = create_refresh_token_and_new_session(user_type, uid)
     access_token = create_access_token(sid)
 
     return {
@@ -377,6 +392,42 @@ def eatery_login_auth(email: str, password: str) -> Dict[str, Union[str, int]]:
         "refresh_token": refresh_token
     }
 
+def refresh_session(refresh_token: str) -> Dict[str, Union[str, int]]:
+    """
+    A function to refresh a user's session
+
+    refresh_token is the refresh token stored in the user's cookie
+    """
+    if not refresh_token_valid(refresh_token):
+        raise AuthorisationError("Invalid refresh token")
+
+    sid = get_session_id_from_refresh_token(refresh_token)
+    session = view_session(sid)
+    uid = None
+    user_type = get_user_type_by_session(sid)
+    if session and session.customer:
+        uid = session.customer
+    elif session and session.eatery:
+        uid = session.eatery
+
+    if uid is None or user_type is None:
+        raise AuthorisationError("Session does not match user type")
+
+    # Create new refresh token
+    new_refresh_token = create_refresh_token_and_update_session(
+        user_type,
+        uid,
+        sid
+    )
+    new_access_token = create_access_token(sid)
+
+    return {
+        "user_id": uid,
+        "user_type": user_type,
+        "access_token": new_access_token,
+        "refresh_token": new_refresh_token
+    }
+
 def logout(access_token: str):
     """
     A function to logout a user
@@ -2,10 +2,11 @@ from typing import Dict, List, Set
 from datetime import datetime, timezone
 
 from functionality.errors import ValidationError, DuplicationError
-from functionality.authorisation import hash_password, verify_password
+from functionality.authorisation import PASSWORD_HISTORY_SIZE, hash_password, verify_password, verify_any_password
 from functionality.address import valid_address
 from functionality.helpers import get_raw_rating, validate_regex_email, validate_regex_password, validate_regex_phone
 
+from db.helpers import run_blocking
 from db.helpers.customer import get_customer_by_id, get_customer_current_password_by_id, \
     get_customer_old_passwords_by_id, update_customer_email, update_customer_name, \
     update_customer_password, update_customer_phone, update_customer_address, favourite_eatery, \
@@ -39,6 +40,29 @@ def get_customer_profile(customer_id: int) -> CustomerDetailsResponse:
         )
     )
 
+async def new_customer_password_hash(customer_id: int, password: str) -> str:
+    """
+    Checks a new password against the customer's current and past passwords, then hashes it
+
+    Done before edit_customer_profile, so the hashing is awaited rather than run while holding a database thread
+    """
+    if not bool(password):
+        raise ValidationError("New password must not be empty")
+
+    validate_regex_password(password)
+
+    curr_password = await run_blocking(get_customer_current_password_by_id, customer_id)
+    if curr_password is None:
+        raise ValidationError("Password could not be retrieved")
+    if not await verify_password(password, curr_password):
+        past_passwords = await run_blocking(get_customer_old_passwords_by_id, customer_id, PASSWORD_HISTORY_SIZE)
+        if past_passwords is None:
+            raise ValidationError("Error retrieving past passwords")
+        if await verify_any_password(password, past_passwords):
+            raise ValueError("Password is the same as a past password")
+
+    return await hash_password(password)
+
 def edit_customer_profile(customer_id: int, **kwargs):
     """
     Used for the input for editing a customer profile
@@ -49,7 +73,7 @@ def edit_customer_profile(customer_id: int, **kwargs):
      - email
      - phone_number
      - address
-     - password
+     - password_hash, from new_customer_password_hash
 
     /customer/profile [PUT]
     """
@@ -97,24 +121,8 @@ def edit_customer_profile(customer_id: int, **kwargs):
     def update_address_logic(address: AddressCreateRequest):
         update_customer_address(customer_id, valid_address(address))
 
-    def validate_password_logic(password: str):
-        if not bool(password):
-            raise ValidationError("New password must not be empty")
-
-        validate_regex_password(password)
-
-        curr_password = get_customer_current_password_by_id(customer_id)
-        if curr_password is None:
-            raise ValidationError("Password could not be retrieved")
-        if not verify_password(password, curr_password):
-            past_passwords = get_customer_old_passwords_by_id(customer_id)
-            if past_passwords is None:
-                raise ValidationError("Error retrieving past passwords")
-            if hash_password(password) in past_passwords:
-                raise ValueError("Password is the same as a past password")
-
-    def update_password_logic(password: str):
-        update_customer_password(customer_id, hash_password(password), datetime.now(timezone.utc))
+    def update_password_hash_logic(password_hash: str):
+        update_customer_password(customer_id, password_hash, datetime.now(timezone.utc), PASSWORD_HISTORY_SIZE)
 
     # Validate all kwargs
     key_to_function_map = {
@@ -122,8 +130,7 @@ def edit_customer_profile(customer_id: int, **kwargs):
         "last_name": validate_name_logic,
         "email": validate_email_logic,
         "phone_number": validate_phone_logic,
-        "address": validate_address_logic,
-        "password": validate_password_logic
+        "address": validate_address_logic
     }
 
     for key, function in key_to_function_map.items():
@@ -137,7 +144,7 @@ def edit_customer_profile(customer_id: int, **kwargs):
         "email": update_email_logic,
         "phone_number": update_phone_logic,
         "address": update_address_logic,
-        "password": update_password_logic
+        "password_hash": update_password_hash_logic
     }
 
     for key, function in key_to_function_map.items():
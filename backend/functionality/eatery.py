@@ -1,22 +1,25 @@
-from typing import Literal, Optional, Tuple, Union, List
+from typing import Dict, Literal, Optional, Tuple, Union, List
 from datetime import datetime, timezone
 
 from functionality.errors import AuthorisationError, ValidationError, DuplicationError
-from functionality.recommendations import basic_recommend_sort, recommend_sort, top_3_vouchers
-from functionality.address import valid_address
-from functionality.authorisation import hash_password, verify_password
-from functionality.helpers import calc_average_rating, get_vouchers_unclaimed,validate_regex_phone, \
+from functionality.recommendations import basic_recommend_sort, nearby_eatery_distances, recommend_sort, top_3_vouchers
+from functionality.address import get_customer_location, valid_address
+from functionality.authorisation import PASSWORD_HISTORY_SIZE, hash_password, verify_password, verify_any_password
+from functionality.media import IMAGE_TYPES, MENU_TYPES, media_url, store_media, stored_media_path
+from functionality.helpers import average_rating, calc_average_rating, get_vouchers_unclaimed, validate_regex_phone, \
     validate_regex_password, validate_regex_email
 
 from db.db_types.db_request import ReviewCreationRequest
+from db.helpers import run_blocking
+from db.db_types.db_response import EateryCardDetailsResponse, VoucherTemplateDetailsResponse
 from db.helpers.eatery import get_all_eateries, get_eatery_by_id, get_eatery_keywords_by_id, \
-    update_eatery_email, update_eatery_name, update_eatery_phone, \
+    get_eatery_summary_by_id, get_eatery_summaries_by_ids, update_eatery_email, update_eatery_name, update_eatery_phone, \
     update_eatery_manager_name, update_eatery_description, update_eatery_thumbnail, \
     get_eatery_current_password_by_id, get_eatery_old_passwords_by_id, update_eatery_password, \
     delete_all_eatery_keywords, add_eatery_keywords, update_eatery_menu, update_eatery_address, \
-    get_eatery_by_email, get_eatery_by_phone_number
-from db.helpers.voucher import get_voucher_by_id, get_vouchers_by_voucher_template
-from db.helpers.voucher_instance import get_voucher_instances_by_status, get_voucher_instance_by_id, \
+    get_eatery_by_email, get_eatery_by_phone_number, get_eatery_cards_by_ids
+from db.helpers.voucher import get_voucher_by_id, get_voucher_counts_by_ids, get_vouchers_by_voucher_template
+from db.helpers.voucher_instance import get_voucher_instance_by_id, \
     get_voucher_instances_by_customer, get_voucher_instance_status, update_voucher_instance_review_status
 from db.helpers.voucher_template import get_voucher_template_by_id, get_voucher_templates_by_eatery
 from db.helpers.review import get_reviews_by_eatery, get_review_by_id, create_review
@@ -35,8 +38,12 @@ def list_eateries() -> HomePageResponse:
     if eatery_ids is None:
         raise ValidationError("Error retrieving eateries")
 
-    eateries_sorted = basic_recommend_sort(eatery_ids)
-    eateries = format_eatery_details(eateries_sorted)
+    cards = get_eatery_cards_by_ids(eatery_ids)
+    if cards is None:
+        raise ValidationError("Error retrieving eateries")
+
+    eateries_sorted = basic_recommend_sort(cards)
+    eateries = format_eatery_details(eateries_sorted, cards)
 
     return HomePageResponse(
         eateries=eateries
@@ -46,50 +53,39 @@ def recommend_eateries(customer_id: int, sorts: List[Sorts]) -> List[HomePageEat
     """
     reccomends eateries
     """
-    eatery_ids = get_all_eateries()
-    if eatery_ids is None:
+    # Only eateries close enough to recommend are loaded
+    distances = nearby_eatery_distances(get_customer_location(customer_id))
+
+    # Cards are only loaded for the eateries that are actually recommended
+    eatery_ids = recommend_sort(customer_id, distances, sorts)
+
+    cards = get_eatery_cards_by_ids(eatery_ids)
+    if cards is None:
         raise ValidationError("Error retrieving eateries")
-    eatery_ids = recommend_sort(customer_id, eatery_ids, sorts)
-    eateries = format_eatery_details(eatery_ids)
+
+    eateries = format_eatery_details(eatery_ids, cards)
     return eateries
 
-def format_eatery_details(eatery_ids: List[int]) -> List[HomePageEateryInformationResponse]:
+def format_eatery_details(eatery_ids: List[int], cards: Dict[int, EateryCardDetailsResponse]) -> List[HomePageEateryInformationResponse]:
     """
     Formats a list of eateries for the homepage response
     """
     eateries: List[HomePageEateryInformationResponse] = []
     for eatery_id in eatery_ids:
-        eatery = get_eatery_by_id(eatery_id)
-        if eatery is None:
+        card = cards.get(eatery_id)
+        if card is None:
             raise ValidationError("Error retrieving eatery")
-        vouchers = get_voucher_templates_by_eatery(eatery_id)
-        if vouchers is None:
-            raise ValidationError("Error retrieving vouchers")
 
         # gets top vouchers
-        top_vouchers = top_3_vouchers(eatery_id)
-
-        top_vouchers_tuples = []
-        for vouch_id in top_vouchers:
-            voucher = get_voucher_by_id(vouch_id)
-
-            if voucher is None:
-                raise ValidationError("Error retrieving voucher")
-
-            voucher_template = get_voucher_template_by_id(voucher.voucher_template)
-
-            if voucher_template is None:
-                raise ValidationError("Error retrieving voucher template")
-
-            top_vouchers_tuples.append((vouch_id, voucher_template.name))
+        top_vouchers = top_3_vouchers(card.vouchers)
 
         homepage_eatery = HomePageEateryInformationResponse(
             eatery_id=eatery_id,
-            eatery_name=eatery.business_name,
-            thumbnail_uri=eatery.thumbnail,
-            num_vouchers=get_vouchers_unclaimed(vouchers),
-            top_three_vouchers=top_vouchers_tuples,
-            average_rating=calc_average_rating(eatery_id)
+            eatery_name=card.business_name,
+            thumbnail_uri=media_url(card.thumbnail),
+            num_vouchers=sum(1 for voucher in card.vouchers if voucher.unclaimed > 0),
+            top_three_vouchers=[(voucher.voucher_id, voucher.name) for voucher in top_vouchers],
+            average_rating=average_rating(card.rating)
         )
 
         eateries.append(homepage_eatery)
@@ -113,8 +109,8 @@ def eatery_details(eatery_id: int, details_type: Literal["private", "public"]) -
             name=eatery.business_name,
             description=eatery.description,
             phone_number=eatery.phone,
-            thumbnail_uri=eatery.thumbnail,
-            menu_uri=eatery.menu,
+            thumbnail_uri=media_url(eatery.thumbnail_detail or eatery.thumbnail),
+            menu_uri=media_url(eatery.menu),
             keywords=eatery_keywords,
             average_rating=calc_average_rating(eatery_id),
             address=AddressResponse(
@@ -131,8 +127,9 @@ def eatery_details(eatery_id: int, details_type: Literal["private", "public"]) -
         manager_first_name=eatery.manager_first_name,
         manager_last_name=eatery.manager_last_name,
         abn=eatery.abn,
-        thumbnail_uri=eatery.thumbnail,
-        menu_uri=eatery.menu,
+        # The owner gets the original back, sending it with other edits leaves the thumbnail alone
+        thumbnail_uri=media_url(eatery.thumbnail),
+        menu_uri=media_url(eatery.menu),
         keywords=eatery_keywords,
         date_joined=eatery.date_joined,
         average_rating=calc_average_rating(eatery_id),
@@ -142,6 +139,29 @@ def eatery_details(eatery_id: int, details_type: Literal["private", "public"]) -
         )
     )
 
+async def new_eatery_password_hash(eatery_id: int, password: str) -> str:
+    """
+    Checks a new password against the eatery's current and past passwords, then hashes it
+
+    Done before edit_eatery_profile, so the hashing is awaited rather than run while holding a database thread
+    """
+    if not isinstance(password, str):
+        raise ValidationError("Password must be a string")
+
+    validate_regex_password(password)
+
+    curr_password = await run_blocking(get_eatery_current_password_by_id, eatery_id)
+    if curr_password is None:
+        raise ValidationError("Password could not be retrieved")
+    if not await verify_password(password, curr_password):
+        past_passwords = await run_blocking(get_eatery_old_passwords_by_id, eatery_id, PASSWORD_HISTORY_SIZE)
+        if past_passwords is None:
+            raise ValidationError("Error retrieving past passwords")
+        if await verify_any_password(password, past_passwords):
+            raise ValueError("Password is the same as a past password")
+
+    return await hash_password(password)
+
 def edit_eatery_profile(eatery_id: int, **kwargs):
     """
     Updates an eatery's details including thumbnail
@@ -154,7 +174,7 @@ def edit_eatery_profile(eatery_id: int, **kwargs):
      - manager_last_name
      - address
      - description
-     - password
+     - password_hash, from new_eatery_password_hash
      - keywords
      - thumbnail_uri
      - menu_uri
@@ -234,32 +254,20 @@ def edit_eatery_profile(eatery_id: int, **kwargs):
         if eatery_info is not None and eatery_info.description != description:
             update_eatery_description(eatery_id, description)
 
-    def validate_password_logic(password: str):
-        if not isinstance(password, str):
-            raise ValidationError("Password must be a string")
-
-        validate_regex_password(password)
-
-        curr_password = get_eatery_current_password_by_id(eatery_id)
-        if curr_password is None:
-            raise ValidationError("Password could not be retrieved")
-        if not verify_password(password, curr_password):
-            past_passwords = get_eatery_old_passwords_by_id(eatery_id)
-            if past_passwords is None:
-                raise ValidationError("Error retrieving past passwords")
-            if hash_password(password) in past_passwords:
-                raise ValueError("Password is the same as a past password")
-
-    def update_password_logic(password: str):
-        update_eatery_password(eatery_id, hash_password(password), datetime.now(timezone.utc))
+    def update_password_hash_logic(password_hash: str):
+        update_eatery_password(eatery_id, password_hash, datetime.now(timezone.utc), PASSWORD_HISTORY_SIZE)
 
     def validate_thumbnail_uri_logic(thumbnail_uri: str):
         if not isinstance(thumbnail_uri, str):
             raise ValidationError("Thumbnail must be a string")
 
+        # Uploads are written to the media store once here, only the name they are stored under is saved
+        kwargs["thumbnail_uri"] = store_media(thumbnail_uri, IMAGE_TYPES)
+
     def update_thumbnail_uri_logic(thumbnail_uri: str):
-        if eatery_info is not None and eatery_info.thumbnail != thumbnail_uri:
-            update_eatery_thumbnail(eatery_id, thumbnail_uri)
+        # A rendition read back from the details is the current thumbnail, not a new upload
+        if eatery_info is not None and thumbnail_uri not in (eatery_info.thumbnail, eatery_info.thumbnail_card, eatery_info.thumbnail_detail):
+            update_eatery_thumbnail(eatery_id, thumbnail_uri, renditions_pending=stored_media_path(thumbnail_uri) is not None)
 
     def validate_keywords_logic(keywords: List[str]):
         if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
@@ -274,7 +282,9 @@ def edit_eatery_profile(eatery_id: int, **kwargs):
 
     def validate_menu_uri_logic(menu_uri: str):
         if not isinstance(menu_uri, str):
-            raise ValidationError("Thumbnail must be a string")
+            raise ValidationError("Menu must be a string")
+
+        kwargs["menu_uri"] = store_media(menu_uri, MENU_TYPES)
 
     def update_menu_uri_logic(menu_uri: str):
         if eatery_info is not None and eatery_info.menu != menu_uri:
@@ -289,7 +299,6 @@ def edit_eatery_profile(eatery_id: int, **kwargs):
         "manager_last_name": validate_manager_last_name_logic,
         "address": validate_address_logic,
         "description": validate_description_logic,
-        "password": validate_password_logic,
         "keywords": validate_keywords_logic,
         "thumbnail_uri": validate_thumbnail_uri_logic,
         "menu_uri": validate_menu_uri_logic,
@@ -309,7 +318,7 @@ def edit_eatery_profile(eatery_id: int, **kwargs):
         "manager_last_name": update_manager_last_name_logic,
         "address": update_address_logic,
         "description": update_description_logic,
-        "password": update_password_logic,
+        "password_hash": update_password_hash_logic,
         "keywords": update_keywords_logic,
         "thumbnail_uri": update_thumbnail_uri_logic,
         "menu_uri": update_menu_uri_logic,
@@ -329,7 +338,7 @@ def eatery_vouchers(eatery_id: int) -> EateryVoucherListResponse:
     if all_vouchers is None:
         raise ValidationError("Error retrieving eatery's vouchers")
 
-    vouchers: List[EateryVoucherResponse] = []
+    template_vouchers: List[Tuple[VoucherTemplateDetailsResponse, List[int]]] = []
 
     for voucher_template_id in all_vouchers:
         voucher_template = get_voucher_template_by_id(voucher_template_id)
@@ -342,24 +351,30 @@ def eatery_vouchers(eatery_id: int) -> EateryVoucherListResponse:
         if voucher_ids is None:
             continue
 
+        template_vouchers.append((voucher_template, voucher_ids))
+
+    # Availability for every voucher on the page comes from one lookup
+    counts = get_voucher_counts_by_ids([voucher_id for _, voucher_ids in template_vouchers for voucher_id in voucher_ids])
+
+    if counts is None:
+        raise ValidationError("Error retrieving unclaimed voucher instances")
+
+    vouchers: List[EateryVoucherResponse] = []
+
+    for voucher_template, voucher_ids in template_vouchers:
         for voucher_id in voucher_ids:
             voucher = get_voucher_by_id(voucher_id)
 
             if voucher is None:
                 raise ValidationError("Error retrieving voucher by id")
 
-            unclaimed = get_voucher_instances_by_status(voucher_id, "unclaimed")
-
-            if unclaimed is None:
-                raise ValidationError("Error retrieving unclaimed voucher instances")
-
             vouchers.append(EateryVoucherResponse(
                 voucher_id=voucher_id,
                 name=voucher_template.name,
                 description=voucher_template.description,
                 conditions=voucher_template.conditions,
-                total_quantity=voucher.quantity,
-                unclaimed_quantity=len(unclaimed),
+                total_quantity=counts[voucher_id].total,
+                unclaimed_quantity=counts[voucher_id].unclaimed,
                 expiry=voucher.expiry_date
             ))
 
@@ -433,7 +448,7 @@ def eatery_review_creation(eatery_id: int, customer_id: int, review: ReviewCreat
     """
     Creates a review for a logged in customer who has claimed and redeemed a voucher but is yet to review
     """
-    eatery = get_eatery_by_id(eatery_id)
+    eatery = get_eatery_summary_by_id(eatery_id)
     if eatery is None:
         raise ValidationError("Error retrieving eatery")
 
@@ -485,8 +500,10 @@ def get_eatery_information_responses() -> List[EateryInformationResponse]:
     if eatery_ids is None:
         raise ValidationError("No eateries found")
 
+    summaries = get_eatery_summaries_by_ids(eatery_ids)
+
     for eatery_id in eatery_ids:
-        eatery = get_eatery_by_id(eatery_id)
+        eatery = summaries.get(eatery_id)
 
         if eatery is None:
             continue
@@ -506,7 +523,7 @@ def get_eatery_information_responses() -> List[EateryInformationResponse]:
         responses.append(EateryInformationResponse(
             eatery_id=eatery_id,
             eatery_name=eatery.business_name,
-            thumbnail_uri=eatery.thumbnail,
+            thumbnail_uri=media_url(eatery.thumbnail),
             num_vouchers=get_vouchers_unclaimed(vouchers),
             top_three_vouchers=top_vouchers if len(top_vouchers) > 0 else [(1, "dummy 1"), (2, "dummy 2"), (3, "dummy 3")],
             average_rating=calc_average_rating(eatery_id)
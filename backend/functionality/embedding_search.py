@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from db.db_types.db_response import EaterySearchDocumentResponse
+from db.helpers.search_index import eatery_name_terms, get_eatery_search_documents
+
+# Width of the hashed feature space every text is embedded into
+EMBEDDING_DIM = 256
+
+# How long a built index is reused before it is rebuilt from the database
+EMBEDDING_INDEX_TTL = float(os.environ.get("SMART_SEARCH_EMBEDDING_TTL_SECONDS", "60"))
+
+@lru_cache(maxsize=100_000)
+def _trigram_columns(word: str) -> Tuple[int, ...]:
+    """
+    Gets the hashed columns of a word's character trigrams, padded so prefixes and suffixes count too
+    """
+    padded = f"#{word}#"
+
+    # crc32 rather than hash() so vectors are the same in every process
+    return tuple(zlib.crc32(padded[i:i + 3].encode()) % EMBEDDING_DIM for i in range(max(len(padded) - 2, 1)))
+
+def embed(texts: List[str]) -> np.ndarray:
+    """
+    Embeds each text as an L2 normalised vector of hashed character trigram counts
+
+    Shared trigrams give related spellings (burger / burgers) a high cosine similarity without a model or network call
+    """
+    rows: List[int] = []
+    columns: List[int] = []
+
+    for row, text in enumerate(texts):
+        for word in re.findall(r"\w+", text.lower()):
+            word_columns = _trigram_columns(word)
+            rows.extend([row] * len(word_columns))
+            columns.extend(word_columns)
+
+    # Count every (row, column) pair in one pass over the flattened matrix
+    flat = np.array(rows, dtype=np.int64) * EMBEDDING_DIM + np.array(columns, dtype=np.int64)
+    matrix = np.bincount(flat, minlength=len(texts) * EMBEDDING_DIM).astype(np.float32).reshape(len(texts), EMBEDDING_DIM)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    return matrix
+
+def document_terms(document: EaterySearchDocumentResponse) -> List[str]:
+    """
+    Gets the texts an eatery is matched on, its keywords, name and description
+    """
+    terms = list(document.keywords)
+    terms.append(document.business_name)
+    terms.extend(eatery_name_terms(document.business_name))
+
+    if document.description:
+        terms.append(document.description)
+
+    return terms
+
+class EmbeddingIndex:
+    """
+    A contiguous matrix holding one row per eatery term, along with the eatery each row belongs to
+    """
+    def __init__(self, documents: Dict[int, EaterySearchDocumentResponse]):
+        self.eatery_ids = np.array(list(documents), dtype=np.int64)
+        self.postcodes = np.array([_postcode_number(document.postcode) for document in documents.values()], dtype=np.float64)
+
+        terms: List[str] = []
+        owners: List[int] = []
+        for position, document in enumerate(documents.values()):
+            for term in document_terms(document):
+                terms.append(term)
+                owners.append(position)
+
+        self.owners = np.array(owners, dtype=np.int64)
+        self.matrix = np.ascontiguousarray(embed(terms))
+        self.built_at = time.monotonic()
+
+    def search(self, prompt_words: List[str], threshold: int = 70, top_k: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Scores every eatery against the prompt words and returns (eatery ID, score) for those above the threshold, best first
+
+        An eatery's score is the best score of any of its terms against any prompt word, as in score_eatery
+        """
+        scores = np.zeros(len(self.eatery_ids), dtype=np.float64)
+
+        words = [word for word in prompt_words if not word.isnumeric()]
+        if words and len(self.owners) > 0:
+            # Cosine similarity of every term against every prompt word, scaled to a percentage
+            similarity = (self.matrix @ embed(words).T).max(axis=1) * 100
+            np.maximum.at(scores, self.owners, similarity)
+
+        # Numeric prompt words are treated as postcodes, anything within 3 is a full match
+        for word in prompt_words:
+            if word.isnumeric():
+                scores[np.abs(self.postcodes - int(word)) <= 3] = 100
+
+        scores = np.rint(scores)
+        matched = np.flatnonzero(scores > threshold)
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+
+        if top_k is not None:
+            ranked = ranked[:top_k]
+
+        return [(int(self.eatery_ids[i]), int(scores[i])) for i in ranked]
+
+_index: Optional[EmbeddingIndex] = None
+_index_lock = threading.Lock()
+
+def get_embedding_index() -> EmbeddingIndex:
+    """
+    Gets the embedding index, rebuilding it from the database once it is older than the TTL
+    """
+    global _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _index.built_at > EMBEDDING_INDEX_TTL:
+            _index = EmbeddingIndex(get_eatery_search_documents())
+
+        return _index
+
+def invalidate_embedding_index():
+    """
+    Forces the next search to rebuild the embedding index
+    """
+    global _index
+    with _index_lock:
+        _index = None
+
+def embedding_search_ids(prompt_words: List[str]) -> List[Tuple[int, int]]:
+    """
+    Given prompt words, returns the matching eatery IDs and their scores, best first
+    """
+    return get_embedding_index().search(prompt_words)
+
+def _postcode_number(postcode: str) -> float:
+    """
+    Gets a postcode as a number, postcodes that aren't numeric never match
+    """
+    return float(postcode) if postcode.strip().isnumeric() else np.inf
@@ -25,3 +25,13 @@ class AuthorisationError(Exception):
     def __init__(self, message: str):
         super().__init__(message)
         self.message = message
+
+class ServiceUnavailableError(Exception):
+    """
+    An error for when the server is too busy to take on more work right now
+
+    The client should back off and try again shortly
+    """
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
@@ -1,10 +1,11 @@
 import re
-from typing import List
+from typing import Dict, List
 
 from functionality.errors import ValidationError
 
-from db.helpers.review import get_review_by_id, get_reviews_by_eatery
-from db.helpers.voucher_instance import get_voucher_instances_by_status
+from db.db_types.db_response import RatingDetailsResponse
+from db.helpers.review import get_review_by_id, get_eatery_ratings_by_ids
+from db.helpers.voucher import get_voucher_counts_by_ids
 
 def validate_regex_phone(phone: str) -> bool:
     """
@@ -40,30 +41,20 @@ def get_vouchers_unclaimed(vouchers: List[int]) -> int:
     """
     Gets the number of vouchers remaining that can be claimed
     """
-    num_vouchers = 0
-    for vid in vouchers:        
-        unclaimed_vouchers = get_voucher_instances_by_status(vid, "unclaimed")
-        if unclaimed_vouchers is None:
-            raise ValidationError("Error retrieving vouchers")
-        
-        if len(unclaimed_vouchers) > 0:
-            num_vouchers += 1
-    
-    return num_vouchers
+    counts = get_voucher_counts_by_ids(vouchers)
+    if counts is None:
+        raise ValidationError("Error retrieving vouchers")
 
-def get_average_eatery_rating_sort(eatery_id: int) -> float:
+    return sum(1 for count in counts.values() if count.unclaimed > 0)
+
+def average_rating_sort(rating: RatingDetailsResponse) -> float:
     """
-    Gets an eateries average rating
+    Gets the average rating used for sorting from a rating aggregate
     """
-    reviews = get_reviews_by_eatery(eatery_id)
-    if reviews is None:
-        raise ValueError("Error retrieving reviews for eatery")
-    ratings = get_raw_rating(reviews)
-
     # if no ratings default to 3 stars for sorting
-    if len(ratings) == 0:
+    if rating.review_count == 0:
         return 2.7
-    return sum(ratings) // len(ratings)
+    return rating.rating_total // rating.review_count
 
 def get_raw_rating(review_ids: List[int]) -> List[float]:
     """
@@ -81,16 +72,34 @@ def calc_average_rating(eatery_id: int) -> float:
     """
     Calculates average rating for an eatery
     """
-    all_reviews = get_reviews_by_eatery(eatery_id)
+    return calc_average_ratings([eatery_id])[eatery_id]
+
+def calc_average_ratings(eatery_ids: List[int]) -> Dict[int, float]:
+    """
+    Calculates average ratings for many eateries at once
+    """
+    ratings = get_eatery_ratings_by_ids(eatery_ids)
 
-    if all_reviews is None:
+    if ratings is None:
         raise ValidationError("Error retrieving eatery reviews")
 
-    ratings = map(lambda review_id: get_review_by_id(review_id).rating, all_reviews)
-    valid_ratings = list(filter(lambda x: x is not None, ratings))
+    return {eatery_id: average_rating(rating) for eatery_id, rating in ratings.items()}
 
+def average_rating(rating: RatingDetailsResponse) -> float:
+    """
+    Calculates the average rating from a rating aggregate
+    """
     # Avoid division by zero
-    if len(valid_ratings) == 0:
+    if rating.review_count == 0:
         return 0.0
 
-    return sum(valid_ratings) / len(valid_ratings)
+    return rating.rating_total / rating.review_count
+
+def average_voucher_rating(rating: RatingDetailsResponse) -> float:
+    """
+    Calculates a vouchers displayed rating from its template's rating aggregate
+    """
+    if rating.review_count == 0:
+        return 0
+
+    return round(rating.rating_total / rating.review_count, 1)
@@ -0,0 +1,150 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+from logger import log_purple
+
+from functionality.errors import ValidationError
+
+from db.helpers.eatery import get_eatery_by_id, get_eateries_with_inline_media, update_eatery_menu, update_eatery_thumbnail
+
+# Where uploaded images and menus are written, named by the hash of their contents
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "media")
+
+# What stored media URLs start with, point it at a CDN or proxy in front of the media router if there is one
+# Only the name of stored media is saved, so this can change without touching the database
+MEDIA_BASE_URL = os.environ.get("MEDIA_BASE_URL", "http://localhost:8080/media").rstrip("/")
+
+# The file extension stored media of each MIME type is given
+IMAGE_TYPES = {
+    "image/jpeg": "jpeg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif"
+}
+MENU_TYPES = {**IMAGE_TYPES, "application/pdf": "pdf"}
+
+# The MIME type each extension is served as
+CONTENT_TYPES = {extension: mime_type for mime_type, extension in MENU_TYPES.items()}
+
+DATA_URL = re.compile(r"^data:([\w.+-]+/[\w.+-]+)(?:;[^,;]*?)*;base64,", re.IGNORECASE)
+MEDIA_NAME = re.compile(r"^([0-9a-f]{64})\.(\w+)$")
+
+def is_data_url(uri: str) -> bool:
+    """
+    Checks whether a URI holds its contents inline rather than pointing somewhere
+    """
+    return uri.startswith("data:")
+
+def store_media(uri: str, allowed_types: Dict[str, str]) -> str:
+    """
+    Writes the contents of a base64 data URL to the media store, returning the name it is stored under
+
+    A URL the media store serves is given back as its name, anything else that isn't a data URL is returned as is.
+    Identical uploads share one file, so storing the same image twice is free.
+    """
+    if not is_data_url(uri):
+        return media_name(uri) or uri
+
+    match = DATA_URL.match(uri)
+    if match is None:
+        raise ValidationError("Uploads must be base64 data URLs")
+
+    mime_type = match.group(1).lower()
+    if mime_type not in allowed_types:
+        raise ValidationError(f"Uploads of type {mime_type} are not allowed")
+
+    try:
+        data = base64.b64decode(uri[match.end():], validate=True)
+    except binascii.Error as e:
+        raise ValidationError("Upload is not valid base64") from e
+
+    return write_media(data, allowed_types[mime_type])
+
+def write_media(data: bytes, extension: str) -> str:
+    """
+    Writes media to the store under the hash of its contents, returning the name it is stored under
+    """
+    name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+    path = os.path.join(MEDIA_ROOT, name)
+
+    if not os.path.exists(path):
+        os.makedirs(MEDIA_ROOT, exist_ok=True)
+
+        # Written aside and renamed into place so a half written file is never served
+        fd, temp_path = tempfile.mkstemp(dir=MEDIA_ROOT, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            os.unlink(temp_path)
+            raise
+
+    return name
+
+def media_path(name: str) -> Optional[str]:
+    """
+    Gets the path of stored media from the name in its URL, or None if there is no such media
+    """
+    match = MEDIA_NAME.match(name)
+    if match is None or match.group(2) not in CONTENT_TYPES:
+        return None
+
+    path = os.path.join(MEDIA_ROOT, name)
+    return path if os.path.isfile(path) else None
+
+def stored_media_path(reference: str) -> Optional[str]:
+    """
+    Gets the path of stored media from what is saved for it, or None if it isn't in the media store
+    """
+    return media_path(reference)
+
+def media_name(uri: str) -> Optional[str]:
+    """
+    Gets the name of stored media from the URL it is served from, or None if the URL doesn't point at the media store
+    """
+    if not uri.startswith(MEDIA_BASE_URL + "/"):
+        return None
+
+    name = uri[len(MEDIA_BASE_URL) + 1:]
+    return name if MEDIA_NAME.match(name) else None
+
+def media_url(reference: Optional[str]) -> Optional[str]:
+    """
+    Gets the URL to respond with for saved media, anything not in the media store is already a URL
+    """
+    if reference is None or MEDIA_NAME.match(reference) is None:
+        return reference
+
+    return f"{MEDIA_BASE_URL}/{reference}"
+
+def media_content_type(name: str) -> str:
+    """
+    Gets the MIME type stored media is served as
+    """
+    return CONTENT_TYPES[name.rsplit(".", 1)[1]]
+
+def move_inline_media():
+    """
+    Moves thumbnails and menus saved before the media store existed out of the database
+    """
+    eatery_ids = get_eateries_with_inline_media()
+
+    for eatery_id in eatery_ids:
+        eatery = get_eatery_by_id(eatery_id)
+        if eatery is None:
+            continue
+
+        if eatery.thumbnail is not None and is_data_url(eatery.thumbnail):
+            update_eatery_thumbnail(eatery_id, store_media(eatery.thumbnail, IMAGE_TYPES), renditions_pending=True)
+
+        if eatery.menu is not None and is_data_url(eatery.menu):
+            update_eatery_menu(eatery_id, store_media(eatery.menu, MENU_TYPES))
+
+    if eatery_ids:
+        log_purple(f"Moved the inline media of \"{len(eatery_ids)}\" Eateries to the media store")
@@ -1,16 +1,45 @@
 import os
-
-from datetime import datetime
-
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Optional
+from datetime import datetime, timedelta, timezone
+
+import requests
 from mailersend import emails
 from pydantic import BaseModel
 
-from logger import log_green
+from logger import log_green, log_red
+
+import metrics
+from db.db_types.db_request import MailCreationRequest
+from db.db_types.db_response import MailDetailsResponse
+from db.helpers.mail_outbox import enqueue_mail, claim_mail_batch, extend_mail_lease, mark_mail_sent, mark_mail_failed, \
+    count_pending_mail
 
 USE_EMAIL = os.environ.get("EMAILS_ENABLED", "False")
 API_KEY = os.environ.get("MAILERSENDER_API_KEY", "NO_KEY")
 EMAIL_FROM = os.environ.get("EMAIL_ADDRESS", "NO_EMAIL")
 
+# Emails sent per batch by the mail worker and how long a batch is leased for before another worker may retry it
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", "50"))
+MAIL_LEASE_SECONDS = float(os.environ.get("MAIL_LEASE_SECONDS", "120"))
+
+# Failed emails are retried after MAIL_BACKOFF_SECONDS, doubling each time, up to MAIL_MAX_ATTEMPTS sends
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_BACKOFF_SECONDS = float(os.environ.get("MAIL_BACKOFF_SECONDS", "30"))
+
+# How long a single send to MailerSend may take before it fails and is retried like any other failure
+MAIL_SEND_TIMEOUT_SECONDS = float(os.environ.get("MAIL_SEND_TIMEOUT_SECONDS", "10"))
+
+send_time = metrics.histogram("mail_send_seconds", "Time taken to hand a single email to the mail transport")
+sent_count = metrics.counter("mail_sent", "Emails sent")
+failed_count = metrics.counter("mail_send_failures", "Email sends that failed and will be retried or given up on")
+
+_outbox_depth: int = 0
+metrics.gauge("mail_outbox_depth", "Emails waiting to be sent, as of the mail worker's last batch", lambda: _outbox_depth)
+
 class VoucherClaimEmailRequest(BaseModel):
     eatery_name: str
     voucher_name: str
@@ -24,7 +53,7 @@ class VoucherBookingEmailRequest(BaseModel):
     voucher_code: str
     voucher_expiry: datetime
 
-def send_customer_welcome_email(to_email: str, to_name: str):
+def send_customer_welcome_email(to_email: str, to_name: str, dedupe_key: str):
     """
     Send a welcome email to a customer
     """
@@ -35,9 +64,9 @@ def send_customer_welcome_email(to_email: str, to_name: str):
                 <p>We're excited to have you on board as a customer. You can now start exploring eateries and making voucher bookings.</p>"""
     text = f"""Hi {to_name},\n\nWelcome to ChowDown! We're excited to have you on board as a customer. 
                 You can now start exploring eateries and making voucher bookings.\n\nHappy dining!"""
-    send_email(subject, to_email, to_name, text, html_text)
+    send_email(subject, to_email, to_name, text, html_text, dedupe_key)
 
-def send_eatery_welcome_email(to_email: str, to_name: str):
+def send_eatery_welcome_email(to_email: str, to_name: str, dedupe_key: str):
     """
     Send a welcome email to an eatery
     """
@@ -47,9 +76,9 @@ def send_eatery_welcome_email(to_email: str, to_name: str):
                     <p>We're excited to have you on board as an eatery. You can now start creating voucher templates and managing your bookings.</p>"""
     text = f"""Hi {to_name},\n\nWelcome to ChowDown! We're excited to have you on board as an eatery. 
                 You can now start creating voucher templates and managing your bookings.\n\nHappy dining!"""
-    send_email(subject, to_email, to_name, text, html_text)
+    send_email(subject, to_email, to_name, text, html_text, dedupe_key)
 
-def send_voucher_claiming_email(to_email: str, to_name: str, voucher_request: VoucherClaimEmailRequest):
+def send_voucher_claiming_email(to_email: str, to_name: str, voucher_request: VoucherClaimEmailRequest, dedupe_key: str):
     """
     Send an email to a customer who has claimed a voucher
     """
@@ -61,9 +90,9 @@ def send_voucher_claiming_email(to_email: str, to_name: str, voucher_request: Vo
                 <p>This voucher expires {voucher_request.voucher_expiry}</p>"""
     text = f"""Hi {to_name},\n\nThank you for claiming a voucher with ChowDown! You have successfully claimed a voucher for {voucher_request.voucher_name}.\n\n
                 Voucher Description: {voucher_request.voucher_description}\n\nThis voucher expires {voucher_request.voucher_expiry}"""
-    send_email(subject, to_email, to_name, text, html_text)
+    send_email(subject, to_email, to_name, text, html_text, dedupe_key)
 
-def send_voucher_booking_email(to_email: str, to_name: str, voucher_request: VoucherBookingEmailRequest):
+def send_voucher_booking_email(to_email: str, to_name: str, voucher_request: VoucherBookingEmailRequest, dedupe_key: str):
     """
     Send an email to a customer who has booked a voucher
     """
@@ -79,41 +108,130 @@ def send_voucher_booking_email(to_email: str, to_name: str, voucher_request: Vou
             Your booking at {voucher_request.eatery_name} has been confirmed and you are entitled to a voucher for {voucher_request.voucher_name}.\n\n
             Voucher Description: {voucher_request.voucher_description}\n\nThis voucher expires {voucher_request.voucher_expiry}\n\n
             Please use the following code to redeem your voucher:\n\nVoucher Code: {voucher_request.voucher_code}"""
-    send_email(subject, to_email, to_name, text, html_text)
+    send_email(subject, to_email, to_name, text, html_text, dedupe_key)
 
-def send_email(subject: str, to_email: str, to_name: str, text: str, html_text: str = ""):
-    """
-    Send an email message
+def send_email(subject: str, to_email: str, to_name: str, text: str, html_text: str = "", dedupe_key: Optional[str] = None):
     """
-    if USE_EMAIL == "True":
-        _send_message(subject, to_email, to_name, text, html_text)
+    Queues an email message in the outbox, it is sent by the mail worker once the current transaction commits
 
-def _send_message(subject: str, to_email: str, to_name: str, text: str, html_text: str = ""):
+    Messages with the same dedupe key are only ever queued once, without one identical messages are deduplicated
     """
-    Send an email message
+    if dedupe_key is None:
+        dedupe_key = hashlib.sha256("\0".join([to_email, subject, text, html_text]).encode()).hexdigest()
+
+    enqueue_mail(MailCreationRequest(
+        dedupe_key=dedupe_key,
+        to_email=to_email,
+        to_name=to_name,
+        subject=subject,
+        text=text,
+        html_text=html_text
+    ))
+
+class MailTransport(ABC):
     """
-    mailer = emails.NewEmail(API_KEY)
+    Somewhere the mail worker can hand emails to
+    """
+    @abstractmethod
+    def send(self, mail: MailDetailsResponse):
+        """
+        Sends an email, raising if it could not be sent
+        """
 
-    mail_body = {}
+class MailerSendTransport(MailTransport):
+    """
+    Sends emails through the MailerSend API
+    """
+    def send(self, mail: MailDetailsResponse):
+        """
+        Sends an email through MailerSend, raising if the API doesn't accept it
+        """
+        mailer = emails.NewEmail(API_KEY)
 
-    mail_from = {
-        "name": "ChowDown",
-        "email": EMAIL_FROM,
-    }
+        mail_body = {}
 
-    receipients = [
-        {
-            "name": to_name,
-            "email": to_email,
+        mail_from = {
+            "name": "ChowDown",
+            "email": EMAIL_FROM,
         }
-    ]
 
-    mailer.set_mail_from(mail_from, mail_body)
-    mailer.set_mail_to(receipients, mail_body)
-    mailer.set_subject(subject, mail_body)
-    mailer.set_html_content(html_text, mail_body)
-    mailer.set_plaintext_content(text, mail_body)
+        receipients = [
+            {
+                "name": mail.to_name,
+                "email": mail.to_email,
+            }
+        ]
 
-    res = mailer.send(mail_body)
+        mailer.set_mail_from(mail_from, mail_body)
+        mailer.set_mail_to(receipients, mail_body)
+        mailer.set_subject(mail.subject, mail_body)
+        mailer.set_html_content(mail.html_text, mail_body)
+        mailer.set_plaintext_content(mail.text, mail_body)
 
-    log_green(f"Email sent to {to_email} with status code {res}")
+        # Posted here rather than with mailer.send, which waits on the API with no timeout at all
+        res = requests.post(f"{mailer.api_base}/email", headers=mailer.headers_default, json=mail_body, timeout=MAIL_SEND_TIMEOUT_SECONDS)
+        if not res.ok:
+            raise RuntimeError(f"MailerSend rejected the email: {res.status_code}\n{res.text}")
+
+        log_green(f"Email sent to {mail.to_email} with status code {res.status_code}")
+
+class FakeMailTransport(MailTransport):
+    """
+    Keeps the most recent emails in memory instead of sending them, used when emails are disabled and in tests
+
+    Set `failures` to make that many upcoming sends fail
+    """
+    def __init__(self, keep: int = 1000):
+        self.sent: Deque[MailDetailsResponse] = deque(maxlen=keep)
+        self.failures = 0
+
+    def send(self, mail: MailDetailsResponse):
+        """
+        Records an email as sent, or fails if failures are pending
+        """
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("Fake mail transport failure")
+
+        self.sent.append(mail)
+
+mail_transport: MailTransport = MailerSendTransport() if USE_EMAIL == "True" else FakeMailTransport()
+
+def deliver_mail_batch(transport: Optional[MailTransport] = None) -> int:
+    """
+    Sends a batch of due emails from the outbox, returning how many were taken
+
+    Emails that fail are retried with exponential backoff until they run out of attempts
+    """
+    global _outbox_depth
+    transport = transport or mail_transport
+
+    now = datetime.now(timezone.utc)
+    batch = claim_mail_batch(MAIL_BATCH_SIZE, MAIL_MAX_ATTEMPTS, now + timedelta(seconds=MAIL_LEASE_SECONDS))
+    leased_at = time.monotonic()
+
+    for position, mail in enumerate(batch):
+        # Renew the lease on the rest of the batch once half of it has gone, so a slow API can't let another worker take them
+        if time.monotonic() - leased_at > MAIL_LEASE_SECONDS / 2:
+            extend_mail_lease([pending.id for pending in batch[position:]], datetime.now(timezone.utc) + timedelta(seconds=MAIL_LEASE_SECONDS))
+            leased_at = time.monotonic()
+
+        start = time.monotonic()
+        try:
+            transport.send(mail)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            # Whatever went wrong, the email stays in the outbox to be tried again
+            failed_count.inc()
+            log_red(f"Error sending Email {mail.id} (attempt {mail.attempts + 1}): {e}")
+            backoff = MAIL_BACKOFF_SECONDS * 2 ** mail.attempts
+            mark_mail_failed(mail.id, str(e), datetime.now(timezone.utc) + timedelta(seconds=backoff))
+        else:
+            # Marked straight away so a worker dying part way through the batch never sends this email again
+            mark_mail_sent([mail.id])
+            sent_count.inc()
+        finally:
+            send_time.observe(time.monotonic() - start)
+
+    _outbox_depth = count_pending_mail(MAIL_MAX_ATTEMPTS)
+
+    return len(batch)
@@ -0,0 +1,150 @@
+"""
+A module which runs password hashing on a pool of worker processes
+"""
+import asyncio
+import os
+import threading
+import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, List, Optional, Set, TypeVar
+from passlib.context import CryptContext
+
+import metrics
+from functionality.errors import ServiceUnavailableError
+
+# One worker per core, bcrypt is pure CPU so more would only queue inside the OS instead
+HASHING_WORKERS = int(os.environ.get("PASSWORD_HASHING_WORKERS", str(os.cpu_count() or 1)))
+
+# Hashes queued or running at once before new ones are turned away
+HASHING_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASHING_QUEUE_LIMIT", str(HASHING_WORKERS * 8)))
+
+hash_time = metrics.histogram("password_hash_seconds", "Time to hash or verify a password, including time queued")
+rejections = metrics.counter("password_hash_rejections", "Hashes turned away because the queue was full")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+T = TypeVar("T")
+
+def _hash(password: str) -> str:
+    """
+    Hashes a password, runs in a worker process
+    """
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verifies against a hashed password, runs in a worker process
+    """
+    return pwd_context.verify(plain_password, hashed_password)
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a pool of worker processes so hashing uses every core and never holds up the server
+
+    At most `queue_limit` hashes are queued or running at once, beyond that callers get a ServiceUnavailableError
+
+    Results are awaited on the event loop, so a request waiting on a hash does not hold one of the database threads
+    """
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    async def hash(self, password: str) -> str:
+        """
+        Hashes a password
+        """
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verifies against a hashed password
+        """
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def verify_any(self, plain_password: str, hashed_passwords: List[str]) -> bool:
+        """
+        Verifies against several hashed passwords at once, returning as soon as one matches
+        """
+        start = time.monotonic()
+        pending: Set["asyncio.Future[bool]"] = set()
+        try:
+            for hashed_password in hashed_passwords:
+                pending.add(asyncio.wrap_future(self.submit(_verify, plain_password, hashed_password)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(future.result() for future in done):
+                    return True
+
+            return False
+        finally:
+            # Anything still queued after a match or a failure is no longer needed
+            for future in pending:
+                future.cancel()
+            hash_time.observe(time.monotonic() - start)
+
+    def submit(self, func: Callable[..., T], *args: Any) -> "Future[T]":
+        """
+        Queues a call on the worker processes, turning it away if the queue is full
+        """
+        with self.lock:
+            if self.in_flight >= self.queue_limit:
+                rejections.inc()
+                raise ServiceUnavailableError("Server is busy, please try again shortly")
+
+            if self.executor is None:
+                # Spawn rather than fork, forking a process with running threads can copy held locks
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+            self.in_flight += 1
+            try:
+                future = self.executor.submit(func, *args)
+            except BaseException:
+                self.in_flight -= 1
+                raise
+
+        future.add_done_callback(self._release)
+        return future
+
+    def shutdown(self):
+        """
+        Stops the worker processes, they are started again on the next hash
+        """
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def queue_depth(self) -> int:
+        """
+        Gets the number of hashes queued or running
+        """
+        with self.lock:
+            return self.in_flight
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Runs a call on the worker processes and awaits its result
+        """
+        start = time.monotonic()
+        try:
+            return await asyncio.wrap_future(self.submit(func, *args))
+        finally:
+            hash_time.observe(time.monotonic() - start)
+
+    def _release(self, _: Future):
+        """
+        Frees a queue slot once a call has finished
+        """
+        with self.lock:
+            self.in_flight -= 1
+
+password_hasher = PasswordHasher(HASHING_WORKERS, HASHING_QUEUE_LIMIT)
+
+metrics.gauge("password_hash_queue_depth", "Hashes queued or running", password_hasher.queue_depth)
@@ -1,18 +1,15 @@
 from datetime import datetime, timezone
 import math
-from typing import List, Tuple
-from geopy.distance import geodesic
+from typing import Dict, List, Set, Tuple
+import numpy as np
 
 from functionality.errors import ValidationError
-from functionality.helpers import get_average_eatery_rating_sort, get_vouchers_unclaimed
-from functionality.voucher import get_average_voucher_rating, get_expiry
+from functionality.helpers import average_rating_sort, average_voucher_rating
 from functionality.customer import get_customer_past_eateries, get_customer_past_eateries_reviews
-from functionality.address import get_customer_location, get_eatery_date_joined, get_eatery_location
 
-from db.helpers.customer import get_customer_preferences_by_id, get_all_favourited_eateries
-from db.helpers.voucher import get_voucher_quantity, get_vouchers_by_voucher_template
-from db.helpers.voucher_template import get_voucher_templates_for_eatery_by_is_deleted
-from db.helpers.eatery import get_eatery_keywords_by_id
+from db.helpers.customer import get_customer_preference_keyword_ids, get_all_favourited_eateries
+from db.helpers.eatery import get_eatery_features_by_ids, get_eatery_locations_in_box
+from db.db_types.db_response import EateryCardDetailsResponse, EateryCardVoucherResponse
 
 from router.api_types.api_request import Sorts
 
@@ -40,75 +37,114 @@ def round_dist(meters: float) -> int:
     meters = math.ceil(meters / 1000000)
     return meters * 1000000
 
-def distance_between_coords(coord_1: Tuple[float, float], coord_2: Tuple[float, float]) -> int:
+# Eateries further away than this are never recommended
+MAX_RECOMMEND_DISTANCE = 10000
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+def round_dists(meters: np.ndarray) -> np.ndarray:
     """
-    gets rounded dist b/w coords
+    Applies round_dist to every distance at once
     """
-    return round_dist(geodesic(coord_1, coord_2).meters)
-
-def preference_commonality(customer_preferences: List[str], eatery_keywords: List[str]) -> int:
+    step = np.select(
+        [meters < 1000, meters < 30000, meters < 100000, meters < 1000000],
+        [100, 1000, 10000, 100000],
+        default=1000000
+    )
+    return (np.ceil(meters / step) * step).astype(np.int64)
+
+def distances_from(coord: Tuple[float, float], coords: np.ndarray) -> np.ndarray:
     """
-    counts preference commonality
+    Gets the rounded haversine distance in meters from a (latitude, longitude) to each row of an (n, 2) array of them
+    """
+    lat_1, lon_1 = np.radians(coord)
+    lat_2, lon_2 = np.radians(coords[:, 0]), np.radians(coords[:, 1])
 
-    change later to a commonality score
+    a = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+    return round_dists(2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+def get_eatery_locations_near(coord: Tuple[float, float], radius: float) -> Dict[int, Tuple[float, float]]:
+    """
+    Gets the locations of eateries in the bounding box around a (latitude, longitude), a superset of those within the radius
     """
-    return sum(1 for pref in customer_preferences if pref in eatery_keywords)
+    lat, lon = coord
+    lat_delta = math.degrees(radius / EARTH_RADIUS)
+    min_lat, max_lat = lat - lat_delta, lat + lat_delta
 
-def get_active_vouchers(eatery_id: int) -> List[int]:
+    # Near the poles every longitude is in range
+    if min_lat <= -90 or max_lat >= 90:
+        return get_eatery_locations_in_box(max(min_lat, -90), min(max_lat, 90), -180, 180)
+
+    lon_delta = math.degrees(radius / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    if lon_delta >= 180:
+        return get_eatery_locations_in_box(min_lat, max_lat, -180, 180)
+
+    # Wrap longitudes back into [-180, 180], a box crossing the antimeridian ends up with min_lon > max_lon
+    min_lon = (lon - lon_delta + 180) % 360 - 180
+    max_lon = (lon + lon_delta + 180) % 360 - 180
+
+    return get_eatery_locations_in_box(min_lat, max_lat, min_lon, max_lon)
+
+def nearby_eatery_distances(coord: Tuple[float, float]) -> Dict[int, int]:
     """
-    Gets active vouchers for an eatery
+    Gets the rounded distance to every eatery within MAX_RECOMMEND_DISTANCE of a (latitude, longitude)
+    """
+    locations = get_eatery_locations_near(coord, MAX_RECOMMEND_DISTANCE)
+    if not locations:
+        return {}
+
+    eatery_ids = list(locations)
+    distances = distances_from(coord, np.array([locations[eid] for eid in eatery_ids], dtype=np.float64))
+
+    return {eid: int(dist) for eid, dist in zip(eatery_ids, distances) if dist <= MAX_RECOMMEND_DISTANCE}
+
+def preference_commonality(preference_keyword_ids: Set[int], eatery_keyword_ids: List[int]) -> int:
     """
-    # TODO: convert to a join query
-    active_voucher_templates = get_voucher_templates_for_eatery_by_is_deleted(eatery_id, False)
-    if active_voucher_templates is None:
-        raise ValueError("Error retrieving active vouchers")
-    
-    active_vouchers: List[int] = []
-    for template_id in active_voucher_templates:
-        voucher_ids = get_vouchers_by_voucher_template(template_id)
-        if voucher_ids is not None:
-            active_vouchers.extend(voucher_ids)
+    counts preference commonality
 
-    return active_vouchers
+    change later to a commonality score
+    """
+    return sum(1 for keyword_id in eatery_keyword_ids if keyword_id in preference_keyword_ids)
 
-def recommend_sort(customer_id: int, eateries: List[int], sorts: List[Sorts]) -> List[int]:
+def recommend_sort(customer_id: int, distances: Dict[int, int], sorts: List[Sorts]) -> List[int]:
     """
     Sorts by distance and preference
+
+    Only eateries with a distance are considered, see nearby_eatery_distances.
+    Everything about an eatery comes precomputed from its feature row, so this is one pass joining
+    them with the customer's own reviews, history, preferences and favourites
     """
-    customer_location = get_customer_location(customer_id)
     customer_reviews = get_customer_past_eateries_reviews(customer_id)
     past_eateries = get_customer_past_eateries(customer_id)
 
-    customer_preferences = get_customer_preferences_by_id(customer_id)
+    preference_keyword_ids = get_customer_preference_keyword_ids(customer_id)
     favourited_eateries = get_all_favourited_eateries(customer_id)
-    if customer_preferences is None or favourited_eateries is None:
+    if preference_keyword_ids is None or favourited_eateries is None:
         raise ValidationError("Error retrieving customer preferences and / or favourite eateries")
 
-    eatery_details = []
-    for eatery_id in eateries:
-        eatery_keywords = get_eatery_keywords_by_id(eatery_id)
-        if eatery_keywords is None:
-            raise ValidationError("Error retrieving eatery keywords")
+    preference_keyword_ids = set(preference_keyword_ids)
+    favourited_eateries = set(favourited_eateries)
 
+    eatery_details = []
+    for eatery_id, features in get_eatery_features_by_ids(list(distances)).items():
         rating = customer_reviews.get(eatery_id)
         if rating is None:
-            rating = get_average_eatery_rating_sort(eatery_id)
+            rating = average_rating_sort(features.rating)
 
         eatery_details.append({
             "eid": eatery_id,
-            "distance": distance_between_coords(customer_location, get_eatery_location(eatery_id)),
-            "vouchers": len(get_active_vouchers(eatery_id)),
-            "keywords": preference_commonality(customer_preferences, eatery_keywords),
+            "distance": distances[eatery_id],
+            "vouchers": features.active_vouchers,
+            "keywords": preference_commonality(preference_keyword_ids, features.keyword_ids),
             "rating": rating,
             "not_tried": eatery_id not in past_eateries,
             "favourite": eatery_id in favourited_eateries,
-            "register_date": get_eatery_date_joined(eatery_id)
+            "register_date": features.date_joined
         })
 
     # Remove irrelevant things
-    # Limit distance always
-    eatery_details = [
-        eatery for eatery in eatery_details if eatery["distance"] <= 10000]
+    # Distance is always limited up front by nearby_eatery_distances
     if Sorts.RATING in sorts:
         # Minimum rating filter
         eatery_details = [
@@ -148,22 +184,20 @@ def recommend_sort(customer_id: int, eateries: List[int], sorts: List[Sorts]) ->
 
     return [detail["eid"] for detail in eatery_details]
 
-def basic_recommend_sort(eateries: List[int]) -> List[int]:
+def basic_recommend_sort(eateries: Dict[int, EateryCardDetailsResponse]) -> List[int]:
     """
     Sorts by registration date rating and number of vouchers
     """
     # Get lnum vouchers average rating and register date
     eatery_details = []
-    for eatery_id in eateries:
-        vouchers = get_active_vouchers(eatery_id)
-
+    for eatery_id, card in eateries.items():
         eatery_details.append({
             "eid": eatery_id,
-            "vouchers": len(vouchers),
-            "rating": get_average_eatery_rating_sort(eatery_id),
-            "register_date": get_eatery_date_joined(eatery_id)
+            "vouchers": len(card.vouchers),
+            "rating": average_rating_sort(card.rating),
+            "register_date": card.date_joined
         })
-    
+
     eatery_details.sort(key=lambda x: x["register_date"], reverse=True)
     # sort by number of vouchers
     eatery_details.sort(key=lambda x: x["vouchers"], reverse=True)
@@ -174,39 +208,19 @@ def basic_recommend_sort(eateries: List[int]) -> List[int]:
 
     return [detail["eid"] for detail in eatery_details]
 
-def top_3_vouchers(eatery_id: int) -> List[int]:
+def top_3_vouchers(vouchers: List[EateryCardVoucherResponse]) -> List[EateryCardVoucherResponse]:
     """
-    Sorts by distance and preference
+    Picks the three vouchers to feature on an eatery's homepage card
     """
-    # Get location and keywords for each eatery
-    vouchers = get_active_vouchers(eatery_id)
-
-    voucher_details = []
-    for voucher_id in vouchers:
-        unclaimed = get_vouchers_unclaimed([voucher_id])
-        if unclaimed is None:
-            raise ValidationError("Error retrieving unclaimed vouchers")
-
-        total = get_voucher_quantity(voucher_id)
-        if total is None:
-            raise ValidationError("Error retrieving total voucher count")
-
-        voucher_details.append({
-            "vid": voucher_id,
-            "rating": get_average_voucher_rating(voucher_id),
-            "expiry": get_expiry(voucher_id),
-            "rate": unclaimed / total if total is not None else 1
-        })
-
     # sort by rating
-    voucher_details.sort(key=lambda x: x["rating"])
+    voucher_details = sorted(vouchers, key=lambda x: average_voucher_rating(x.rating))
 
     # remove vouchers that have expired
     voucher_details = [
-        vouch for vouch in voucher_details if vouch["expiry"] > datetime.now(timezone.utc)]
-    voucher_details.sort(key=lambda x: x["expiry"])
+        vouch for vouch in voucher_details if vouch.expiry > datetime.now(timezone.utc)]
+    voucher_details.sort(key=lambda x: x.expiry)
 
     # Sort by speed consumed
-    voucher_details.sort(key=lambda x: x["rate"])
+    voucher_details.sort(key=lambda x: x.unclaimed / x.total if x.total > 0 else 1)
 
-    return [detail["vid"] for detail in voucher_details][:3]
+    return voucher_details[:3]
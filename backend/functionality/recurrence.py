@@ -0,0 +1,72 @@
+"""
+A module which works out when recurring voucher releases happen
+"""
+import calendar
+from datetime import datetime, timedelta
+from typing import Optional
+
+from functionality.errors import ValidationError
+
+# Schedules that repeat after a fixed amount of time, monthly is handled separately as months vary in length
+FIXED_INTERVALS = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "fortnightly": timedelta(weeks=2)
+}
+
+def add_months(start: datetime, months: int) -> datetime:
+    """
+    Moves a datetime forward by a number of months, keeping its time of day
+
+    Days past the end of the target month are clamped to its last day, so the 31st of January becomes the 28th or 29th of February
+    """
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+
+    _, last_day = calendar.monthrange(year, month)
+    return start.replace(year=year, month=month, day=min(start.day, last_day))
+
+def occurrence(release_schedule: str, release_date: datetime, index: int) -> datetime:
+    """
+    Gets the index-th release of a schedule, the 0th being the release date itself
+    """
+    if release_schedule in FIXED_INTERVALS:
+        return release_date + FIXED_INTERVALS[release_schedule] * index
+
+    if release_schedule == "monthly":
+        # Always measured from the release date so a clamped month doesn't pull every later release earlier
+        return add_months(release_date, index)
+
+    raise ValidationError("Invalid release schedule")
+
+def next_occurrence(release_schedule: Optional[str], release_date: datetime, after: Optional[datetime]) -> Optional[datetime]:
+    """
+    Gets the first release of a schedule strictly after the given time, or the release date if nothing has been released yet
+
+    Works in constant time however far `after` is from the release date
+    """
+    if after is None or after < release_date:
+        return release_date
+
+    # A one off release has already happened
+    if release_schedule is None:
+        return None
+
+    if release_schedule in FIXED_INTERVALS:
+        # Whole intervals that fit up to and including `after`, the next release is one past them
+        return occurrence(release_schedule, release_date, (after - release_date) // FIXED_INTERVALS[release_schedule] + 1)
+
+    if release_schedule == "monthly":
+        # Month arithmetic happens in the release date's timezone so a release never shifts by a day
+        after = after.astimezone(release_date.tzinfo) if release_date.tzinfo is not None else after
+        months = (after.year - release_date.year) * 12 + after.month - release_date.month
+
+        # This month's release may or may not have happened yet, the one after certainly hasn't
+        candidate = occurrence(release_schedule, release_date, months)
+        if candidate <= after:
+            candidate = occurrence(release_schedule, release_date, months + 1)
+
+        return candidate
+
+    raise ValidationError("Invalid release schedule")
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from db.helpers import run_blocking
+from db.helpers.keyword_score import get_keyword_scores, upsert_keyword_scores
+
+def normalise_word(word: str) -> str:
+    """
+    Normalises a keyword or prompt word so that equivalent pairs share a cache entry
+    """
+    return word.strip().lower()
+
+class KeywordScoreCache:
+    """
+    Two level cache of keyword relatedness scores, an in-process LRU in front of the keyword_scores table
+
+    Entries are versioned by model name so switching model never serves scores from the old one,
+    and both levels ignore entries older than `ttl` seconds.
+    """
+    def __init__(self, model: str, ttl: float, max_size: int):
+        self.model = model
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[Tuple[str, str, str], Tuple[int, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    async def get_many(self, prompt_word: str, keywords: List[str]) -> Dict[str, int]:
+        """
+        Gets the cached scores of keywords against a prompt word, keyed by the keywords as given
+        """
+        prompt_word = normalise_word(prompt_word)
+        found: Dict[str, int] = {}
+        missing: Dict[str, List[str]] = {}
+
+        now = time.monotonic()
+        with self.lock:
+            for keyword in keywords:
+                key = (self.model, normalise_word(keyword), prompt_word)
+                entry = self.entries.get(key)
+
+                if entry is not None and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    found[keyword] = entry[0]
+                else:
+                    missing.setdefault(key[1], []).append(keyword)
+
+        if not missing:
+            return found
+
+        scored_after = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        stored = await run_blocking(get_keyword_scores, prompt_word, list(missing), self.model, scored_after)
+
+        # Promote what the database had into the LRU, the database doesn't track remaining TTL so give it a full one
+        self._remember(prompt_word, stored)
+        for normalised, score in stored.items():
+            for keyword in missing[normalised]:
+                found[keyword] = score
+
+        return found
+
+    async def put_many(self, prompt_word: str, scores: Dict[str, int]):
+        """
+        Stores freshly computed scores of keywords against a prompt word in both levels
+        """
+        prompt_word = normalise_word(prompt_word)
+        normalised = {normalise_word(keyword): score for keyword, score in scores.items()}
+
+        self._remember(prompt_word, normalised)
+        await run_blocking(upsert_keyword_scores, prompt_word, normalised, self.model, datetime.now(timezone.utc))
+
+    def _remember(self, prompt_word: str, scores: Dict[str, int]):
+        """
+        Adds normalised scores to the LRU, evicting the least recently used entries once full
+        """
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for keyword, score in scores.items():
+                key = (self.model, keyword, prompt_word)
+                self.entries[key] = (score, expires)
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
@@ -1,16 +1,23 @@
 import asyncio
+import json
 import os
 import re
-from typing import List, Set, Tuple
+from typing import List, Optional
 from openai import AsyncOpenAI
 
-from logger import log_green
+from logger import log_green, log_red
 
 from functionality.errors import ValidationError
-from functionality.helpers import calc_average_rating
+from functionality.helpers import average_rating
+from functionality.media import media_url
+from functionality.recommendations import top_3_vouchers
+from functionality.score_cache import KeywordScoreCache
+from functionality.embedding_search import embedding_search_ids
 
-from db.helpers.voucher_template import get_voucher_template_by_id, get_voucher_templates_by_eatery
-from db.helpers.eatery import get_all_eateries, get_eatery_by_id, get_eatery_keywords_by_id
+from db.helpers import run_blocking
+from db.helpers.eatery import get_all_eateries, get_eatery_addresses_by_ids, get_eatery_cards_by_ids, get_eatery_keywords_by_ids, \
+    get_eatery_summaries_by_ids
+from db.helpers.search_index import search_eatery_ids
 
 from router.api_types.api_response import EateryInformationResponse
 
@@ -19,81 +26,49 @@ client = AsyncOpenAI(
     api_key=os.environ.get("OPENAI_API_KEY", "NO_KEY")
 )
 
+SMART_SEARCH_MODEL = os.environ.get("SMART_SEARCH_MODEL", "gpt-3.5-turbo")
+
+# Keywords scored per ChatGPT request, 1 scores each keyword on its own
+SMART_SEARCH_BATCH_SIZE = int(os.environ.get("SMART_SEARCH_BATCH_SIZE", "50"))
+SMART_SEARCH_BATCH_RETRIES = int(os.environ.get("SMART_SEARCH_BATCH_RETRIES", "1"))
+
+# Keyword relatedness barely changes so scores are reused across queries
+score_cache = KeywordScoreCache(
+    model=SMART_SEARCH_MODEL,
+    ttl=float(os.environ.get("SMART_SEARCH_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60))),
+    max_size=int(os.environ.get("SMART_SEARCH_CACHE_SIZE", "10000"))
+)
+
 async def search_eateries(query: str) -> List[EateryInformationResponse]:
     """
     Given a query, we want to return all the eateries that are related to the query
     """
-    
-    return await smart_search(query) if os.environ.get("SMART_SEARCH", "False") == "True" else dumb_search(query)
+    mode = os.environ.get("SMART_SEARCH", "False")
+
+    if mode == "True":
+        return await smart_search(query)
+
+    if mode == "embedding":
+        return await run_blocking(embedding_search, query)
+
+    return await run_blocking(dumb_search, query)
 
 def dumb_search(query: str) -> List[EateryInformationResponse]:
     """
     Given a query, returns eateries that match the query
     """
-
-    # Get all the eateries
     prompt_words = query.split() + [query]
 
-    # Get all the eateries
-    eatery_ids = get_all_eateries()
-
-    if eatery_ids is None:
-        raise ValidationError("No eateries found")
-
-    matched_eateries: Set[int] = set()
-
-    eatery_keywords = {}
-
-    for eid in eatery_ids:
-        eatery_keywords[eid] = get_eatery_keywords(eid)
-
-        if eatery_keywords[eid] is None:
-            continue
-
-        for keyword in eatery_keywords[eid]:
-            for prompt_word in prompt_words:
-                if keyword.lower() == prompt_word.lower():
-                    matched_eateries.add(eid)
-                    break
-
-        # Matches eatery name by intersecting words in query and eatery name
-        eatery = get_eatery_by_id(eid)
-        if eatery is None:
-            continue
-        eatery_name = eatery.business_name
-
-        # also match full eatery name with whitespaces removed
-        matched_eateries.update(match_eatery_name(eid, prompt_words, eatery_name))
-    res = []
-
-    for eid in matched_eateries:
-        eatery_info = get_eatery_by_id(eid)
-
-        if eatery_info is None:
-            continue
-
-        vouchers = get_voucher_templates_by_eatery(eid)
-
-        if vouchers is None:
-            continue
-
-        top_vouchers: List[Tuple[int, str]] = []
-        for vouch_id in vouchers[:3]:
-            voucher = get_voucher_template_by_id(vouch_id)
-            if voucher is None:
-                continue
-            top_vouchers.append((vouch_id, voucher.name))
+    # Only the eateries found in the search index are loaded
+    return format_search_results(search_eatery_ids(prompt_words))
 
-        res.append(EateryInformationResponse(
-            eatery_id=eid,
-            eatery_name=eatery_info.business_name,
-            thumbnail_uri=eatery_info.thumbnail,
-            num_vouchers=len(vouchers),
-            top_three_vouchers=top_vouchers,
-            average_rating=calc_average_rating(eid)
-        ))
+def embedding_search(query: str) -> List[EateryInformationResponse]:
+    """
+    Given a query, ranks eateries by the similarity of their keywords, name and description without any external service
+    """
+    prompt_words = query.split(" ") + [query]
 
-    return res
+    return format_search_results([eid for eid, _ in embedding_search_ids(prompt_words)])
 
 async def smart_search(query: str) -> List[EateryInformationResponse]:
     """
@@ -102,14 +77,14 @@ async def smart_search(query: str) -> List[EateryInformationResponse]:
     prompt_words = query.split(" ") + [query]
 
     # Get all the eateries
-    eatery_ids = get_all_eateries()
+    eatery_ids = await run_blocking(get_all_eateries)
 
     if eatery_ids is None:
         raise ValidationError("No eateries found")
 
     scored_eateries = []
 
-    eateries_keywords = get_each_eateries_keywords(eatery_ids)
+    eateries_keywords = await run_blocking(get_each_eateries_keywords, eatery_ids)
 
     # Take all the keywords and turn them into a set
     # Use set to remove duplicates
@@ -127,87 +102,59 @@ async def smart_search(query: str) -> List[EateryInformationResponse]:
     # Sort the eateries by score
     scored_eateries.sort(key=lambda x: x[1], reverse=True)
 
-    res = []
+    return await run_blocking(format_search_results, [eatery[0] for eatery in scored_eateries])
 
-    for eatery in scored_eateries:
-        eid = eatery[0]
+def format_search_results(eatery_ids: List[int]) -> List[EateryInformationResponse]:
+    """
+    Given the matched eatery IDs in order, builds the search response for each eatery
+    """
+    res = []
 
-        eatery_info = get_eatery_by_id(eid)
+    # The matches are shown as the same cards as the homepage, loaded for all of them at once
+    cards = get_eatery_cards_by_ids(eatery_ids)
 
-        if eatery_info is None:
-            continue
+    if cards is None:
+        raise ValidationError("Error retrieving eateries")
 
-        vouchers = get_voucher_templates_by_eatery(eid)
+    for eid in eatery_ids:
+        card = cards.get(eid)
 
-        if vouchers is None:
+        if card is None:
             continue
 
-        top_vouchers: List[Tuple[int, str]] = []
-        for vouch_id in vouchers[:3]:
-            voucher = get_voucher_template_by_id(vouch_id)
-            if voucher is None:
-                continue
-            top_vouchers.append((vouch_id, voucher.name))
-
         res.append(EateryInformationResponse(
-            eatery_id=eatery[0],
-            eatery_name=eatery_info.business_name,
-            thumbnail_uri=eatery_info.thumbnail,
-            num_vouchers=len(vouchers),
-            top_three_vouchers=top_vouchers,
-            average_rating=calc_average_rating(eid)
+            eatery_id=eid,
+            eatery_name=card.business_name,
+            thumbnail_uri=media_url(card.thumbnail),
+            num_vouchers=sum(1 for voucher in card.vouchers if voucher.unclaimed > 0),
+            top_three_vouchers=[(voucher.voucher_id, voucher.name) for voucher in top_3_vouchers(card.vouchers)],
+            average_rating=average_rating(card.rating)
         ))
 
     return res
 
-def match_eatery_name(eid: int, prompt_words: List[str], eatery_name: str) -> Set[int]:
-    """
-    Given an eatery ID, a list of prompt words and the eatery name, we want to match the eatery name against the prompt words
-    """
-    eatery_name_words = eatery_name.split(
-    ) + [re.sub(r'\s*', '', eatery_name)]
-
-    matched_eateries: Set[int] = set()
-
-    if any(re.match(prompt_word, eatery_name_word, re.IGNORECASE) for prompt_word in prompt_words for eatery_name_word in eatery_name_words):
-        matched_eateries.add(eid)
-
-    return matched_eateries
-
 def get_each_eateries_keywords(eatery_ids: List[int]) -> dict[int, List[str]]:
     """
     Given a list of eatery IDs, we want to get the keywords for each eatery
     """
     res = {}
 
+    # The name and postcode count as keywords too
+    summaries = get_eatery_summaries_by_ids(eatery_ids)
+    addresses = get_eatery_addresses_by_ids(eatery_ids)
+    keywords = get_eatery_keywords_by_ids(eatery_ids) or {}
+
     for eid in eatery_ids:
-        eatery_keywords = get_eatery_keywords(eid)
+        eatery_keywords = keywords.get(eid, [])
 
-        if eatery_keywords is None:
-            eatery_keywords = []
+        if eid in summaries and eid in addresses:
+            eatery_keywords.append(summaries[eid].business_name)
+            eatery_keywords.append(addresses[eid].postcode)
 
         res[eid] = eatery_keywords
 
     return res
 
-def get_eatery_keywords(eid: int) -> List[str]:
-    """
-    Given an eatery ID, we want to get the keywords for the eatery
-    """
-    eatery_keywords = get_eatery_keywords_by_id(eid)
-
-    if eatery_keywords is None:
-        eatery_keywords = []
-
-    # Add the eatery name and postcode to the keywords
-    eatery_info = get_eatery_by_id(eid)
-
-    if eatery_info is not None:
-        eatery_keywords.append(eatery_info.business_name)
-        eatery_keywords.append(eatery_info.address.postcode)
-
-    return eatery_keywords
-
 async def score_all_keywords(prompt_words: List[str], keywords: List[str]) -> dict[str, dict[str, int]]:
     """
     Given a list of prompt words and a list of keywords, we want to score each keyword against each prompt word
@@ -281,11 +228,17 @@ async def score_prompt_word_against_keywords(prompt_word: str, keywords: List[st
 
     We will return a dictionary of keyword -> score
     """
-    semaphore = asyncio.Semaphore(value=10)
+    output = await score_cache.get_many(prompt_word, keywords)
+
+    # Only ask ChatGPT about the pairs we haven't scored recently
+    missing = [keyword for keyword in keywords if keyword not in output]
+    if not missing:
+        return output
 
-    res = await asyncio.gather(*[_score_keyword_against_prompt_word(keyword, prompt_word, semaphore) for keyword in keywords])
+    scored = await _score_keywords(prompt_word, missing)
+    await score_cache.put_many(prompt_word, scored)
 
-    output = dict(zip(keywords, res))
+    output.update(scored)
 
     return output
 
@@ -298,18 +251,131 @@ def _get_postcode_score(postcode1: int, postcode2: int):
 
     return 0 if abs(postcode1 - postcode2) > 3 else 100
 
-async def _score_keyword_against_prompt_word(keyword: str, prompt_word: str, semaphore) -> int:
+def _score_locally(keyword: str, prompt_word: str) -> Optional[int]:
     """
-    Given a keyword and a prompt word, we want to score the keyword against the prompt word
+    Scores the pairs that don't need ChatGPT, returns None if the pair has to be sent off
     """
     if keyword == prompt_word:
         return 100
-    
+
     # If we're dealing with a number, we need to match up directly otherwise 0
     # This assumes postcode
     if prompt_word.isnumeric():
         return _get_postcode_score(int(keyword), int(prompt_word)) if keyword.isnumeric() else 0
 
+    return None
+
+async def _score_keywords(prompt_word: str, keywords: List[str]) -> dict[str, int]:
+    """
+    Given a prompt word and keywords, scores them in chunks of SMART_SEARCH_BATCH_SIZE keywords per ChatGPT request
+    """
+    semaphore = asyncio.Semaphore(value=10)
+
+    if SMART_SEARCH_BATCH_SIZE <= 1:
+        res = await asyncio.gather(*[_score_keyword_against_prompt_word(keyword, prompt_word, semaphore) for keyword in keywords])
+        return dict(zip(keywords, res))
+
+    scored: dict[str, int] = {}
+    remote: List[str] = []
+
+    for keyword in keywords:
+        score = _score_locally(keyword, prompt_word)
+        if score is None:
+            remote.append(keyword)
+        else:
+            scored[keyword] = score
+
+    chunks = [remote[i:i + SMART_SEARCH_BATCH_SIZE] for i in range(0, len(remote), SMART_SEARCH_BATCH_SIZE)]
+
+    for chunk_scores in await asyncio.gather(*[_score_keyword_chunk(chunk, prompt_word, semaphore) for chunk in chunks]):
+        scored.update(chunk_scores)
+
+    return scored
+
+async def _score_keyword_chunk(keywords: List[str], prompt_word: str, semaphore) -> dict[str, int]:
+    """
+    Scores a chunk of keywords against a prompt word in one request
+
+    Keywords missing from a malformed reply are asked about again, then scored one by one as a last resort
+    """
+    scored: dict[str, int] = {}
+    remaining = keywords
+
+    for _ in range(1 + SMART_SEARCH_BATCH_RETRIES):
+        async with semaphore:
+            resp = await client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are to assist in the relatedness of words. You will be given a prompt and a JSON \
+                        list of keywords and you must determine a score between 0 and 100 for each keyword against the \
+                        prompt. For example, if keyword=mexican and prompt=taco, the score might be 90. However if \
+                        keyword=burger and prompt=taco, the score might be 5. Reply only with a JSON object mapping every \
+                        keyword exactly as given to its score. No words what so ever."},
+                    {
+                        "role": "user",
+                        "content": f"prompt={prompt_word} keywords={json.dumps(remaining)}"
+                    }
+                ],
+                model=SMART_SEARCH_MODEL,
+            )
+
+        result = resp.choices[0].message.content
+
+        log_green(f"GPT: Scored {len(remaining)} keywords against {prompt_word}")
+
+        scored.update(_parse_chunk_scores(result, remaining))
+        remaining = [keyword for keyword in remaining if keyword not in scored]
+
+        if not remaining:
+            return scored
+
+    log_red(f"GPT: Falling back to scoring {len(remaining)} keywords against {prompt_word} one at a time")
+
+    res = await asyncio.gather(*[_score_keyword_against_prompt_word(keyword, prompt_word, semaphore) for keyword in remaining])
+    scored.update(zip(remaining, res))
+
+    return scored
+
+def _parse_chunk_scores(result: Optional[str], keywords: List[str]) -> dict[str, int]:
+    """
+    Given a batched GPT result, gets the scores it holds for the keywords, skipping anything malformed
+    """
+    if result is None:
+        return {}
+
+    # Tolerate code fences or chatter around the JSON object
+    match = re.search(r"\{.*\}", result, re.DOTALL)
+
+    try:
+        raw = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        raw = None
+
+    if not isinstance(raw, dict):
+        return {}
+
+    by_lower = {str(key).strip().lower(): value for key, value in raw.items()}
+
+    res = {}
+    for keyword in keywords:
+        value = raw.get(keyword, by_lower.get(keyword.strip().lower()))
+
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+
+        res[keyword] = min(max(int(value), 0), 100)
+
+    return res
+
+async def _score_keyword_against_prompt_word(keyword: str, prompt_word: str, semaphore) -> int:
+    """
+    Given a keyword and a prompt word, we want to score the keyword against the prompt word
+    """
+    score = _score_locally(keyword, prompt_word)
+    if score is not None:
+        return score
+
     async with semaphore:
         # Run the prompt against ChatGPT and get a score
         resp = await client.chat.completions.create(
@@ -325,7 +391,7 @@ async def _score_keyword_against_prompt_word(keyword: str, prompt_word: str, sem
                     "content": f"keyword={keyword} prompt={prompt_word}"
                 }
             ],
-            model="gpt-3.5-turbo",
+            model=SMART_SEARCH_MODEL,
         )
 
         result = resp.choices[0].message.content
@@ -0,0 +1,82 @@
+import io
+import os
+import time
+from typing import Optional, Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from logger import log_purple, log_red
+
+import metrics
+from functionality.media import stored_media_path, write_media
+
+from db.helpers.eatery import get_pending_thumbnail_renditions, update_eatery_thumbnail_renditions
+
+# The largest each rendition can be, images are shrunk to fit keeping their aspect ratio and never enlarged
+CARD_SIZE = (480, 320)
+DETAIL_SIZE = (1280, 960)
+
+# WebP quality of the renditions, out of 100
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "80"))
+
+# The most thumbnails rendered in one go
+THUMBNAIL_BATCH_SIZE = int(os.environ.get("THUMBNAIL_BATCH_SIZE", "10"))
+
+render_time = metrics.histogram("thumbnail_render_seconds", "Time taken to render both renditions of a thumbnail")
+render_failures = metrics.counter("thumbnail_render_failures", "Thumbnails that could not be read as images")
+
+def render_rendition(image: Image.Image, size: Tuple[int, int]) -> bytes:
+    """
+    Shrinks an image to fit within size and encodes it as WebP
+    """
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    rendition.save(output, format="WEBP", quality=THUMBNAIL_QUALITY, method=4)
+
+    return output.getvalue()
+
+def render_thumbnail(path: str) -> Tuple[str, str]:
+    """
+    Renders the card and detail renditions of a stored image, returning the names they are stored under
+    """
+    with Image.open(path) as original:
+        # Phones save photos sideways with a rotation tag, so apply it before the tag is lost
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    return (
+        write_media(render_rendition(image, CARD_SIZE), "webp"),
+        write_media(render_rendition(image, DETAIL_SIZE), "webp")
+    )
+
+def render_pending_thumbnails(limit: int = THUMBNAIL_BATCH_SIZE) -> int:
+    """
+    Renders thumbnails uploaded since the last run, returning how many were taken
+
+    Thumbnails that aren't in the media store or aren't readable images are left without renditions,
+    the original is shown instead
+    """
+    pending = get_pending_thumbnail_renditions(limit)
+
+    for eatery_id, thumbnail in pending.items():
+        start = time.monotonic()
+
+        card: Optional[str] = None
+        detail: Optional[str] = None
+
+        path = stored_media_path(thumbnail)
+        if path is not None:
+            try:
+                card, detail = render_thumbnail(path)
+                render_time.observe(time.monotonic() - start)
+            except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+                render_failures.inc()
+                log_red(f"Error rendering the thumbnail of Eatery {eatery_id}: {e}")
+
+        update_eatery_thumbnail_renditions(eatery_id, thumbnail, card, detail)
+
+    if pending:
+        log_purple(f"Rendered \"{len(pending)}\" Eatery thumbnails")
+
+    return len(pending)
@@ -1,7 +1,8 @@
 import os
 import secrets
 import string
-from typing import Literal, Optional, Tuple
+from contextvars import ContextVar
+from typing import Any, Dict, Literal, Optional, Tuple
 from datetime import datetime, timezone, timedelta
 import jwt
 from fastapi import HTTPException, Request, status
@@ -11,9 +12,13 @@ from fastapi.openapi.models import HTTPBearer as HTTPBearerModel
 
 from functionality.errors import ValidationError, AuthorisationError
 
-from db.helpers.session import create_session, check_if_session_exists, update_refresh_token_in_session, view_session
+from db.helpers import run_blocking
+from db.helpers.session import create_session, check_if_session_exists, update_refresh_token_in_session, get_session_user
 from db.db_types.db_request import SessionCreationRequest
 
+# The access token decoded for the current request, so it's only verified once however many times it's used
+_decoded_access_token: ContextVar[Optional[Tuple[str, Dict[str, Any]]]] = ContextVar("decoded_access_token", default=None)
+
 def extract_bearer_token(request: Request) -> Optional[str]:
     """
     Gets the access token from the Authorization header and returns it
@@ -56,8 +61,9 @@ class HTTPBearer401(SecurityBase):
                 )
             return None
 
-        # Check token validity
-        if not access_token_valid(token):
+        # Check token validity, decoding here means the rest of the request reuses the result
+        decode_access_token(token)
+        if not await run_blocking(access_token_valid, token):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token was not given in correct format.",
@@ -168,10 +174,10 @@ def access_token_valid(access_token: str) -> bool:
 
     Returns: True if the access token is valid, False otherwise
     """
-    decoded = jwt.decode(access_token, os.environ["ACCESS_TOKEN_SECRET"], algorithms=["HS256"])
+    decoded = decode_access_token(access_token)
 
     sid = decoded.get("sid")
-    return sid and (check_if_session_exists(sid) or False)
+    return sid and get_session_user(sid) is not None
 
 def refresh_token_valid(refresh_token: str) -> bool:
     """
@@ -192,12 +198,25 @@ def get_session_id_from_access_token(access_token: str) -> int:
     Given an access token, gets us the session id
     """
 
-    # Unpack the session id from the refresh token
-    payload = jwt.decode(access_token, os.environ["ACCESS_TOKEN_SECRET"], algorithms=["HS256"])
+    # Unpack the session id from the access token
+    payload = decode_access_token(access_token)
     sid = payload["sid"]
 
     return sid
 
+def decode_access_token(access_token: str) -> Dict[str, Any]:
+    """
+    Verifies and decodes an access token, reusing the result if it was already decoded for this request
+    """
+    decoded = _decoded_access_token.get()
+    if decoded is not None and decoded[0] == access_token:
+        return decoded[1]
+
+    payload = jwt.decode(access_token, os.environ["ACCESS_TOKEN_SECRET"], algorithms=["HS256"])
+    _decoded_access_token.set((access_token, payload))
+
+    return payload
+
 def get_user_id(access_token: str, user_type: Literal["customer", "eatery"]) -> int:
     """
     Gets an access token and returns the user's id
@@ -206,22 +225,18 @@ def get_user_id(access_token: str, user_type: Literal["customer", "eatery"]) ->
     sid = get_session_id_from_access_token(access_token)
     if sid is None:
         raise ValidationError("Error creating session")
-    session = view_session(sid)
+    session_user = get_session_user(sid)
 
-    if session is None:
+    if session_user is None:
         raise ValidationError("Error viewing session")
 
-    if user_type == "customer":
-        if session.customer is not None:
-            return session.customer
-        raise AuthorisationError("Invalid session")
+    if user_type not in ("customer", "eatery"):
+        raise ValidationError("Undefined user type")
 
-    if user_type == "eatery":
-        if session.eatery is not None:
-            return session.eatery
+    if session_user.user_type != user_type:
         raise AuthorisationError("Invalid session")
 
-    raise ValidationError("Undefined user type")
+    return session_user.user_id
 
 def get_session_id_from_refresh_token(refresh_token: str) -> int:
     """
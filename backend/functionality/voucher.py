@@ -1,23 +1,24 @@
 from datetime import datetime, timedelta, timezone
 import random
-from typing import List, get_args
+from typing import get_args
 
 from pydantic import AwareDatetime
+from psycopg2 import IntegrityError
 
+from db.helpers import savepoint
 from db.helpers.customer import get_customer_by_id
-from db.helpers.eatery import get_eatery_by_id
-from db.helpers.review import get_reviews_by_voucher
-from db.helpers.voucher import get_voucher_by_id, get_vouchers_by_customer
+from db.helpers.eatery import get_eatery_summary_by_id
+from db.helpers.review import get_voucher_template_rating_by_id
+from db.helpers.voucher import get_voucher_by_id, get_voucher_counts_by_ids, get_vouchers_by_customer
 from db.helpers.voucher_instance import (
-    allocate_redemption_code, allocate_voucher_instance, get_voucher_instance_by_id,
-    get_voucher_instance_id_by_redemption_code, get_voucher_instances_by_status,
-    update_voucher_instance_status
+    allocate_redemption_code, claim_voucher_instance, get_voucher_instance_by_id,
+    get_voucher_instance_id_by_redemption_code, update_voucher_instance_status
 )
 from db.helpers.voucher_template import get_voucher_template_by_id, insert_voucher_template
 from db.db_types.db_request import ScheduleType, VoucherTemplateCreationRequest
 
 from functionality.errors import AuthorisationError, ValidationError
-from functionality.helpers import get_raw_rating
+from functionality.helpers import average_voucher_rating
 from functionality.message import VoucherBookingEmailRequest, VoucherClaimEmailRequest, send_voucher_booking_email, send_voucher_claiming_email
 from functionality.voucher_scheduler import VoucherScheduler
 
@@ -59,7 +60,7 @@ class VoucherCreationForm:
         if not isinstance(self.eid, int):
             raise ValidationError("Invalid eatery id type")
 
-        if get_eatery_by_id(self.eid) is None:
+        if get_eatery_summary_by_id(self.eid) is None:
             raise ValidationError("No eatery exists with the given eatery id")
 
     def validate_quantity(self):
@@ -119,11 +120,8 @@ class VoucherCreationForm:
         if vt_id is None:
             raise ValidationError("Error inserting voucher template")
 
-        # Add the voucher to the scheduler
-        VoucherScheduler().add_voucher(vt_id)
-
-        # Trigger the voucher scheduler
-        VoucherScheduler().trigger_voucher_creation()
+        # Release the first batch now if it is due and queue the rest with the scheduler
+        VoucherScheduler().schedule_new_voucher(vt_id)
 
         return vt_id
 
@@ -152,9 +150,9 @@ def voucher_details(voucher_id: int) -> VoucherDetailsResponse:
     if voucher is None:
         raise ValidationError("Voucher with that id cannot be found")
 
-    unclaimed = get_voucher_instances_by_status(voucher_id, "unclaimed")
+    counts = get_voucher_counts_by_ids([voucher_id])
 
-    if unclaimed is None:
+    if counts is None:
         raise ValidationError("Error retrieving unclaimed voucher instances")
 
     voucher_template = get_voucher_template_by_id(voucher.voucher_template)
@@ -168,7 +166,7 @@ def voucher_details(voucher_id: int) -> VoucherDetailsResponse:
         description=voucher_template.description,
         conditions=voucher_template.conditions,
         total_quantity=voucher.quantity,
-        unclaimed_quantity=len(unclaimed),
+        unclaimed_quantity=counts[voucher_id].unclaimed,
         expiry=voucher.expiry_date,
     )
 
@@ -198,23 +196,21 @@ def voucher_claim(voucher_id: int, customer_id: int) -> VoucherClaimResponse:
     if user_vouchers is not None and voucher_id in user_vouchers:
         raise ValidationError("Customer already owns that voucher")
 
-    # Check that there exists an instance of the voucher that is not claimed
-    voucher_instances = get_voucher_instances_by_status(voucher_id, "unclaimed")
-
-    if voucher_instances is None or len(voucher_instances) == 0:
-        raise ValidationError("No unclaimed vouchers exist")
+    # Claim an unclaimed instance of the voucher, concurrent claimers never get the same instance
+    try:
+        with savepoint():
+            voucher_instance_id = claim_voucher_instance(voucher_id, customer_id)
+    except IntegrityError as e:
+        # A concurrent claim by the same customer got there first
+        raise ValidationError("Customer already owns that voucher") from e
 
-    # Get the first instance of the voucher
-    voucher_instance_id = voucher_instances[0]
-
-    # Claim the voucher instance
-    update_voucher_instance_status(voucher_instance_id, "claimed")
-    allocate_voucher_instance(voucher_instance_id, customer_id)
+    if voucher_instance_id is None:
+        raise ValidationError("Voucher is sold out")
 
     voucher_template = get_voucher_template_by_id(voucher.voucher_template)
     
     if voucher_template is not None:
-        eatery = get_eatery_by_id(voucher_template.eatery)
+        eatery = get_eatery_summary_by_id(voucher_template.eatery)
 
         if eatery is not None:
             send_voucher_claiming_email(customer.email, customer.first_name, VoucherClaimEmailRequest(
@@ -222,28 +218,13 @@ def voucher_claim(voucher_id: int, customer_id: int) -> VoucherClaimResponse:
                 voucher_name=voucher_template.name,
                 voucher_description=voucher_template.description,
                 voucher_expiry=voucher.expiry_date
-            ))
+            ), f"voucher-claim:{voucher_instance_id}")
 
     # Return id of the voucher instance
     return VoucherClaimResponse(
         voucher_instance_id=voucher_instance_id
     )
 
-def get_vouchers_unclaimed(vouchers: List[int]) -> int:
-    """
-    Gets the number of vouchers remaining that can be claimed
-    """
-    num_vouchers = 0
-    for vid in vouchers:
-        unclaimed_vouchers = get_voucher_instances_by_status(vid, "unclaimed")
-        if unclaimed_vouchers is None:
-            raise ValidationError("Error retrieving vouchers")
-
-        if len(unclaimed_vouchers) > 0:
-            num_vouchers += 1
-
-    return num_vouchers
-
 def generate_unique_voucher_instance_code(voucher_instance_id: int) -> str:
     """
     Given the voucher_instance_id, generates a unique code for the voucher instance
@@ -259,7 +240,8 @@ def generate_unique_voucher_instance_code(voucher_instance_id: int) -> str:
         try:
             # We handle uniqueness on the database level
             # Most efficient practice
-            allocate_redemption_code(voucher_instance_id, code)
+            with savepoint():
+                allocate_redemption_code(voucher_instance_id, code)
             break
         except Exception:
             continue
@@ -306,7 +288,7 @@ def voucher_redeem_instance(voucher_instance_id: int, customer_id: int) -> Vouch
         
 
         if customer is not None and voucher_template is not None:
-            eatery = get_eatery_by_id(voucher_template.eatery)
+            eatery = get_eatery_summary_by_id(voucher_template.eatery)
 
             if eatery is not None:
                 send_voucher_booking_email(
@@ -318,7 +300,8 @@ def voucher_redeem_instance(voucher_instance_id: int, customer_id: int) -> Vouch
                         voucher_description=voucher_template.description,
                         voucher_code=voucher_instance.redemption_code,
                         voucher_expiry=voucher.expiry_date
-                    )
+                    ),
+                    f"voucher-booking:{voucher_instance_id}:{voucher_instance.redemption_code}"
                 )
 
     return VoucherInstanceRedeemResponse(
@@ -462,15 +445,15 @@ def get_average_voucher_rating(voucher_id: int) -> float:
     """
     Gets an vouchers average rating
     """
-    reviews = get_reviews_by_voucher(voucher_id)
-    if reviews is None:
-        raise ValueError("Error retrieving reviews")
+    voucher = get_voucher_by_id(voucher_id)
+    if voucher is None:
+        raise ValueError("Error retrieving voucher")
 
-    if reviews is None or len(reviews) == 0:
-        return 0
+    rating = get_voucher_template_rating_by_id(voucher.voucher_template)
+    if rating is None:
+        raise ValueError("Error retrieving reviews")
 
-    ratings = get_raw_rating(reviews)
-    return round(sum(ratings) / len(ratings), 1)
+    return average_voucher_rating(rating)
 
 def get_expiry(voucher_id: int) -> AwareDatetime:
     """
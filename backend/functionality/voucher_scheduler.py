@@ -1,18 +1,44 @@
-import calendar
+import heapq
+import os
+import threading
+import time
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from threading import Lock
-from queue import PriorityQueue
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
-from logger import log_purple
+from logger import log_purple, log_red
 
+import metrics
 from functionality.errors import ValidationError
+from functionality.recurrence import next_occurrence
 
 from db.db_types.db_request import VoucherCreationRequest, VoucherInstanceCreationRequest
-from db.helpers.voucher import insert_voucher
-from db.helpers.voucher_instance import insert_voucher_instance
-from db.helpers.voucher_template import get_all_voucher_templates, get_voucher_template_schedule_by_id, update_voucher_template_last_release
+from db.db_types.db_response import VoucherTemplateScheduleDetailsResponse
+from db.helpers import connection_pool, on_commit, transaction
+from db.lease import AdvisoryLease
+from db.helpers.voucher import insert_vouchers
+from db.helpers.voucher_instance import insert_voucher_instance_batches
+from db.helpers.voucher_template import SCHEDULER_CHANNEL, get_all_voucher_template_schedules, \
+    get_voucher_template_schedules_by_ids, notify_voucher_template_scheduled, update_voucher_templates_last_release
+
+# The scheduler sleeps until the next release is due, but never longer than this in case a wake up is missed
+SCHEDULER_MAX_SLEEP = float(os.environ.get("SCHEDULER_REPEAT_SECONDS", "30"))
+
+# How long to wait before retrying releases that failed
+SCHEDULER_RETRY_SECONDS = float(os.environ.get("SCHEDULER_RETRY_SECONDS", "5"))
+
+# With several workers or replicas only the process holding an advisory lock lease releases vouchers
+SCHEDULER_LEADER_ELECTION = os.environ.get("SCHEDULER_LEADER_ELECTION", "True")
+
+# How often the leader checks it still holds the lease and the others try to take it over
+SCHEDULER_LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "5"))
+
+# The advisory lock key of the scheduler lease
+SCHEDULER_LOCK = 0x76636872
+
+release_lag = metrics.histogram("voucher_release_lag_seconds", "Time between a batch of vouchers being due and being released")
+tick_time = metrics.histogram("voucher_scheduler_tick_seconds", "Time taken to release every batch of vouchers due in one tick")
 
 class SingletonMeta(type):
     """
@@ -37,93 +63,218 @@ class VoucherScheduler(metaclass=SingletonMeta):
     def __init__(self):
         log_purple("Initialising Voucher Scheduler")
 
-        # This should hold the release date of the next batch of vouchers and the voucher template id
-        self.queue = PriorityQueue()
+        # Held while touching the queue, also used to wake the scheduler thread when a release is added
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = False
 
-        self._initialise_queue()
+        # A heap of the release date of the next batch of vouchers and the voucher template id
+        self.queue: List[Tuple[datetime, int]] = []
+
+        # The release each template is currently queued for, queue entries that don't match are stale and skipped
+        self.scheduled: Dict[int, datetime] = {}
+
+        # Without leader election every process releases vouchers, which is only safe with a single worker
+        self.lease = AdvisoryLease(SCHEDULER_LOCK, SCHEDULER_CHANNEL, **connection_pool.kwargs) \
+            if SCHEDULER_LEADER_ELECTION == "True" else None
+        self.leading = self.lease is None
+        self.retry_lease_at = 0.0
+
+        metrics.gauge("voucher_scheduler_leader", "Whether this process is the one releasing vouchers", lambda: int(self.leading))
+
+        # Otherwise the queue is loaded once this process takes the lease
+        if self.leading:
+            self._initialise_queue()
         log_purple("Voucher Scheduler initialised")
 
-    def _initialise_queue(self):
+    def _initialise_queue(self, merge: bool = False):
         """
         Initialises the queue with all voucher templates
-        """
-        # Go through and get all voucher templates
-        voucher_template_ids = get_all_voucher_templates()
 
-        if voucher_template_ids is None:
-            raise ValidationError("No voucher templates found")
+        When merging, releases queued while the templates were being loaded are kept
+        """
+        # Go through and get the scheduling details of all voucher templates in one query
+        schedules = get_all_voucher_template_schedules()
+
+        scheduled = {}
+        for voucher_template_id, schedule in schedules.items():
+            release_date = self._get_next_release(schedule)
+            if release_date is not None:
+                scheduled[voucher_template_id] = release_date
+
+        with self.condition:
+            if merge:
+                scheduled = {**self.scheduled, **scheduled}
+
+            # Heapify the lot at once rather than pushing templates one by one
+            self.queue = [(release_date, voucher_template_id) for voucher_template_id, release_date in scheduled.items()]
+            heapq.heapify(self.queue)
+            self.scheduled = scheduled
+            self.condition.notify()
+
+    def _get_next_release(self, voucher_template: VoucherTemplateScheduleDetailsResponse) -> Optional[datetime]:
+        """
+        Takes in the scheduling details of a voucher_template and determines the next release date for the batch of vouchers
+        """
+        # If voucher template is deleted, don't schedule
+        if voucher_template.is_deleted:
+            return None
 
-        for voucher_template_id in voucher_template_ids:
-            self.add_voucher(voucher_template_id)
+        return next_occurrence(voucher_template.release_schedule, voucher_template.release_date, voucher_template.last_release)
 
-    def _get_voucher_template_next_release(self, voucher_template_id: int) -> Optional[datetime]:
+    def add_voucher(self, voucher_template_id: int):
         """
-        Takes in the id for a voucher_template and determines the next release date for the batch of vouchers
+        A method for adding a voucher to the priority queue, waking the scheduler if it is now due sooner
         """
-        voucher_template = get_voucher_template_schedule_by_id(voucher_template_id)
+        schedules = get_voucher_template_schedules_by_ids([voucher_template_id])
 
-        if voucher_template is None:
+        if voucher_template_id not in schedules:
             raise ValidationError("Voucher template not found")
 
-        # If voucher template is deleted, don't schedule
-        if voucher_template.is_deleted:
-            return None
+        self._schedule(voucher_template_id, self._get_next_release(schedules[voucher_template_id]))
 
-        if voucher_template.last_release is None:
-            return voucher_template.release_date
+    def _add_vouchers(self, voucher_template_ids: List[int]):
+        """
+        Requeues many voucher templates at once, dropping any that no longer exist
+        """
+        if not voucher_template_ids:
+            return
 
-        # This voucher is only meant to be issued once
-        # And we have alrdy issued it in this case
-        if voucher_template.release_schedule is None:
-            return None
+        schedules = get_voucher_template_schedules_by_ids(voucher_template_ids)
+        for voucher_template_id in voucher_template_ids:
+            schedule = schedules.get(voucher_template_id)
+            self._schedule(voucher_template_id, None if schedule is None else self._get_next_release(schedule))
 
-        def get_next_time(start, prev_end, step):
-            next_time = start
+    def schedule_new_voucher(self, voucher_template_id: int):
+        """
+        Releases a newly created voucher template straight away if it is already due,
+        then queues its next release once the template has been committed
+        """
+        schedules = get_voucher_template_schedules_by_ids([voucher_template_id])
 
-            while next_time < prev_end:
-                next_time += step
+        if voucher_template_id not in schedules:
+            raise ValidationError("Voucher template not found")
 
-            return next_time
-        
-        def release_schedule_time_handler(release_schedule: str, release_date: datetime, last_release: datetime):
-            if release_schedule == "daily":
-                return get_next_time(release_date, last_release, timedelta(days=1))
-            if release_schedule == "weekly":
-                return get_next_time(release_date, last_release, timedelta(weeks=1))
-            if release_schedule == "fortnightly":
-                return get_next_time(release_date, last_release, timedelta(weeks=2))
-            if release_schedule == "monthly":
-                # This case is a little bit more difficult to handle
-                # We want to make sure it's on the same date as the release date
+        release_date = self._get_next_release(schedules[voucher_template_id])
+        if release_date is not None and release_date <= datetime.now(timezone.utc):
+            # Joins the caller's transaction so the first batch commits along with the template
+            self._release_batch([(release_date, voucher_template_id)], schedules)
 
-                # Get the day of the month
-                release_day = release_date.day
-                release_month = release_date.month
-                release_year = release_date.year
+        # The leader may be another process, it hears about the template once it commits
+        notify_voucher_template_scheduled(voucher_template_id)
+        on_commit(lambda: self.add_voucher(voucher_template_id))
 
-                _, last_day = calendar.monthrange(release_year, release_month)
+    def _schedule(self, voucher_template_id: int, release_date: Optional[datetime]):
+        """
+        Queues the next release of a voucher template, replacing any release already queued for it
+        """
+        with self.condition:
+            if release_date is None:
+                self.scheduled.pop(voucher_template_id, None)
+                return
 
-                # If the release day is greater than the last day of the month, we need to move it to the last day
-                release_day = min(release_day, last_day)
+            self.scheduled[voucher_template_id] = release_date
 
-                return datetime(release_year, release_month, release_day)
+            # Add to the queue ordering by release_date
+            heapq.heappush(self.queue, (release_date, voucher_template_id))
+            self.condition.notify()
 
-            raise ValidationError("Invalid release schedule")
+    def start(self):
+        """
+        Starts releasing vouchers on a background thread, sleeping until each release is due
+        """
+        with self.condition:
+            if self.thread is not None:
+                return
 
-        return release_schedule_time_handler(voucher_template.release_schedule, voucher_template.release_date, voucher_template.last_release)
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="voucher-scheduler", daemon=True)
+            self.thread.start()
 
-    def add_voucher(self, voucher_template_id: int):
+    def stop(self):
         """
-        A method for adding a voucher to the priority queue
+        Stops the background thread, waiting for any release in progress to finish
         """
-        # Get the vouchers next release date
-        release_date = self._get_voucher_template_next_release(voucher_template_id)
+        with self.condition:
+            thread = self.thread
+            self.thread = None
+            self.stopping = True
+            self.condition.notify()
 
-        if release_date is None:
-            return
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        """
+        Releases vouchers as they come due until stopped, but only while this process leads
+        """
+        try:
+            while True:
+                try:
+                    leading = self._lead()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    log_red(f"Voucher Scheduler failed to take its lease: {e}")
+                    leading = False
+
+                with self.condition:
+                    if self.stopping:
+                        return
+
+                    if leading:
+                        # The leader wakes when the next release is due, and often enough to keep hold of the lease
+                        timeout = SCHEDULER_MAX_SLEEP if self.lease is None else min(SCHEDULER_MAX_SLEEP, SCHEDULER_LEASE_SECONDS)
+                        if self.queue:
+                            timeout = min(timeout, (self.queue[0][0] - datetime.now(timezone.utc)).total_seconds())
+                    else:
+                        timeout = max(self.retry_lease_at - time.monotonic(), 0.1)
+
+                    if timeout > 0:
+                        self.condition.wait(timeout)
+                        continue
+
+                try:
+                    self.trigger_voucher_creation()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    # The failed releases were put back in the queue, give whatever went wrong a moment before retrying
+                    log_red(f"Voucher Scheduler failed to release vouchers: {e}")
+                    with self.condition:
+                        self.condition.wait(SCHEDULER_RETRY_SECONDS)
+        finally:
+            if self.lease is not None:
+                self.lease.release()
+                self.leading = False
+
+    def _lead(self) -> bool:
+        """
+        Takes or renews the scheduler lease, returning whether this process should release vouchers
+        """
+        if self.lease is None:
+            return True
+
+        if self.lease.held:
+            if self.lease.renew():
+                # Templates created or changed by other processes since the last check
+                self._add_vouchers(list({int(payload) for payload in self.lease.notifications()}))
+                return True
+
+            self.leading = False
+            log_red("Voucher Scheduler lost its lease, another process will take over releases")
+            return False
 
-        # Add to the queue ordering by release_date
-        self.queue.put((release_date, voucher_template_id))
+        # Followers only try for the lease every so often, not on every wake up
+        if time.monotonic() < self.retry_lease_at:
+            return False
+
+        self.retry_lease_at = time.monotonic() + SCHEDULER_LEASE_SECONDS
+        if not self.lease.acquire():
+            return False
+
+        # Another process may have been releasing until now, so start again from the database
+        log_purple("Voucher Scheduler took the lease, releasing vouchers from this process")
+        self._initialise_queue(merge=True)
+        self.leading = True
+
+        return True
 
     def trigger_voucher_creation(self):
         """
@@ -136,74 +287,100 @@ class VoucherScheduler(metaclass=SingletonMeta):
         """
         Logs the current state of the queue
         """
-        temp = self.queue.queue.copy()
+        with self.condition:
+            temp = sorted(self.queue)
 
         log_purple(f"Voucher Scheduler: Size={len(temp)}")
         for item in temp:
             log_purple(f"Voucher Scheduler: Release Date=\"{item[0]}\", Voucher Template ID=\"{item[1]}\"")
 
-    def _create_voucher_batches(self):
+    def _take_due(self, current_time: datetime) -> List[Tuple[datetime, int]]:
         """
-        Creates the vouchers for templates that are scheduled to be created
+        Takes every release from the queue that is due by the given time
         """
-        log_purple("Voucher Scheduler creating voucher batches")
-
-        # Get the current time
-        current_time = datetime.now(timezone.utc)
-
-        # Used for logging
-        vouchers_created = 0
+        due = []
+        with self.condition:
+            while self.queue and self.queue[0][0] <= current_time:
+                release_date, voucher_template_id = heapq.heappop(self.queue)
 
-        # While there are vouchers to be created
-        while not self.queue.empty():
-            # Get the next voucher to be created
-            release_date, voucher_template_id = self.queue.get()
+                # Skip releases that have since been replaced or cancelled
+                if self.scheduled.get(voucher_template_id) != release_date:
+                    continue
 
-            # If the release date is in the future, we can stop
-            if release_date > current_time:
-                self.queue.put((release_date, voucher_template_id))
-                break
+                del self.scheduled[voucher_template_id]
+                due.append((release_date, voucher_template_id))
 
-            self._create_voucher(voucher_template_id, release_date)
-            vouchers_created += 1
+        return due
 
-            # Add the next batch of vouchers to the queue
-            self.add_voucher(voucher_template_id)
-
-        log_purple(f"Voucher Scheduler done creating voucher batches. Created=\"{vouchers_created}\"")
+    def _create_voucher_batches(self):
+        """
+        Creates the vouchers for templates that are scheduled to be created
 
-    def _create_voucher(self, voucher_template_id: int, release_date: datetime) -> int:
+        Every batch due in this tick is released in a single transaction
         """
-        Creates a voucher for the voucher template
+        log_purple("Voucher Scheduler creating voucher batches")
+        start = time.monotonic()
+
+        due = self._take_due(datetime.now(timezone.utc))
+        if due:
+            try:
+                schedules = get_voucher_template_schedules_by_ids([voucher_template_id for _, voucher_template_id in due])
+                next_releases = self._release_batch(due, schedules)
+            except Exception:
+                # Put the releases back so they are tried again
+                for release_date, voucher_template_id in due:
+                    self._schedule(voucher_template_id, release_date)
+                raise
+
+            for voucher_template_id, release_date in next_releases.items():
+                self._schedule(voucher_template_id, release_date)
+
+        tick_time.observe(time.monotonic() - start)
+        log_purple(f"Voucher Scheduler done creating voucher batches. Created=\"{len(due)}\"")
+
+    def _release_batch(
+        self,
+        due: List[Tuple[datetime, int]],
+        schedules: Dict[int, VoucherTemplateScheduleDetailsResponse]
+    ) -> Dict[int, Optional[datetime]]:
         """
-        voucher_template = get_voucher_template_schedule_by_id(voucher_template_id)
-
-        if voucher_template is None:
-            raise ValidationError("Voucher template not found")
+        Creates a voucher and its instances for each due release, returning the following release of each template
+        """
+        release_time = datetime.now(timezone.utc)
 
-        # Create the voucher
-        voucher = VoucherCreationRequest(
-            voucher_template=voucher_template_id,
-            release_date=release_date,
-            expiry_date=release_date + voucher_template.release_duration
-        )
+        # Templates removed or deleted since being queued are dropped
+        due = [(release_date, voucher_template_id) for release_date, voucher_template_id in due
+               if voucher_template_id in schedules and not schedules[voucher_template_id].is_deleted]
+        if not due:
+            return {}
 
-        release_time = datetime.now(timezone.utc)
+        # The vouchers, their whole batches of instances and the last releases are written together
+        with transaction():
+            # Releases another process already made come back without an id and get no instances
+            voucher_ids = insert_vouchers([VoucherCreationRequest(
+                voucher_template=voucher_template_id,
+                release_date=release_date,
+                expiry_date=release_date + schedules[voucher_template_id].release_duration
+            ) for release_date, voucher_template_id in due])
 
-        v_id = insert_voucher(voucher)
+            insert_voucher_instance_batches([VoucherInstanceCreationRequest(
+                status=("unclaimed"),
+                voucher=voucher_ids[voucher_template_id],
+                qty=schedules[voucher_template_id].release_size
+            ) for _, voucher_template_id in due if voucher_template_id in voucher_ids])
 
-        if v_id is None:
-            raise ValidationError("Error creating voucher")
+            update_voucher_templates_last_release([voucher_template_id for _, voucher_template_id in due], release_time)
 
-        insert_voucher_instance(VoucherInstanceCreationRequest(
-            status=("unclaimed"),
-            voucher=v_id,
-            qty=voucher_template.release_size
-        ))
+        next_releases = {}
+        for release_date, voucher_template_id in due:
+            if voucher_template_id in voucher_ids:
+                release_lag.observe((release_time - release_date).total_seconds())
 
-        update_voucher_template_last_release(voucher_template_id, release_time)
+            # Work out the next release from what was just written rather than reading the template again
+            schedule = schedules[voucher_template_id].model_copy(update={"last_release": release_time})
+            next_releases[voucher_template_id] = self._get_next_release(schedule)
 
-        return v_id
+        return next_releases
 
     def reset_scheduler(self):
         """
@@ -211,4 +388,4 @@ class VoucherScheduler(metaclass=SingletonMeta):
 
         Clears all data inside of it
         """
-        self.__init__()
+        self._initialise_queue()
@@ -2,28 +2,54 @@ import asyncio
 import os
 from typing import Literal, List, Tuple, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from psycopg2 import Error
 
-from db.helpers import connect, disconnect
+import metrics
+from logger import log_red
+from db.helpers import connect, connection_pool, disconnect, run_blocking
+from db.pool import PoolTimeoutError
 from db.linker import DatabaseSetup
+from functionality.errors import ServiceUnavailableError
+from functionality.media import move_inline_media
+from functionality.message import MAIL_BATCH_SIZE, deliver_mail_batch
+from functionality.password_hashing import password_hasher
+from functionality.thumbnails import THUMBNAIL_BATCH_SIZE, render_pending_thumbnails
 from functionality.voucher_scheduler import VoucherScheduler
-from router import customer, eatery, voucher, auth, other
+from router import customer, eatery, voucher, auth, other, media
+from router.util import database_transaction
 
-async def trigger_voucher_creation():
+async def mail_delivery_task():
     """
-    Triggers the voucher creation operation in the voucher schedular
+    Sends queued emails in batches, checking the outbox every few seconds once it is empty
     """
-    VoucherScheduler().trigger_voucher_creation()
+    while True:
+        try:
+            taken = await run_blocking(deliver_mail_batch)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            # Anything escaping would end the task for good, so log it and try again after the poll interval
+            log_red(f"Error delivering emails: {e!r}")
+            taken = 0
+
+        if taken < MAIL_BATCH_SIZE:
+            await asyncio.sleep(float(os.getenv("MAIL_POLL_SECONDS", "2")))
 
-async def voucher_creation_task():
+async def thumbnail_rendition_task():
     """
-    Schedules the voucher creation operation to occur every 30 seconds
+    Renders uploaded thumbnails in batches, checking for new uploads every few seconds once they are done
     """
     while True:
-        asyncio.create_task(trigger_voucher_creation())
-        await asyncio.sleep(int(os.getenv("SCHEDULER_REPEAT_SECONDS", "30")))
+        try:
+            taken = await run_blocking(render_pending_thumbnails)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            # Anything escaping would end the task for good, so log it and try again after the poll interval
+            log_red(f"Error rendering thumbnails: {e!r}")
+            taken = 0
+
+        if taken < THUMBNAIL_BATCH_SIZE:
+            await asyncio.sleep(float(os.getenv("THUMBNAIL_POLL_SECONDS", "2")))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI): # pylint: disable=W0621
@@ -31,9 +57,19 @@ async def lifespan(app: FastAPI): # pylint: disable=W0621
     Runs startup and shutdown logic of the app
     """
     # Preload
-    asyncio.create_task(voucher_creation_task())
+    await run_blocking(DatabaseSetup().migrate)
+    await run_blocking(move_inline_media)
+    scheduler = await run_blocking(VoucherScheduler)
+    scheduler.start()
+    mail_task = asyncio.create_task(mail_delivery_task())
+    thumbnail_task = asyncio.create_task(thumbnail_rendition_task())
     yield
     # Clean Up
+    mail_task.cancel()
+    thumbnail_task.cancel()
+    await run_blocking(scheduler.stop)
+    password_hasher.shutdown()
+    connection_pool.closeall()
 
 app = FastAPI(
     title="Chowdown App",
@@ -63,11 +99,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(eatery.router, prefix="/eatery", tags=["eatery"])
-app.include_router(voucher.router, prefix="/voucher", tags=["voucher"])
-app.include_router(customer.router, prefix="/customer", tags=["customer"])
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(_: Request, exc: PoolTimeoutError) -> JSONResponse:
+    """
+    Tells the client to back off when no database connection frees up in time
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": exc.message})
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(_: Request, exc: ServiceUnavailableError) -> JSONResponse:
+    """
+    Tells the client to back off when password hashing is saturated
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": exc.message})
+
+# Only the routers that use the database run each request as a unit of work, the rest never touch the pool
+app.include_router(auth.router, prefix="/auth", tags=["auth"], dependencies=[Depends(database_transaction)])
+app.include_router(eatery.router, prefix="/eatery", tags=["eatery"], dependencies=[Depends(database_transaction)])
+app.include_router(voucher.router, prefix="/voucher", tags=["voucher"], dependencies=[Depends(database_transaction)])
+app.include_router(customer.router, prefix="/customer", tags=["customer"], dependencies=[Depends(database_transaction)])
 app.include_router(other.router, prefix="/other", tags=["other"])
+app.include_router(media.router, prefix="/media", tags=["media"])
 
 @app.get("/")
 async def root():
@@ -102,10 +154,9 @@ AllTables = Literal[
   "reports"
 ]
 
-@app.get("/db/test")
-async def test_database():
+def _test_database():
     """
-    Test the database connection
+    Runs a trivial query against the database
     """
     try:
         conn = connect()
@@ -121,13 +172,28 @@ async def test_database():
     finally:
         disconnect(conn)
 
+@app.get("/db/test")
+async def test_database():
+    """
+    Test the database connection
+    """
+    return await run_blocking(_test_database)
+
+# Served outside the unit of work so the pool can be inspected while it is exhausted
+@app.get("/metrics")
+async def view_metrics():
+    """
+    View the current value of every metric, e.g. database pool usage and wait times
+    """
+    return metrics.snapshot()
+
 @app.get("/db/list")
 async def list_all_database_tables() -> List[str]:
     """
     list all db tables
     """
     db_setup = DatabaseSetup()
-    return db_setup.list_tables()
+    return await run_blocking(db_setup.list_tables)
 
 @app.delete("/db/clear")
 async def clear_database_table(table: AllTables):
@@ -135,7 +201,7 @@ async def clear_database_table(table: AllTables):
     clear db tables
     """
     db_setup = DatabaseSetup()
-    return db_setup.clear_tables([table])
+    return await run_blocking(db_setup.clear_tables, [table])
 
 @app.delete("/db/clear/all")
 async def clear_all_database_tables():
@@ -143,8 +209,8 @@ async def clear_all_database_tables():
     clear all db tables
     """
     db_setup = DatabaseSetup()
-    tables = db_setup.list_tables()
-    return db_setup.clear_tables(tables)
+    tables = await run_blocking(db_setup.list_tables)
+    return await run_blocking(db_setup.clear_tables, tables)
 
 @app.get("/table/{table_name}")
 async def view_table_entries(table_name: AllTables) -> Optional[List[Tuple]]:
@@ -152,4 +218,4 @@ async def view_table_entries(table_name: AllTables) -> Optional[List[Tuple]]:
     view the entries in table
     """
     db_setup = DatabaseSetup()
-    return db_setup.view_table(table_name)
+    return await run_blocking(db_setup.view_table, table_name)
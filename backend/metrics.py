@@ -0,0 +1,104 @@
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Upper bounds (in seconds) for latency histograms
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter:
+    def __init__(self, description: str):
+        self.description = description
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        """
+        Increments the counter
+        """
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets the current value of the counter
+        """
+        return {"type": "counter", "description": self.description, "value": self.value}
+
+class Gauge:
+    def __init__(self, description: str, read: Callable[[], float]):
+        self.description = description
+        self.read = read
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets the current value of the gauge
+        """
+        return {"type": "gauge", "description": self.description, "value": self.read()}
+
+class Histogram:
+    def __init__(self, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.description = description
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """
+        Records a single observation
+        """
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.total += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets the cumulative bucket counts, count and sum of the histogram
+        """
+        with self.lock:
+            cumulative = 0
+            buckets: Dict[str, int] = {}
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+                cumulative += count
+                buckets[bound] = cumulative
+
+            return {"type": "histogram", "description": self.description, "buckets": buckets, "count": cumulative, "sum": self.total}
+
+_registry: Dict[str, Any] = {}
+_registry_lock = threading.Lock()
+
+def counter(name: str, description: str) -> Counter:
+    """
+    Gets or registers a counter
+    """
+    return _register(name, lambda: Counter(description))
+
+def gauge(name: str, description: str, read: Callable[[], float]) -> Gauge:
+    """
+    Gets or registers a gauge whose value is read on demand
+    """
+    return _register(name, lambda: Gauge(description, read))
+
+def histogram(name: str, description: str, buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+    """
+    Gets or registers a histogram
+    """
+    return _register(name, lambda: Histogram(description, buckets or DEFAULT_BUCKETS))
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """
+    Gets the current value of every registered metric
+    """
+    with _registry_lock:
+        metrics = dict(_registry)
+
+    return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+def _register(name: str, create: Callable[[], Any]) -> Any:
+    """
+    Registers a metric under the given name unless it already exists
+    """
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = create()
+        return _registry[name]
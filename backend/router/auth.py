@@ -2,12 +2,13 @@ from typing import Annotated
 from fastapi import APIRouter, HTTPException, Response, Security, status, Request
 import jwt
 
-from db.helpers.session import get_user_type_by_session, view_session
+from db.helpers import run_blocking
 from router.api_types.api_request import CustomerRegistrationRequest, EateryRegistrationRequest, LoginRequest
 from router.api_types.api_response import AuthenticationResponse
-from functionality.authorisation import CustomerRegistrationForm, EateryRegistrationForm, customer_login_auth, customer_registration, eatery_login_auth, eatery_registration, logout
+from functionality.authorisation import CustomerRegistrationForm, EateryRegistrationForm, customer_login_auth, customer_registration, eatery_login_auth, eatery_registration, logout, \
+    refresh_session
 from functionality.errors import AuthorisationError, DuplicationError, ValidationError
-from functionality.token import HTTPBearer401, create_access_token, create_refresh_token_and_update_session, get_session_id_from_refresh_token, refresh_token_valid
+from functionality.token import HTTPBearer401
 
 router = APIRouter()
 
@@ -19,40 +20,18 @@ async def token_refresh(request: Request, response: Response) -> AuthenticationR
     refresh_token = request.cookies.get("refresh_token")
 
     try:
-        if not refresh_token or not refresh_token_valid(refresh_token):
+        if not refresh_token:
             raise AuthorisationError("Invalid refresh token")
 
-        sid = get_session_id_from_refresh_token(refresh_token)
-        session = view_session(sid)
-        uid = None
-        user_type = get_user_type_by_session(sid)
-        if session and session.customer:
-            uid = session.customer
-        elif session and session.eatery:
-            uid = session.eatery
-
-        if uid is None or user_type is None:
-            raise AuthorisationError("Session does not match user type")
-
-        # Create new refresh token
-        new_refresh_token = create_refresh_token_and_update_session(
-            user_type,
-            uid,
-            sid
-        )
-        new_access_token = create_access_token(sid)
+        res = await run_blocking(refresh_session, refresh_token)
 
         response.set_cookie(
             key="refresh_token",
-            value=new_refresh_token,
+            value=res["refresh_token"],
             httponly=True
         )
 
-        return AuthenticationResponse(
-            user_id=uid,
-            access_token=new_access_token,
-            user_type=user_type
-        )
+        return AuthenticationResponse(user_id=res["user_id"], user_type=res["user_type"], access_token=res["access_token"])
     except (ValueError, AuthorisationError, jwt.exceptions.PyJWTError) as e:
         response.delete_cookie("refresh_token")
         raise HTTPException(
@@ -67,7 +46,7 @@ async def logout_user(response: Response, token: Annotated[str, Security(HTTPBea
     Logs a user out of their account
     """
     try:
-        logout(token)
+        await run_blocking(logout, token)
         response.delete_cookie("refresh_token")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Username or Password is incorrect for customer") from e
@@ -87,7 +66,7 @@ async def register_customer(response: Response, customer: CustomerRegistrationRe
     )
 
     try:
-        res = customer_registration(customer_form)
+        res = await customer_registration(customer_form)
         response.set_cookie(
             key="refresh_token",
             value=res["refresh_token"],
@@ -107,7 +86,7 @@ async def customer_login(response: Response, customer_login_props: LoginRequest)
     Logs a customer in
     """
     try:
-        res = customer_login_auth(
+        res = await customer_login_auth(
             customer_login_props.email,
             customer_login_props.password
         )
@@ -141,7 +120,7 @@ async def register_eatery(response: Response, eatery: EateryRegistrationRequest)
     )
 
     try:
-        res = eatery_registration(eatery_form)
+        res = await eatery_registration(eatery_form)
 
         response.set_cookie(
             key="refresh_token",
@@ -163,7 +142,7 @@ async def eatery_login(response: Response, eatery_login_props: LoginRequest) ->
     Logs a eatery in
     """
     try:
-        res = eatery_login_auth(
+        res = await eatery_login_auth(
             eatery_login_props.email,
             eatery_login_props.password
         )
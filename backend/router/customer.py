@@ -1,8 +1,10 @@
 from typing import Annotated
 from fastapi import APIRouter, HTTPException, Security, status
 
+from db.helpers import run_blocking
+
 from functionality.errors import ValidationError, DuplicationError
-from functionality.customer import edit_customer_profile, get_customer_profile, customer_vouchers, make_favourite_eatery, \
+from functionality.customer import edit_customer_profile, get_customer_profile, new_customer_password_hash, customer_vouchers, make_favourite_eatery, \
     make_unfavourite_eatery, make_hide_eatery, make_unhide_eatery
 from functionality.token import HTTPBearer401
 
@@ -20,9 +22,9 @@ async def display_full_details_of_customer(customer_id: int, token: Annotated[st
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this profile")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this profile")
 
-    return get_customer_profile(customer_id)
+    return await run_blocking(get_customer_profile, customer_id)
 
 @router.put("/{customer_id}/profile", status_code=status.HTTP_200_OK)
 async def update_customer_details(customer_id: int, customer_new_info: CustomerUpdatesRequest, token: Annotated[str, Security(HTTPBearer401())]):
@@ -31,12 +33,15 @@ async def update_customer_details(customer_id: int, customer_new_info: CustomerU
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this profile")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this profile")
 
     kwargs = {key: getattr(customer_new_info, key, None) for key, value in customer_new_info.model_dump().items() if value is not None}
 
     try:
-        return edit_customer_profile(customer_id, **kwargs)
+        if "password" in kwargs:
+            kwargs["password_hash"] = await new_customer_password_hash(customer_id, kwargs.pop("password"))
+
+        return await run_blocking(edit_customer_profile, customer_id, **kwargs)
     except DuplicationError as d:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(d)) from d
     except ValidationError as v:
@@ -51,9 +56,9 @@ async def get_customer_vouchers(customer_id: int, token: Annotated[str, Security
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
 
-    return customer_vouchers(customer_id)
+    return await run_blocking(customer_vouchers, customer_id)
 
 @router.put("/{customer_id}/favourite_eateries", status_code=status.HTTP_200_OK)
 async def customer_favourite_eatery(customer_id: int, favourite_eatery: CustomerFavouriteEatery, token: Annotated[str, Security(HTTPBearer401())]):
@@ -62,9 +67,9 @@ async def customer_favourite_eatery(customer_id: int, favourite_eatery: Customer
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
 
-    return make_favourite_eatery(customer_id, favourite_eatery.eatery_id)
+    return await run_blocking(make_favourite_eatery, customer_id, favourite_eatery.eatery_id)
 
 @router.delete("/{customer_id}/favourite_eateries", status_code=status.HTTP_200_OK)
 async def customer_unfavourite_eatery(customer_id: int, unfavourite_eatery: CustomerUnfavouriteEatery, token: Annotated[str, Security(HTTPBearer401())]):
@@ -73,9 +78,9 @@ async def customer_unfavourite_eatery(customer_id: int, unfavourite_eatery: Cust
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
 
-    return make_unfavourite_eatery(customer_id, unfavourite_eatery.eatery_id)
+    return await run_blocking(make_unfavourite_eatery, customer_id, unfavourite_eatery.eatery_id)
 
 @router.put("/{customer_id}/hidden_eateries", status_code=status.HTTP_200_OK)
 async def customer_hide_eatery(customer_id: int, hide_eatery: CustomerHideEatery, token: Annotated[str, Security(HTTPBearer401())]):
@@ -84,9 +89,9 @@ async def customer_hide_eatery(customer_id: int, hide_eatery: CustomerHideEatery
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
 
-    return make_hide_eatery(customer_id, hide_eatery.eatery_id)
+    return await run_blocking(make_hide_eatery, customer_id, hide_eatery.eatery_id)
 
 @router.delete("/{customer_id}/hidden_eateries", status_code=status.HTTP_200_OK)
 async def customer_unhide_eatery(customer_id: int, unhide_eatery: CustomerUnhideEatery, token: Annotated[str, Security(HTTPBearer401())]):
@@ -95,6 +100,6 @@ async def customer_unhide_eatery(customer_id: int, unhide_eatery: CustomerUnhide
 
     Must be authenticated as the same customer as the customer_id
     """
-    check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
+    await check_customer_id_matches_token(customer_id, token, "You are not authorized to view this page")
 
-    return make_unhide_eatery(customer_id, unhide_eatery.eatery_id)
+    return await run_blocking(make_unhide_eatery, customer_id, unhide_eatery.eatery_id)
@@ -1,9 +1,12 @@
 from typing import Annotated, List, Optional
 from fastapi import APIRouter, HTTPException, Query, Security, status
 
+from db.helpers import run_blocking
+
 from functionality.search import search_eateries
 from functionality.token import HTTPBearer401
-from functionality.eatery import get_eatery_information_responses, list_eateries, eatery_details, edit_eatery_profile, eatery_vouchers, eatery_reviews, eatery_review_creation, recommend_eateries
+from functionality.eatery import get_eatery_information_responses, list_eateries, eatery_details, edit_eatery_profile, new_eatery_password_hash, \
+    eatery_vouchers, eatery_reviews, eatery_review_creation, recommend_eateries
 from functionality.errors import ValidationError, DuplicationError, AuthorisationError
 from functionality.recommendations import Sorts
 
@@ -19,7 +22,7 @@ async def list_of_eateries() -> HomePageResponse:
     """
     Gets a list of the public details for all Eateries
     """
-    return list_eateries()
+    return await run_blocking(list_eateries)
 
 @router.get("/list/personalised", status_code=status.HTTP_200_OK, response_model=HomePageResponse)
 async def get_customer_recommended_eateries(
@@ -29,12 +32,12 @@ async def get_customer_recommended_eateries(
     """
     Gets a list of the public details for all Eateries in a sorted order based off proximity, preferences, and reviews.
     """
-    customer_id = get_customer_id(token)
+    customer_id = await get_customer_id(token)
     sort_criteria = []
     if sort_by:
         sort_criteria = [Sorts[s.upper()] for s in sort_by if s.upper() in Sorts.__members__]
 
-    return HomePageResponse(eateries=recommend_eateries(customer_id, sort_criteria)[:max_count])
+    return HomePageResponse(eateries=(await run_blocking(recommend_eateries, customer_id, sort_criteria))[:max_count])
 
 @router.get("/{eatery_id}/details", status_code=status.HTTP_200_OK, response_model=PrivateEateryDetailsResponse)
 async def display_full_details_of_eatery(eatery_id: int, token: Annotated[str, Security(HTTPBearer401())]) -> PrivateEateryDetailsResponse:
@@ -43,10 +46,10 @@ async def display_full_details_of_eatery(eatery_id: int, token: Annotated[str, S
 
     eatery_id (int): ID of the eatery
     """
-    check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
+    await check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
 
     try:
-        return eatery_details(eatery_id, "private")
+        return await run_blocking(eatery_details, eatery_id, "private")
     except ValidationError as v:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(v)) from v
 
@@ -59,12 +62,15 @@ async def update_eatery_details(eatery_id: int, eatery_info: EateryUpdatesReques
 
     eatery_id (int): ID of the eatery
     """
-    check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
+    await check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
 
     kwargs = {key: getattr(eatery_info, key, None) for key, value in eatery_info.model_dump().items() if value is not None}
 
     try:
-        return edit_eatery_profile(eatery_id, **kwargs)
+        if "password" in kwargs:
+            kwargs["password_hash"] = await new_eatery_password_hash(eatery_id, kwargs.pop("password"))
+
+        return await run_blocking(edit_eatery_profile, eatery_id, **kwargs)
     except DuplicationError as d:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(d)) from d
     except ValidationError as v:
@@ -80,7 +86,7 @@ async def get_public_details_of_eatery(eatery_id: int) -> PublicEateryDetailsRes
     eatery_id (int): ID of the eatery
     """
     try:
-        return eatery_details(eatery_id, "private")
+        return await run_blocking(eatery_details, eatery_id, "public")
     except ValidationError as v:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(v)) from v
 
@@ -93,9 +99,12 @@ async def update_eatery_thumbnail(eatery_id: int, thumbnail: EateryThumbnailUpda
 
     eatery_id (int): ID of the eatery
     """
-    check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
+    await check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
 
-    return edit_eatery_profile(eatery_id, thumbnail_uri=thumbnail.thumbnail_uri)
+    try:
+        return await run_blocking(edit_eatery_profile, eatery_id, thumbnail_uri=thumbnail.thumbnail_uri)
+    except ValidationError as v:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(v)) from v
 
 @router.put("/{eatery_id}/menu", status_code=status.HTTP_200_OK)
 async def update_eatery_menu(eatery_id: int, menu: EateryMenuUpdateRequest, token: Annotated[str, Security(HTTPBearer401())]):
@@ -106,9 +115,12 @@ async def update_eatery_menu(eatery_id: int, menu: EateryMenuUpdateRequest, toke
 
     eatery_id (int): ID of the eatery
     """
-    check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
+    await check_eatery_id_matches_token(eatery_id, token, "You are not authorized to view this profile")
 
-    return edit_eatery_profile(eatery_id, menu_uri=menu.menu_uri)
+    try:
+        return await run_blocking(edit_eatery_profile, eatery_id, menu_uri=menu.menu_uri)
+    except ValidationError as v:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(v)) from v
 
 @router.get("/{eatery_id}/vouchers", status_code=status.HTTP_200_OK, response_model=EateryVoucherListResponse)
 async def get_eatery_vouchers(eatery_id: int) -> EateryVoucherListResponse:
@@ -117,7 +129,7 @@ async def get_eatery_vouchers(eatery_id: int) -> EateryVoucherListResponse:
 
     eatery_id (int): ID of the eatery
     """
-    return eatery_vouchers(eatery_id)
+    return await run_blocking(eatery_vouchers, eatery_id)
 
 @router.get("/{eatery_id}/reviews", status_code=status.HTTP_200_OK, response_model=EateryReviewListResponse)
 async def get_eatery_reviews(eatery_id: int) -> EateryReviewListResponse:
@@ -126,7 +138,7 @@ async def get_eatery_reviews(eatery_id: int) -> EateryReviewListResponse:
 
     eatery_id (int): ID of the eatery
     """
-    return eatery_reviews(eatery_id)
+    return await run_blocking(eatery_reviews, eatery_id)
 
 @router.post("/{eatery_id}/reviews", status_code=status.HTTP_200_OK, response_model=ReviewCreationResponse)
 async def create_eatery_review(eatery_id: int, review_info: ReviewCreateRequest, token: Annotated[str, Security(HTTPBearer401())]) -> ReviewCreationResponse:
@@ -134,7 +146,7 @@ async def create_eatery_review(eatery_id: int, review_info: ReviewCreateRequest,
     Creates a review for a logged in customer who has claimed and redeemed a voucher but is yet to review
     """
     try:
-        return eatery_review_creation(eatery_id, get_customer_id(token), review_info)
+        return await run_blocking(eatery_review_creation, eatery_id, await get_customer_id(token), review_info)
     except AuthorisationError as a:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(a)) from a
     except ValidationError as v:
@@ -149,7 +161,7 @@ async def eateries_search(search_query: str = "") -> EaterySearchResponse:
     """
     # For the case that we get an empty search, use the general list of eateries
     if search_query == "":
-        eatery_info_responses = get_eatery_information_responses()
+        eatery_info_responses = await run_blocking(get_eatery_information_responses)
 
         return EaterySearchResponse(eateries=eatery_info_responses)
 
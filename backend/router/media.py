@@ -0,0 +1,29 @@
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Response, status
+from fastapi.responses import FileResponse
+
+from functionality.media import media_content_type, media_path
+
+router = APIRouter()
+
+# Media is named by its contents so a URL always serves the same bytes, clients can keep it forever
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@router.get("/{name}", status_code=status.HTTP_200_OK, response_class=FileResponse)
+async def get_media(name: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Serves an uploaded image or menu, streaming it from disk
+
+    name (str): The content hash and extension of the media
+    """
+    path = media_path(name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media not found")
+
+    etag = f"\"{name.split('.', 1)[0]}\""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(path, media_type=media_content_type(name), headers=headers)
@@ -1,6 +1,9 @@
 import os
+from functools import partial
+import anyio
 import requests
 from fastapi import APIRouter, HTTPException, status
+
 from router.api_types.api_request import AddressAutocompletionResponse
 
 router = APIRouter()
@@ -24,7 +27,9 @@ async def autocomplete_address(query: str) -> AddressAutocompletionResponse:
 
 
     try:
-        res = requests.get(
+        # Not run_blocking, its limiter is kept for calls that may be holding a database connection
+        res = (await anyio.to_thread.run_sync(partial(
+            requests.get,
             "https://api.geoapify.com/v1/geocode/autocomplete",
             params={
                 "text": query,
@@ -35,7 +40,7 @@ async def autocomplete_address(query: str) -> AddressAutocompletionResponse:
                 "apiKey": GEOAPIFY_API_KEY,
             },
             timeout=5
-        ).json()
+        ))).json()
     except Exception as e:
         # assume that we got rate limitted or something else happened
         raise HTTPException(
@@ -3,6 +3,8 @@ import jwt
 
 from fastapi import APIRouter, HTTPException, Security, status
 
+from db.helpers import run_blocking
+
 from functionality.errors import AuthorisationError, ValidationError
 from functionality.token import HTTPBearer401
 from functionality.voucher import VoucherCreationForm, create_voucher, voucher_accept_redemption_code, voucher_claim, \
@@ -33,10 +35,10 @@ async def register_voucher(voucher: VoucherCreateRequest, token: Annotated[str,
         schedule=voucher.schedule,
     )
 
-    check_eatery_id_matches_token(voucher.eatery_id, token, "You are not authorized to view this profile")
+    await check_eatery_id_matches_token(voucher.eatery_id, token, "You are not authorized to view this profile")
 
     try:
-        return create_voucher(voucher_form)
+        return await run_blocking(create_voucher, voucher_form)
     except ValidationError as v:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=v.message) from v
     except jwt.DecodeError as d:
@@ -50,7 +52,7 @@ async def get_voucher(voucher_id: int) -> VoucherDetailsResponse:
     Given a voucher_id, returns the details of such a voucher
     """
     try:
-        return voucher_details(voucher_id)
+        return await run_blocking(voucher_details, voucher_id)
     except ValidationError as v:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=v.message) from v
 
@@ -59,10 +61,10 @@ async def claim_voucher(voucher_id: int, voucher_claim_request: VoucherClaimRequ
     """
     Given a voucher_id and customer_id, claims an instance of the voucher for the customer
     """
-    check_customer_id_matches_token(voucher_claim_request.customer_id, token, "You are not authorized to view this profile")
+    await check_customer_id_matches_token(voucher_claim_request.customer_id, token, "You are not authorized to view this profile")
 
     try:
-        return voucher_claim(voucher_id, voucher_claim_request.customer_id)
+        return await run_blocking(voucher_claim, voucher_id, voucher_claim_request.customer_id)
     except jwt.DecodeError as d:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token") from d
     except ValidationError as v:
@@ -74,7 +76,7 @@ async def redeem_voucher_instance(instance_id: int, token: Annotated[str, Securi
     Given a voucher_instance_id, marks the voucher as redeemed
     """
     try:
-        return voucher_redeem_instance(instance_id, get_customer_id(token))
+        return await run_blocking(voucher_redeem_instance, instance_id, await get_customer_id(token))
     except AuthorisationError as ae:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ae.message) from ae
     except ValidationError as v:
@@ -86,7 +88,7 @@ async def redemption_voucher_code(code: str, token: Annotated[str, Security(HTTP
     Given a redemption code, returns the details of the voucher instance
     """
     try:
-        return voucher_get_redemption_code(code, get_eatery_id(token))
+        return await run_blocking(voucher_get_redemption_code, code, await get_eatery_id(token))
     except AuthorisationError as ae:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ae.message) from ae
     except ValidationError as v:
@@ -98,7 +100,7 @@ async def accept_voucher_redemption(code: str, token: Annotated[str, Security(HT
     Given a redemption code, marks the voucher as redeemed
     """
     try:
-        return voucher_accept_redemption_code(code, get_eatery_id(token))
+        return await run_blocking(voucher_accept_redemption_code, code, await get_eatery_id(token))
     except AuthorisationError as ae:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ae.message) from ae
     except ValidationError as v:
@@ -110,7 +112,7 @@ async def reject_voucher_redemption(code: str, token: Annotated[str, Security(HT
     Given a redemption code, marks the voucher as rejected
     """
     try:
-        return voucher_reject_redemption_code(code, get_eatery_id(token))
+        return await run_blocking(voucher_reject_redemption_code, code, await get_eatery_id(token))
     except AuthorisationError as ae:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ae.message) from ae
     except ValidationError as v:
@@ -2,6 +2,8 @@ import json
 import pytest
 import copy
 
+from db.helpers.session import cache_hits, cache_misses
+
 from testing import client
 from testing.test_helpers import register_customer, register_eatery, login_customer, logout_user, refresh_token, view_eatery_private_details
 # Load data from JSON file
@@ -122,6 +124,27 @@ class TestAuthenticationFlow:
         # Try to logout the user again and expect failure
         assert logout_user(header).status_code == 401
 
+class TestSessionCache:
+    def test_repeated_requests_skip_session_lookup(self, reset_db):
+        _, access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        header = {"Authorization": "bearer " + access_token}
+
+        assert view_eatery_private_details(eatery_id, header).status_code == 200
+        misses, hits = cache_misses.value, cache_hits.value
+
+        # The session is already in memory, so the second request never looks it up
+        assert view_eatery_private_details(eatery_id, header).status_code == 200
+        assert cache_misses.value == misses
+        assert cache_hits.value > hits
+
+    def test_logout_evicts_cached_session(self, reset_db):
+        _, access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        header = {"Authorization": "bearer " + access_token}
+
+        assert view_eatery_private_details(eatery_id, header).status_code == 200
+        assert logout_user(header).status_code == 200
+        assert view_eatery_private_details(eatery_id, header).status_code == 401
+
 class TestAuthorizationScope:
     def test_customer_can_only_view_customer_details(self, reset_db):
         # Authenticate Customer
@@ -1,7 +1,9 @@
 import json
 
 from testing.test_helpers import login_customer, logout_user, register_customer, update_customer_profile, view_customer_profile
+from functionality.authorisation import PASSWORD_HISTORY_SIZE
 from functionality.customer import get_customer_profile
+from db.helpers.customer import get_customer_old_passwords_by_id
 from router.api_types.api_response import AddressResponse, CustomerDetailsResponse
 
 # Load data from JSON file
@@ -77,3 +79,26 @@ class TestCustomerListFlow:
         }
         login_customer(payload)
 
+
+class TestCustomerPasswordHistory:
+    def test_cannot_reuse_past_password(self, reset_db):
+        _, access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        header = {"Authorization": "bearer " + access_token}
+
+        assert update_customer_profile(customer_id, header, {"password": "first_Password1234"}).status_code == 200
+        assert update_customer_profile(customer_id, header, {"password": "second_Password1234"}).status_code == 200
+
+        # The first password is now in the history
+        assert update_customer_profile(customer_id, header, {"password": "first_Password1234"}).status_code == 400
+
+    def test_history_is_pruned(self, reset_db):
+        _, access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        header = {"Authorization": "bearer " + access_token}
+
+        for i in range(PASSWORD_HISTORY_SIZE + 2):
+            assert update_customer_profile(customer_id, header, {"password": f"history_Password{i}"}).status_code == 200
+
+        assert len(get_customer_old_passwords_by_id(customer_id)) == PASSWORD_HISTORY_SIZE
+
+        # The oldest passwords fell out of the history so can be used again
+        assert update_customer_profile(customer_id, header, {"password": "history_Password0"}).status_code == 200
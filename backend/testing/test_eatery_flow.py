@@ -1,12 +1,20 @@
+import base64
 import json
 import os
 import random
 
 from testing.test_helpers import list_eateries, register_eatery, view_eatery_vouchers, view_eatery_public_details, \
     view_eatery_private_details, update_eatery_details, login_eatery, register_customer, create_review, \
-    redeem_voucher_instance, accept_redemption_code
+    redeem_voucher_instance, accept_redemption_code, view_eatery_reviews, list_personalised_eateries, view_media
 from testing.helpers import eatery_create_voucher, create_voucher_payload, make_image_uri, make_pdf_uri, \
-    eatery_leave_review, create_anonymous_reviews, customer_claim_voucher
+    eatery_leave_review, create_anonymous_reviews, customer_claim_voucher, customer_redeem_voucher_instance
+
+from db.helpers.eatery import get_eatery_by_id, get_eatery_summaries_by_ids, get_eatery_locations_by_ids, \
+    get_eatery_addresses_by_ids, get_eateries_by_ids, get_eatery_features_by_ids, add_eatery_keywords, delete_eatery_keywords, \
+    update_eatery_address
+from db.helpers.review import get_eatery_ratings_by_ids
+from db.helpers.voucher_template import update_voucher_template_is_deleted
+from db.db_types.db_request import AddressCreationRequest
 
 from logger import log_purple
 
@@ -42,6 +50,34 @@ class TestEateryListFlow:
         # we know these 4 eateries had unique names
         assert set(names) == set(business_names)
 
+    def test_list_of_eateries_voucher_summary(self, reset_db):
+        # Create a customer and an eatery
+        _, customer_access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        customer_header = {"Authorization": "bearer " + customer_access_token}
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        # Eatery creates 4 vouchers with a single instance each
+        voucher_ids = []
+        for key in range(1, 5):
+            _, voucher_create_payload = create_voucher_payload(voucher_data[str(key)], eatery_id, quantity=1).values()
+            voucher_ids.append(eatery_create_voucher(eatery_header, voucher_create_payload))
+
+        eateries = list_eateries()
+        assert len(eateries) == 1
+        assert eateries[0]["num_vouchers"] == 4
+        assert len(eateries[0]["top_three_vouchers"]) == 3
+
+        # Customer claims the only instance of the first voucher
+        customer_claim_voucher(customer_id, voucher_ids[0], customer_header)
+
+        eateries = list_eateries()
+        assert eateries[0]["num_vouchers"] == 3
+
+        # Top vouchers are named after the templates they were created from
+        names = {voucher_data[str(key)]["name"] for key in range(1, 5)}
+        assert all(name in names for _, name in eateries[0]["top_three_vouchers"])
+
 class TestEateryDetailsFlow:
     def test_public_details(self, reset_db):
         # Create an eatery
@@ -470,8 +506,14 @@ class TestEateryDetailsFlow:
         details = details_response.json()
         assert "thumbnail_uri" in details
 
-        # Check if the Eatery's thumbnail_uri has been updated in public details
-        assert details["thumbnail_uri"] == thumbnail_uri_data
+        # Check if the Eatery's thumbnail_uri has been updated in public details, it now points at the stored image
+        thumbnail_uri = details["thumbnail_uri"]
+        assert not thumbnail_uri.startswith("data:")
+
+        media_response = view_media(thumbnail_uri)
+        assert media_response.status_code == 200
+        assert media_response.headers["content-type"] == "image/jpeg"
+        assert thumbnail_uri_data.endswith(base64.b64encode(media_response.content).decode())
 
         # Get private details of Eatery again
         details_response = view_eatery_private_details(eatery_id, eatery_header)
@@ -480,7 +522,7 @@ class TestEateryDetailsFlow:
         assert "thumbnail_uri" in details
 
         # Check if the Eatery's thumbnail_uri has been updated in private details
-        assert details["thumbnail_uri"] == thumbnail_uri_data
+        assert details["thumbnail_uri"] == thumbnail_uri
     
     def test_update_menu_uri(self, reset_db):
         # Create an eatery
@@ -517,8 +559,14 @@ class TestEateryDetailsFlow:
         details = details_response.json()
         assert "menu_uri" in details
 
-        # Check if the Eatery's menu_uri has been updated in public details
-        assert details["menu_uri"] == menu_uri_data
+        # Check if the Eatery's menu_uri has been updated in public details, it now points at the stored menu
+        menu_uri = details["menu_uri"]
+        assert not menu_uri.startswith("data:")
+
+        media_response = view_media(menu_uri)
+        assert media_response.status_code == 200
+        assert media_response.headers["content-type"] == "application/pdf"
+        assert menu_uri_data.endswith(base64.b64encode(media_response.content).decode())
 
         # Get private details of Eatery again
         details_response = view_eatery_private_details(eatery_id, eatery_header)
@@ -527,7 +575,84 @@ class TestEateryDetailsFlow:
         assert "menu_uri" in details
 
         # Check if the Eatery's menu_uri has been updated in private details
-        assert details["menu_uri"] == menu_uri_data
+        assert details["menu_uri"] == menu_uri
+
+class TestEateryProjections:
+    def test_projections_match_full_details(self, reset_db):
+        eatery_ids = [list(register_eatery(register_data["eatery"][key]).values())[-1] for key in ["1", "2"]]
+        missing_id = max(eatery_ids) + 1000
+
+        summaries = get_eatery_summaries_by_ids(eatery_ids + [missing_id])
+        locations = get_eatery_locations_by_ids(eatery_ids + [missing_id])
+        addresses = get_eatery_addresses_by_ids(eatery_ids + [missing_id])
+        eateries = get_eateries_by_ids(eatery_ids + [missing_id])
+
+        # Eateries that don't exist are left out rather than failing the batch
+        for projection in [summaries, locations, addresses, eateries]:
+            assert set(projection) == set(eatery_ids)
+
+        for eatery_id in eatery_ids:
+            eatery = get_eatery_by_id(eatery_id)
+            assert eateries[eatery_id] == eatery
+
+            assert summaries[eatery_id].business_name == eatery.business_name
+            assert summaries[eatery_id].thumbnail == eatery.thumbnail
+            assert summaries[eatery_id].date_joined == eatery.date_joined
+            assert locations[eatery_id] == (eatery.address.latitude, eatery.address.longitude)
+            assert addresses[eatery_id] == eatery.address
+
+        assert get_eatery_by_id(missing_id) is None
+
+class TestEateryFeatures:
+    def test_features_follow_writes(self, reset_db):
+        _, customer_access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        customer_header = {"Authorization": "bearer " + customer_access_token}
+
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        # A new eatery has its row as soon as it registers
+        features = get_eatery_features_by_ids([eatery_id])[eatery_id]
+        eatery = get_eatery_by_id(eatery_id)
+        assert (features.latitude, features.longitude) == (eatery.address.latitude, eatery.address.longitude)
+        assert features.date_joined == eatery.date_joined
+        assert features.active_vouchers == 0
+        assert features.rating.review_count == 0
+        assert features.keyword_ids == []
+
+        add_eatery_keywords(eatery_id, ["Pizza", "Pasta"])
+        assert len(get_eatery_features_by_ids([eatery_id])[eatery_id].keyword_ids) == 2
+
+        delete_eatery_keywords(eatery_id, ["pasta"])
+        assert len(get_eatery_features_by_ids([eatery_id])[eatery_id].keyword_ids) == 1
+
+        address = register_data["eatery"]["1"]["address"]
+        update_eatery_address(eatery_id, AddressCreationRequest(
+            unit_number=address["unit_number"],
+            house_number=address["house_number"],
+            street_addr=address["street"],
+            city=address["city"],
+            state=address["state"],
+            county=address["county"],
+            country=address["country"],
+            postcode=address["postcode"],
+            longitude=151.0,
+            latitude=-33.0,
+            formatted_str=address["fmt_address"]
+        ))
+        features = get_eatery_features_by_ids([eatery_id])[eatery_id]
+        assert (features.latitude, features.longitude) == (-33.0, 151.0)
+
+        _, voucher_create_payload = create_voucher_payload(voucher_data["1"], eatery_id).values()
+        voucher_id = eatery_create_voucher(eatery_header, voucher_create_payload)
+        assert get_eatery_features_by_ids([eatery_id])[eatery_id].active_vouchers == 1
+
+        eatery_leave_review(customer_id, customer_header, eatery_id, eatery_header, voucher_id)
+        assert get_eatery_features_by_ids([eatery_id])[eatery_id].rating == get_eatery_ratings_by_ids([eatery_id])[eatery_id]
+
+        # Deleted templates don't count towards the eatery's vouchers
+        update_voucher_template_is_deleted(voucher_id, True)
+        assert get_eatery_features_by_ids([eatery_id])[eatery_id].active_vouchers == 0
 
 class TestEateryVouchersFlow:
     def test_get_eatery_routes(self, reset_db):
@@ -733,3 +858,43 @@ class TestEateryReviewsFlow:
         # Get eatery count and expect 4
         eateries = list_eateries()
         assert len(eateries) == 4
+
+    def test_average_rating_matches_reviews(self, reset_db):
+        # Create a customer and an eatery
+        _, customer_access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        customer_header = {"Authorization": "bearer " + customer_access_token}
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        # Customer redeems and reviews 3 different vouchers
+        for key in range(1, 4):
+            _, voucher_create_payload = create_voucher_payload(voucher_data[str(key)], eatery_id).values()
+            voucher_id = eatery_create_voucher(eatery_header, voucher_create_payload)
+            voucher_instance_id = customer_claim_voucher(customer_id, voucher_id, customer_header)
+            redemption_code = customer_redeem_voucher_instance(voucher_instance_id, customer_header)
+            assert accept_redemption_code(redemption_code, eatery_header).status_code == 200
+
+            review_payload = create_anonymous_reviews(anon_review_data[str(key)], voucher_instance_id)
+            assert create_review(eatery_id, customer_header, review_payload).status_code == 200
+
+        ratings = [review["rating"] for review in view_eatery_reviews(eatery_id)]
+        assert len(ratings) == 3
+
+        # Average rating is the mean of all reviews left for the eatery
+        details = view_eatery_public_details(eatery_id).json()
+        assert abs(details["average_rating"] - sum(ratings) / len(ratings)) < 1e-9
+
+    def test_personalised_list_only_nearby(self, reset_db):
+        # Customer lives in Kensington
+        _, customer_access_token, _ = register_customer(register_data["customer"]["3"]).values()
+        customer_header = {"Authorization": "bearer " + customer_access_token}
+
+        # Kensington is a few hundred meters away, Maroubra a few km and Chargrill Charlies is in another state
+        eatery_ids = {}
+        for key in ["1", "9", "11"]:
+            _, _, eatery_ids[key] = register_eatery(register_data["eatery"][key]).values()
+
+        res = list_personalised_eateries(customer_header, ["distance"])
+        assert res.status_code == 200
+
+        assert [eatery["eatery_id"] for eatery in res.json()["eateries"]] == [eatery_ids["11"], eatery_ids["9"]]
@@ -54,6 +54,9 @@ def refresh_token(header):
 def list_eateries():
     return client.get("/eatery/list").json().get("eateries")
 
+def list_personalised_eateries(header, sort_by=None):
+    return client.get("/eatery/list/personalised", headers=header, params={"sort_by": sort_by or []})
+
 def view_eatery_private_details(eatery_id, header):
     return client.get("/eatery/" + str(eatery_id) + "/details", headers=header)
 
@@ -110,3 +113,6 @@ def view_customer_vouchers(customer_id, header):
 
 def search(query):
     return client.get("/eatery/search", params={"search_query": query})
+
+def view_media(media_uri, header=None):
+    return client.get("/media/" + media_uri.rsplit("/", 1)[-1], headers=header)
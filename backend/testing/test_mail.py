@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+import pytest
+import requests
+
+from db.helpers import transaction
+from db.helpers.mail_outbox import claim_mail_batch, count_pending_mail
+import functionality.message as message
+import main
+from functionality.message import FakeMailTransport, MailerSendTransport, MailTransport, deliver_mail_batch, send_email
+
+from testing.test_helpers import register_customer
+
+# Load data from JSON file
+with open("testing/test_data.json", encoding="utf8") as file:
+    test_data = json.load(file)
+
+# Fetching test_data
+register_data = test_data["register_data"]
+
+class TestMailOutbox:
+    def test_registration_queues_welcome_email(self, reset_db):
+        register_customer(register_data["customer"]["1"])
+        transport = FakeMailTransport()
+
+        assert deliver_mail_batch(transport) == 1
+        assert [mail.to_email for mail in transport.sent] == [register_data["customer"]["1"]["email"]]
+
+        # Nothing is sent twice
+        assert deliver_mail_batch(transport) == 0
+        assert len(transport.sent) == 1
+
+    def test_rolled_back_email_is_never_sent(self, reset_db):
+        with pytest.raises(ValueError):
+            with transaction():
+                send_email("Subject", "test@test.com", "Test", "Body")
+                raise ValueError("request failed")
+
+        assert count_pending_mail(message.MAIL_MAX_ATTEMPTS) == 0
+
+    def test_same_email_queued_once(self, reset_db):
+        send_email("Subject", "test@test.com", "Test", "Body", dedupe_key="key")
+        send_email("Subject", "test@test.com", "Test", "Body", dedupe_key="key")
+        send_email("Subject", "test@test.com", "Test", "Other body")
+        send_email("Subject", "test@test.com", "Test", "Other body")
+
+        assert count_pending_mail(message.MAIL_MAX_ATTEMPTS) == 2
+
+    def test_failed_email_is_retried(self, reset_db, monkeypatch):
+        monkeypatch.setattr(message, "MAIL_BACKOFF_SECONDS", 0)
+        monkeypatch.setattr(message, "MAIL_MAX_ATTEMPTS", 2)
+        send_email("Subject", "test@test.com", "Test", "Body")
+
+        transport = FakeMailTransport()
+        transport.failures = 1
+        assert deliver_mail_batch(transport) == 1
+        assert not transport.sent
+
+        assert deliver_mail_batch(transport) == 1
+        assert len(transport.sent) == 1
+
+    def test_gives_up_after_max_attempts(self, reset_db, monkeypatch):
+        monkeypatch.setattr(message, "MAIL_BACKOFF_SECONDS", 0)
+        monkeypatch.setattr(message, "MAIL_MAX_ATTEMPTS", 2)
+        send_email("Subject", "test@test.com", "Test", "Body")
+
+        transport = FakeMailTransport()
+        transport.failures = 5
+        assert deliver_mail_batch(transport) == 1
+        assert deliver_mail_batch(transport) == 1
+        assert deliver_mail_batch(transport) == 0
+        assert count_pending_mail(2) == 0
+
+    def test_worker_dying_mid_batch_resends_nothing(self, reset_db, monkeypatch):
+        monkeypatch.setattr(message, "MAIL_LEASE_SECONDS", 0)
+        for i in range(3):
+            send_email("Subject", f"test{i}@test.com", "Test", "Body")
+
+        class DyingTransport(FakeMailTransport):
+            def send(self, mail):
+                if len(self.sent) == 2:
+                    raise SystemExit
+                super().send(mail)
+
+        with pytest.raises(SystemExit):
+            deliver_mail_batch(DyingTransport())
+
+        # Once the lease is up only the email that never went out is sent
+        transport = FakeMailTransport()
+        assert deliver_mail_batch(transport) == 1
+        assert [mail.to_email for mail in transport.sent] == ["test2@test.com"]
+
+    def test_slow_batch_keeps_its_lease(self, reset_db, monkeypatch):
+        monkeypatch.setattr(message, "MAIL_LEASE_SECONDS", 1)
+        for i in range(2):
+            send_email("Subject", f"test{i}@test.com", "Test", "Body")
+
+        stolen = []
+
+        class SlowTransport(MailTransport):
+            def send(self, mail):
+                time.sleep(0.7)
+                # Another worker looking for due emails at the end of each send
+                stolen.extend(claim_mail_batch(10, message.MAIL_MAX_ATTEMPTS, message.datetime.now(message.timezone.utc)))
+
+        assert deliver_mail_batch(SlowTransport()) == 2
+        assert not stolen
+
+    def test_delivery_task_survives_errors(self, monkeypatch):
+        calls = []
+
+        def deliver_mail_batch_failing():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("unexpected failure")
+            if len(calls) == 3:
+                raise asyncio.CancelledError
+            return 0
+
+        monkeypatch.setenv("MAIL_POLL_SECONDS", "0")
+        monkeypatch.setattr(main, "deliver_mail_batch", deliver_mail_batch_failing)
+
+        # The first batch failing doesn't stop the worker from taking the next one
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main.mail_delivery_task())
+
+        assert len(calls) == 3
+
+    def test_transport_must_implement_send(self):
+        class IncompleteTransport(MailTransport): # pylint: disable=abstract-method
+            pass
+
+        with pytest.raises(TypeError):
+            IncompleteTransport()
+
+    def test_mailersend_timeout_is_retried(self, reset_db, monkeypatch):
+        timeouts = []
+
+        def hanging_post(*_, **kwargs):
+            timeouts.append(kwargs["timeout"])
+            raise requests.Timeout("read timed out")
+
+        monkeypatch.setattr(message.requests, "post", hanging_post)
+        monkeypatch.setattr(message, "MAIL_BACKOFF_SECONDS", 0)
+        send_email("Subject", "test@test.com", "Test", "Body")
+
+        # A send that times out is backed off like any failure and stays in the outbox
+        assert deliver_mail_batch(MailerSendTransport()) == 1
+        assert timeouts == [message.MAIL_SEND_TIMEOUT_SECONDS]
+        assert count_pending_mail(message.MAIL_MAX_ATTEMPTS) == 1
@@ -0,0 +1,57 @@
+import base64
+
+import pytest
+
+from functionality.errors import ValidationError
+from functionality.media import IMAGE_TYPES, MEDIA_BASE_URL, MENU_TYPES, media_path, media_url, store_media
+
+from testing.helpers import make_image_uri, make_pdf_uri
+from testing.test_helpers import view_media
+
+class TestMediaStore:
+    def test_same_upload_stored_once(self):
+        first = store_media(make_image_uri("dummy/2-rice.jpeg"), IMAGE_TYPES)
+        second = store_media(make_image_uri("dummy/2-rice.jpeg"), IMAGE_TYPES)
+
+        assert first == second
+        assert first.endswith(".jpeg")
+        assert media_path(first) is not None
+
+    def test_stored_urls_pass_through(self):
+        stored = store_media(make_pdf_uri("dummy/2-rice.pdf"), MENU_TYPES)
+
+        assert store_media(stored, MENU_TYPES) == stored
+        assert store_media("/eatery_thumbnail.webp", IMAGE_TYPES) == "/eatery_thumbnail.webp"
+
+        # URLs read back from a response are saved as the name they point at
+        assert media_url(stored) == f"{MEDIA_BASE_URL}/{stored}"
+        assert store_media(media_url(stored), MENU_TYPES) == stored
+        assert media_url("/eatery_thumbnail.webp") == "/eatery_thumbnail.webp"
+
+    def test_rejects_bad_uploads(self):
+        with pytest.raises(ValidationError):
+            store_media(make_pdf_uri("dummy/2-rice.pdf"), IMAGE_TYPES)
+
+        with pytest.raises(ValidationError):
+            store_media("data:image/png;base64,not base64!", IMAGE_TYPES)
+
+        with pytest.raises(ValidationError):
+            store_media("data:image/png,rawdata", IMAGE_TYPES)
+
+class TestMediaRouter:
+    def test_cached_by_etag(self):
+        stored = store_media("data:image/png;base64," + base64.b64encode(b"not really a png").decode(), IMAGE_TYPES)
+
+        response = view_media(stored)
+        assert response.status_code == 200
+        assert response.content == b"not really a png"
+        assert "immutable" in response.headers["cache-control"]
+
+        etag = response.headers["etag"]
+        response = view_media(stored, {"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+    def test_unknown_media(self):
+        assert view_media("/media/" + "0" * 64 + ".png").status_code == 404
+        assert view_media("/media/..%2Fmain.py").status_code == 404
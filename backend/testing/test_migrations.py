@@ -0,0 +1,160 @@
+import psycopg2
+import pytest
+
+from db.helpers import USER, PASSWORD, DB_PORT, connect, disconnect
+from db.linker import DatabaseSetup
+
+UPGRADE_DB_NAME = "dream_upgrade"
+
+# A database set up from schema.sql alone, as it would be before any migration ran
+BASELINE_DATA = """
+    INSERT INTO addresses (id, street_addr, city, state, county, country, postcode, longitude, latitude, formatted_str)
+    VALUES (1, 'Ulm Street', 'Sydney', 'NSW', 'Randwick', 'Australia', '2035', 151.23, -33.91, '9 Ulm Street');
+
+    INSERT INTO eateries (id, eatery_name) VALUES (1, 'Pizza Place');
+    INSERT INTO eatery_details (email, phone_number, manager, abn, date_joined, address, eatery, menu)
+    VALUES ('pizza@place.com', '0400000000', ROW('Smith', 'Jo'), '12345678901', NOW(), 1, 1,
+        'http://localhost:8080/media/' || repeat('ab', 32) || '.pdf');
+
+    INSERT INTO keywords (id, title) VALUES (1, 'pizza');
+    INSERT INTO eatery_atoms (keyword, eatery) VALUES (1, 1);
+
+    INSERT INTO voucher_templates (id, title, description, date_created, release_date, release_duration, eatery)
+    VALUES (1, 'Free slice', 'One slice', NOW(), NOW(), '7 days', 1);
+    INSERT INTO vouchers (id, voucher_template, release_date, expiry_date) VALUES (1, 1, NOW(), NOW() + INTERVAL '7 days');
+
+    INSERT INTO voucher_instances (id, status, voucher) VALUES
+        (1, 'unclaimed', 1), (2, 'unclaimed', 1), (3, 'claimed', 1), (4, 'redeemed', 1), (5, 'redeemed', 1);
+    INSERT INTO reviews (description, rating, date_created, voucher_instance, anonymous) VALUES
+        ('Great', 5, NOW(), 4, TRUE), ('Fine', 3, NOW(), 5, TRUE);
+"""
+
+@pytest.fixture
+def baseline_db():
+    """
+    A scratch database holding data written before the migrations existed
+    """
+    admin = psycopg2.connect(user=USER, password=PASSWORD, dbname="postgres", host="host.docker.internal", port=DB_PORT)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {UPGRADE_DB_NAME};")
+        cur.execute(f"CREATE DATABASE {UPGRADE_DB_NAME};")
+
+    conn = psycopg2.connect(user=USER, password=PASSWORD, dbname=UPGRADE_DB_NAME, host="host.docker.internal", port=DB_PORT)
+    try:
+        with conn.cursor() as cur:
+            with open("db/schema.sql", encoding="utf8") as file:
+                cur.execute(file.read())
+            cur.execute(BASELINE_DATA)
+        conn.commit()
+
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {UPGRADE_DB_NAME};")
+        admin.close()
+
+# Each hot lookup and the index expected to serve it
+ACCESS_PATHS = [
+    ("SELECT id FROM voucher_instances WHERE voucher = 1;", "voucher_instances_voucher_status_idx"),
+    ("SELECT id FROM voucher_instances WHERE voucher = 1 AND status = 'unclaimed';", "voucher_instances_voucher_status_idx"),
+    ("SELECT id FROM voucher_instances WHERE customer = 1;", "voucher_instances_customer_idx"),
+    ("SELECT id FROM vouchers WHERE voucher_template = 1;", "vouchers_voucher_template_release_idx"),
+    ("SELECT keyword FROM eatery_atoms WHERE eatery = 1;", "eatery_atoms_eatery_idx"),
+    ("SELECT id FROM reviews WHERE voucher_instance = 1;", "reviews_voucher_instance_idx"),
+    ("SELECT id FROM all_sessions WHERE eatery = 1;", "all_sessions_eatery_idx"),
+    ("SELECT id FROM all_sessions WHERE customer = 1;", "all_sessions_customer_idx"),
+    ("SELECT password FROM passwords WHERE eatery = 1 AND pass_type = 'current';", "passwords_eatery_idx"),
+    ("SELECT password FROM passwords WHERE customer = 1 AND pass_type = 'old' ORDER BY time_created DESC;",
+        "passwords_customer_idx"),
+]
+
+# Customers holding instances across many vouchers, so that no index leading on voucher looks as cheap as
+# one on customer once the planner has statistics
+PLANNER_DATA = """
+    INSERT INTO addresses (id, street_addr, city, state, county, country, postcode, longitude, latitude, formatted_str)
+    VALUES (1, 'Ulm Street', 'Sydney', 'NSW', 'Randwick', 'Australia', '2035', 151.23, -33.91, '9 Ulm Street');
+    INSERT INTO eateries (id, eatery_name) VALUES (1, 'Pizza Place');
+    INSERT INTO voucher_templates (id, title, description, date_created, release_date, release_duration, eatery)
+    VALUES (1, 'Free slice', 'One slice', NOW(), NOW(), '7 days', 1);
+
+    INSERT INTO customers (id, customer_name, email, phone_number, date_joined, address)
+    SELECT n, '(Smith,Jo)', 'customer' || n || '@mail.com', LPAD(n::TEXT, 10, '0'), NOW(), 1
+    FROM generate_series(1, 200) AS n;
+    INSERT INTO vouchers (id, voucher_template, release_date, expiry_date)
+    SELECT n, 1, NOW() + n * INTERVAL '1 day', NOW() + n * INTERVAL '1 day' + INTERVAL '7 days'
+    FROM generate_series(1, 50) AS n;
+    INSERT INTO voucher_instances (status, voucher, customer)
+    SELECT 'claimed', v, c FROM generate_series(1, 50) AS v, generate_series(1, 200) AS c;
+
+    ANALYZE voucher_instances;
+"""
+
+def explain(query):
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PLANNER_DATA)
+            # The remaining test tables are tiny, so stop the planner preferring a sequential scan over everything
+            cur.execute("SET LOCAL enable_seqscan = off;")
+            cur.execute("EXPLAIN " + query)
+            return "\n".join(row[0] for row in cur.fetchall())
+    finally:
+        conn.rollback()
+        disconnect(conn)
+
+class TestMigrations:
+    def test_migrations_applied_once(self):
+        db_setup = DatabaseSetup()
+        db_setup.migrate()
+
+        assert db_setup.migrate() == []
+        assert db_setup.applied_migrations() == [version for version, _, _ in db_setup.list_migrations()]
+
+    def test_history_survives_clearing_tables(self, reset_db):
+        db_setup = DatabaseSetup()
+        db_setup.migrate()
+
+        assert "schema_migrations" not in db_setup.list_tables()
+        assert db_setup.applied_migrations() != []
+
+    @pytest.mark.parametrize("query, index", ACCESS_PATHS)
+    def test_lookup_uses_index(self, reset_db, query, index):
+        DatabaseSetup().migrate()
+
+        assert index in explain(query)
+
+class TestUpgrade:
+    def test_migrations_backfill_existing_data(self, baseline_db):
+        with baseline_db.cursor() as cur:
+            for _, _, path in DatabaseSetup().list_migrations():
+                with open(path, encoding="utf8") as file:
+                    cur.execute(file.read())
+            baseline_db.commit()
+
+            cur.execute("SELECT review_count, rating_total FROM eatery_ratings WHERE eatery = 1;")
+            assert cur.fetchone() == (2, 8)
+            cur.execute("SELECT review_count, rating_total FROM voucher_template_ratings WHERE voucher_template = 1;")
+            assert cur.fetchone() == (2, 8)
+
+            cur.execute("SELECT SUM(total), SUM(unclaimed), SUM(claimed), SUM(redeemed), SUM(reserved) FROM voucher_counts WHERE voucher = 1;")
+            assert cur.fetchone() == (5, 2, 1, 2, 0)
+
+            cur.execute("SELECT source, term FROM eatery_search_terms WHERE eatery = 1 ORDER BY source, term;")
+            assert cur.fetchall() == [
+                ("keyword", "pizza"), ("name", "pizza"), ("name", "pizzaplace"), ("name", "place"),
+                ("postcode", "2035"), ("title", "pizza place")
+            ]
+
+            cur.execute("SELECT active_vouchers, review_count, keyword_ids FROM eatery_features WHERE eatery = 1;")
+            assert cur.fetchone() == (1, 2, [1])
+
+            cur.execute("SELECT thumbnail, menu FROM eatery_details WHERE eatery = 1;")
+            assert cur.fetchone() == ("/eatery_thumbnail.webp", "ab" * 32 + ".pdf")
+
+            # The counters keep following instances written after the upgrade
+            cur.execute("UPDATE voucher_instances SET status = 'claimed' WHERE id = 1;")
+            cur.execute("SELECT SUM(unclaimed), SUM(claimed) FROM voucher_counts WHERE voucher = 1;")
+            assert cur.fetchone() == (1, 2)
+        baseline_db.rollback()
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import time
+import pytest
+
+import db.helpers
+from functionality.errors import ServiceUnavailableError
+from functionality.password_hashing import PasswordHasher, password_hasher
+
+from testing.test_helpers import login_customer, register_customer
+
+with open("testing/test_data.json", encoding="utf8") as file:
+    test_data = json.load(file)
+
+class TestPasswordHasher:
+    def test_hash_then_verify(self):
+        hasher = PasswordHasher(workers=2, queue_limit=4)
+
+        hashed = asyncio.run(hasher.hash("Password123!"))
+        assert hashed != "Password123!"
+        assert asyncio.run(hasher.verify("Password123!", hashed))
+        assert not asyncio.run(hasher.verify("Password124!", hashed))
+        assert hasher.queue_depth() == 0
+
+        hasher.shutdown()
+
+    def test_verify_any(self):
+        hasher = PasswordHasher(workers=2, queue_limit=4)
+        hashed = [asyncio.run(hasher.hash(f"Password{i}!")) for i in range(3)]
+
+        assert asyncio.run(hasher.verify_any("Password2!", hashed))
+        assert not asyncio.run(hasher.verify_any("Password3!", hashed))
+        assert not asyncio.run(hasher.verify_any("Password2!", []))
+
+        hasher.shutdown()
+
+    def test_rejects_when_queue_full(self):
+        hasher = PasswordHasher(workers=1, queue_limit=1)
+        hashed = asyncio.run(hasher.hash("Password123!"))
+
+        # Hold the only queue slot while another hash is attempted
+        pending = hasher.submit(time.sleep, 1)
+        with pytest.raises(ServiceUnavailableError):
+            asyncio.run(hasher.verify("Password123!", hashed))
+
+        pending.result()
+        assert hasher.queue_depth() == 0
+        assert asyncio.run(hasher.verify("Password123!", hashed))
+
+        hasher.shutdown()
+
+    def test_waits_without_a_database_thread(self, reset_db, monkeypatch):
+        borrowed = []
+
+        def recording(method):
+            async def wrapper(*args):
+                # Nothing should be running on run_blocking's threads while the request waits on a hash
+                borrowed.append(db.helpers._blocking_limiter.borrowed_tokens) # pylint: disable=protected-access
+                return await method(*args)
+            return wrapper
+
+        monkeypatch.setattr(password_hasher, "hash", recording(password_hasher.hash))
+        monkeypatch.setattr(password_hasher, "verify", recording(password_hasher.verify))
+
+        register_customer(test_data["register_data"]["customer"]["1"])
+        login_customer(test_data["login_data"]["customer"]["1"])
+
+        assert borrowed == [0, 0]
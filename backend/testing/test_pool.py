@@ -0,0 +1,58 @@
+import pytest
+
+from testing import client
+
+from db.helpers import USER, PASSWORD, DB_NAME, DB_PORT, connection_pool
+from db.pool import ConnectionPool, PoolTimeoutError
+
+def make_pool(maxconn=1, timeout=0.1, validate_after=30.0):
+    return ConnectionPool(
+        minconn=1,
+        maxconn=maxconn,
+        timeout=timeout,
+        max_idle=300.0,
+        validate_after=validate_after,
+        user=USER,
+        password=PASSWORD,
+        database=DB_NAME,
+        host="host.docker.internal",
+        port=DB_PORT
+    )
+
+class TestConnectionPool:
+    def test_times_out_when_exhausted(self):
+        pool = make_pool()
+        conn = pool.getconn()
+        assert pool.stats() == {"in_use": 1, "idle": 0, "max": 1}
+
+        with pytest.raises(PoolTimeoutError):
+            pool.getconn()
+
+        pool.putconn(conn)
+        assert pool.stats() == {"in_use": 0, "idle": 1, "max": 1}
+        pool.closeall()
+
+    def test_recycles_closed_connection(self):
+        pool = make_pool(validate_after=0.0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+        # The server side went away while the connection sat idle
+        conn.close()
+
+        replacement = pool.getconn()
+        assert replacement is not conn
+        assert not replacement.closed
+        pool.putconn(replacement)
+        pool.closeall()
+
+    def test_metrics_served_when_exhausted(self, monkeypatch):
+        def exhausted():
+            raise PoolTimeoutError("Database connection pool exhausted")
+
+        monkeypatch.setattr(connection_pool, "getconn", exhausted)
+
+        # The pool metrics matter most when no connection is free, so reading them must not need one
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert {"db_pool_in_use", "db_pool_idle", "db_pool_wait_seconds"} <= set(response.json())
@@ -0,0 +1,20 @@
+import random
+import numpy as np
+from geopy.distance import geodesic
+
+from functionality.recommendations import distances_from, round_dist, round_dists
+
+class TestDistances:
+    def test_round_dists_matches_round_dist(self):
+        meters = np.array([0, 1, 99.5, 100, 999, 1000, 1001, 29999, 30000, 99999.9, 100000, 999999, 1000000, 4321000], dtype=np.float64)
+        assert list(round_dists(meters)) == [round_dist(m) for m in meters]
+
+    def test_haversine_close_to_geodesic(self):
+        rng = random.Random(0)
+        origin = (-33.9116, 151.2234)
+        coords = np.array([(origin[0] + rng.uniform(-0.1, 0.1), origin[1] + rng.uniform(-0.1, 0.1)) for _ in range(100)])
+
+        for coord, dist in zip(coords, distances_from(origin, coords)):
+            # Both are rounded up to the nearest 100 m / 1 km, the sphere is within half a percent of the ellipsoid
+            exact = geodesic(origin, tuple(coord)).meters
+            assert round_dist(exact * 0.995) <= dist <= round_dist(exact * 1.005)
@@ -0,0 +1,86 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import functionality.voucher_scheduler as scheduler_module
+from db.db_types.db_response import VoucherTemplateScheduleDetailsResponse
+from functionality.recurrence import next_occurrence, occurrence
+from functionality.voucher_scheduler import VoucherScheduler
+
+SCHEDULES = ["daily", "weekly", "fortnightly", "monthly"]
+
+def step_to_next(release_schedule, release_date, after):
+    # The original scheduler, stepping one release at a time
+    index = 0
+    while occurrence(release_schedule, release_date, index) <= after:
+        index += 1
+
+    return occurrence(release_schedule, release_date, index)
+
+def random_datetime(rng, tz):
+    start = datetime(2015, 1, 1, tzinfo=tz)
+    return start + timedelta(seconds=rng.randrange(0, 6 * 365 * 24 * 3600))
+
+class TestRecurrence:
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_stepping(self, seed):
+        rng = random.Random(seed)
+
+        for _ in range(400):
+            tz = timezone(timedelta(hours=rng.choice([-5, 0, 10])))
+            release_schedule = rng.choice(SCHEDULES)
+            release_date = random_datetime(rng, tz)
+            after = release_date + timedelta(seconds=rng.randrange(0, 3 * 365 * 24 * 3600))
+
+            # Land exactly on a release sometimes, which must not be released twice
+            if rng.random() < 0.2:
+                after = occurrence(release_schedule, release_date, rng.randrange(0, 30))
+
+            expected = step_to_next(release_schedule, release_date, after)
+            assert next_occurrence(release_schedule, release_date, after.astimezone(timezone.utc)) == expected
+
+    def test_monthly_clamps_to_month_end(self):
+        release_date = datetime(2024, 1, 31, 9, 30, tzinfo=timezone.utc)
+
+        assert next_occurrence("monthly", release_date, release_date) == datetime(2024, 2, 29, 9, 30, tzinfo=timezone.utc)
+        assert next_occurrence("monthly", release_date, datetime(2024, 3, 1, tzinfo=timezone.utc)) == \
+            datetime(2024, 3, 31, 9, 30, tzinfo=timezone.utc)
+        assert next_occurrence("monthly", release_date, datetime(2024, 12, 31, 10, tzinfo=timezone.utc)) == \
+            datetime(2025, 1, 31, 9, 30, tzinfo=timezone.utc)
+
+    def test_unreleased_and_one_off(self):
+        release_date = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+        assert next_occurrence("daily", release_date, None) == release_date
+        assert next_occurrence(None, release_date, None) == release_date
+        assert next_occurrence(None, release_date, release_date + timedelta(hours=1)) is None
+
+    def test_initialise_large_queue(self, monkeypatch):
+        # Daily templates released years ago would have taken thousands of steps each
+        now = datetime.now(timezone.utc)
+        schedules = {
+            voucher_template_id: VoucherTemplateScheduleDetailsResponse(
+                is_deleted=False,
+                release_date=now - timedelta(days=3650, minutes=voucher_template_id % 1440),
+                release_schedule=SCHEDULES[voucher_template_id % len(SCHEDULES)],
+                release_duration=timedelta(days=1),
+                release_size=1,
+                last_release=now - timedelta(hours=1)
+            ) for voucher_template_id in range(100_000)
+        }
+        monkeypatch.setattr(scheduler_module, "get_all_voucher_template_schedules", lambda: schedules)
+
+        scheduler = VoucherScheduler()
+        start = time.monotonic()
+        scheduler.reset_scheduler()
+        elapsed = time.monotonic() - start
+
+        assert len(scheduler.queue) == 100_000
+        assert min(scheduler.queue)[0] > now - timedelta(hours=1)
+        assert elapsed < 1
+
+        # Put the scheduler back to the real templates
+        monkeypatch.undo()
+        scheduler.reset_scheduler()
@@ -1,11 +1,21 @@
 import json
+import re
+from types import SimpleNamespace
+import anyio
 
-from testing.test_helpers import register_eatery, search, update_eatery_details
+from functionality import search as search_module
+from functionality.score_cache import KeywordScoreCache
+from functionality.embedding_search import EmbeddingIndex, invalidate_embedding_index
+from db.db_types.db_response import EaterySearchDocumentResponse
+from functionality.search import score_cache, score_prompt_word_against_keywords
+from testing.test_helpers import list_eateries, register_eatery, search, update_eatery_details
+from testing.helpers import create_voucher_payload, eatery_create_voucher
 
 with open("testing/test_data.json", encoding="utf8") as file:
     test_data = json.load(file)
 
 register_data = test_data["register_data"]
+voucher_data = test_data["voucher_data"]
 
 class TestSearch:
     def test_dumb_search(self, reset_db):
@@ -39,3 +49,195 @@ class TestSearch:
 
         assert eateries[0]["eatery_id"] == eid1
         assert eateries[0]["eatery_name"] == eatery1_data["business_name"]
+
+    def test_dumb_search_matches_homepage_cards(self, reset_db):
+        """
+        Search results show the same vouchers and rating as the eatery's homepage card
+        """
+        _, access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + access_token}
+
+        res = update_eatery_details(eatery_id, eatery_header, {"keywords": ["mexican"]})
+        assert res.status_code == 200
+
+        for key in range(1, 5):
+            _, voucher_create_payload = create_voucher_payload(voucher_data[str(key)], eatery_id, quantity=1).values()
+            eatery_create_voucher(eatery_header, voucher_create_payload)
+
+        res = search("mexican")
+        assert res.status_code == 200
+
+        eateries = res.json()["eateries"]
+        assert len(eateries) == 1
+        assert eateries[0]["num_vouchers"] == 4
+        assert len(eateries[0]["top_three_vouchers"]) == 3
+        assert eateries[0] == list_eateries()[0]
+
+    def test_dumb_search_whitespace_query(self, reset_db):
+        """
+        A query of only whitespace matches nothing rather than every eatery name
+        """
+        register_eatery(register_data["eatery"]["1"])
+        register_eatery(register_data["eatery"]["2"])
+
+        res = search("   ")
+        assert res.status_code == 200
+        assert res.json()["eateries"] == []
+
+    def test_dumb_search_index_follows_updates(self, reset_db):
+        """
+        Uses a dumb search after changing the keywords and name of an eatery
+        """
+        eatery1_data = register_data["eatery"]["1"]
+        _, access_token_1, eid1 = register_eatery(eatery1_data).values()
+        headers = {"Authorization": "bearer " + access_token_1}
+
+        eatery2_data = register_data["eatery"]["2"]
+        _, _, eid2 = register_eatery(eatery2_data).values()
+
+        # Name tokens match by prefix and postcodes match exactly
+        res = search("charg")
+        assert [eatery["eatery_id"] for eatery in res.json()["eateries"]] == [eid1]
+
+        res = search(eatery2_data["address"]["postcode"])
+        assert [eatery["eatery_id"] for eatery in res.json()["eateries"]] == [eid2]
+
+        # Replacing the keywords drops the old ones from the index
+        res = update_eatery_details(eid1, headers, {"keywords": ["mexican"]})
+        assert res.status_code == 200
+        res = update_eatery_details(eid1, headers, {"keywords": ["burger"]})
+        assert res.status_code == 200
+
+        assert not search("mexican").json()["eateries"]
+        assert [eatery["eatery_id"] for eatery in search("BURGER").json()["eateries"]] == [eid1]
+
+        # Renaming the eatery reindexes its name
+        res = update_eatery_details(eid1, headers, {"name": "Taco Town"})
+        assert res.status_code == 200
+
+        assert not search("charg").json()["eateries"]
+        assert [eatery["eatery_id"] for eatery in search("taco town").json()["eateries"]] == [eid1]
+
+class TestKeywordScoreCache:
+    def test_scores_survive_restart(self, reset_db):
+        async def run():
+            await KeywordScoreCache("model-a", ttl=60, max_size=10).put_many("Taco", {"Mexican": 90, "burger": 5})
+
+            # A fresh process only has the database to go on
+            scores = await KeywordScoreCache("model-a", ttl=60, max_size=10).get_many("taco", ["mexican", "BURGER", "sushi"])
+            assert scores == {"mexican": 90, "BURGER": 5}
+
+            # Scores are versioned by model and expire after the TTL
+            assert not await KeywordScoreCache("model-b", ttl=60, max_size=10).get_many("taco", ["mexican"])
+            assert not await KeywordScoreCache("model-a", ttl=0, max_size=10).get_many("taco", ["mexican"])
+
+        anyio.run(run)
+
+    def test_lru_evicts_oldest(self, reset_db):
+        async def run():
+            cache = KeywordScoreCache("model-a", ttl=60, max_size=2)
+            await cache.put_many("taco", {"mexican": 90, "burger": 5, "nachos": 95})
+            assert len(cache.entries) == 2
+            assert ("model-a", "mexican", "taco") not in cache.entries
+
+        anyio.run(run)
+
+    def test_warm_query_makes_no_gpt_calls(self, reset_db):
+        async def run():
+            await score_cache.put_many("taco", {"mexican": 90, "burger": 5})
+
+            # The test client has no API key so any ChatGPT call would fail
+            assert await score_prompt_word_against_keywords("taco", ["mexican", "burger"]) == {"mexican": 90, "burger": 5}
+
+        anyio.run(run)
+
+class StandInCompletions:
+    """
+    Local stand-in for the chat completion endpoint, scores every keyword 42 and counts requests
+    """
+    def __init__(self, malformed_replies=0):
+        self.requests = 0
+        self.malformed_replies = malformed_replies
+
+    async def create(self, messages, model):
+        self.requests += 1
+        content = messages[-1]["content"]
+
+        if self.malformed_replies > 0:
+            self.malformed_replies -= 1
+            reply = "Sorry, I can't help with that"
+        elif "keywords=" in content:
+            keywords = json.loads(re.search(r"keywords=(.*)$", content).group(1))
+            reply = json.dumps({keyword: 42 for keyword in keywords})
+        else:
+            reply = "42"
+
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+class TestBatchedScoring:
+    def test_batches_keywords_per_prompt_word(self, reset_db, monkeypatch):
+        completions = StandInCompletions()
+        monkeypatch.setattr(search_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(search_module, "SMART_SEARCH_BATCH_SIZE", 50)
+
+        keywords = [f"keyword{i}" for i in range(120)]
+        scores = anyio.run(score_prompt_word_against_keywords, "taco", keywords)
+
+        assert scores == {keyword: 42 for keyword in keywords}
+        assert completions.requests == 3
+
+    def test_per_keyword_mode(self, reset_db, monkeypatch):
+        completions = StandInCompletions()
+        monkeypatch.setattr(search_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(search_module, "SMART_SEARCH_BATCH_SIZE", 1)
+
+        keywords = [f"keyword{i}" for i in range(120)]
+        scores = anyio.run(score_prompt_word_against_keywords, "burrito", keywords)
+
+        assert scores == {keyword: 42 for keyword in keywords}
+        assert completions.requests == 120
+
+    def test_malformed_chunk_retries_then_falls_back(self, reset_db, monkeypatch):
+        completions = StandInCompletions(malformed_replies=2)
+        monkeypatch.setattr(search_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(search_module, "SMART_SEARCH_BATCH_SIZE", 50)
+        monkeypatch.setattr(search_module, "SMART_SEARCH_BATCH_RETRIES", 1)
+
+        keywords = ["mexican", "burger", "2000"]
+        scores = anyio.run(score_prompt_word_against_keywords, "nachos", keywords)
+
+        # Two malformed batch replies, then one request per keyword
+        assert scores == {keyword: 42 for keyword in keywords}
+        assert completions.requests == 5
+
+class TestEmbeddingSearch:
+    def test_ranks_by_best_term(self):
+        index = EmbeddingIndex({
+            1: EaterySearchDocumentResponse(business_name="Taco Town", description="", postcode="2000", keywords=["mexican"]),
+            2: EaterySearchDocumentResponse(business_name="Bun Bar", description="", postcode="2150", keywords=["burgers", "fries"]),
+            3: EaterySearchDocumentResponse(business_name="Sushi Stop", description="", postcode="2033", keywords=["japanese"])
+        })
+
+        assert index.search(["mexican"]) == [(1, 100)]
+        assert [eid for eid, _ in index.search(["burger"])] == [2]
+        assert [eid for eid, _ in index.search(["2001"])] == [1]
+        assert not index.search(["pasta"])
+
+    def test_embedding_search_mode(self, reset_db, monkeypatch):
+        eatery1_data = register_data["eatery"]["1"]
+        _, access_token_1, eid1 = register_eatery(eatery1_data).values()
+
+        eatery2_data = register_data["eatery"]["2"]
+        _, access_token_2, eid2 = register_eatery(eatery2_data).values()
+
+        res = update_eatery_details(eid1, {"Authorization": "bearer " + access_token_1}, {"keywords": ["mexican"]})
+        assert res.status_code == 200
+        res = update_eatery_details(eid2, {"Authorization": "bearer " + access_token_2}, {"keywords": ["burgers"]})
+        assert res.status_code == 200
+
+        monkeypatch.setenv("SMART_SEARCH", "embedding")
+        invalidate_embedding_index()
+
+        res = search("burger")
+        assert res.status_code == 200
+        assert [eatery["eatery_id"] for eatery in res.json()["eateries"]] == [eid2]
@@ -0,0 +1,101 @@
+import io
+import json
+
+from PIL import Image
+
+from functionality.media import MEDIA_BASE_URL
+from functionality.thumbnails import CARD_SIZE, DETAIL_SIZE, render_pending_thumbnails
+
+from db.helpers.eatery import get_eatery_by_id
+
+from testing.helpers import make_image_uri
+from testing.test_helpers import list_eateries, register_eatery, update_eatery_thumbnail, view_eatery_public_details, view_media, \
+    view_eatery_private_details, update_eatery_details
+
+# Load data from JSON file
+with open("testing/test_data.json", encoding="utf8") as file:
+    test_data = json.load(file)
+
+# Fetching test_data
+register_data = test_data["register_data"]
+
+def upload_thumbnail(image_path):
+    _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+    eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+    assert update_eatery_thumbnail(eatery_id, eatery_header, {"thumbnail_uri": make_image_uri(image_path)}).status_code == 200
+    return eatery_id, eatery_header
+
+def view_image(uri):
+    response = view_media(uri)
+    assert response.status_code == 200
+    return response, Image.open(io.BytesIO(response.content))
+
+class TestThumbnailRenditions:
+    def test_renditions_replace_original(self, reset_db):
+        eatery_id, _ = upload_thumbnail("dummy/1-drink.jpeg")
+
+        # The original is shown until the worker has run
+        original = list_eateries()[0]["thumbnail_uri"]
+        assert view_eatery_public_details(eatery_id).json()["thumbnail_uri"] == original
+
+        assert render_pending_thumbnails() == 1
+        assert render_pending_thumbnails() == 0
+
+        card_uri = list_eateries()[0]["thumbnail_uri"]
+        detail_uri = view_eatery_public_details(eatery_id).json()["thumbnail_uri"]
+        assert original not in (card_uri, detail_uri)
+
+        # Only the names are saved, the URLs are built from MEDIA_BASE_URL when responding
+        eatery = get_eatery_by_id(eatery_id)
+        assert [f"{MEDIA_BASE_URL}/{name}" for name in (eatery.thumbnail, eatery.thumbnail_card, eatery.thumbnail_detail)] == \
+            [original, card_uri, detail_uri]
+
+        original_response, _ = view_image(original)
+        card_response, card = view_image(card_uri)
+        detail_response, detail = view_image(detail_uri)
+
+        assert card_response.headers["content-type"] == "image/webp"
+        assert card.width <= CARD_SIZE[0] and card.height <= CARD_SIZE[1]
+        assert detail.width <= DETAIL_SIZE[0] and detail.height <= DETAIL_SIZE[1]
+
+        # The card is a small fraction of the full size upload
+        assert len(card_response.content) * 10 < len(original_response.content)
+        assert len(detail_response.content) < len(original_response.content)
+
+    def test_new_thumbnail_drops_old_renditions(self, reset_db):
+        eatery_id, eatery_header = upload_thumbnail("dummy/1-drink.jpeg")
+        render_pending_thumbnails()
+
+        assert update_eatery_thumbnail(eatery_id, eatery_header, {"thumbnail_uri": make_image_uri("dummy/2-rice.jpeg")}).status_code == 200
+
+        original = list_eateries()[0]["thumbnail_uri"]
+        _, image = view_image(original)
+        assert image.format == "JPEG"
+
+        render_pending_thumbnails()
+        _, card = view_image(list_eateries()[0]["thumbnail_uri"])
+        assert card.format == "WEBP"
+
+    def test_details_round_trip_keeps_original(self, reset_db):
+        eatery_id, eatery_header = upload_thumbnail("dummy/1-drink.jpeg")
+        render_pending_thumbnails()
+
+        original = view_eatery_private_details(eatery_id, eatery_header).json()["thumbnail_uri"]
+        detail_uri = view_eatery_public_details(eatery_id).json()["thumbnail_uri"]
+        assert original != detail_uri
+
+        # Sending back either thumbnail that was read leaves the upload and its renditions as they are
+        for thumbnail_uri in [original, detail_uri]:
+            payload = {"description": "New description", "thumbnail_uri": thumbnail_uri}
+            assert update_eatery_details(eatery_id, eatery_header, payload).status_code == 200
+
+            assert view_eatery_private_details(eatery_id, eatery_header).json()["thumbnail_uri"] == original
+            assert view_eatery_public_details(eatery_id).json()["thumbnail_uri"] == detail_uri
+            assert render_pending_thumbnails() == 0
+
+    def test_default_thumbnail_not_rendered(self, reset_db):
+        register_eatery(register_data["eatery"]["1"])
+
+        assert render_pending_thumbnails() == 0
+        assert list_eateries()[0]["thumbnail_uri"] == "/eatery_thumbnail.webp"
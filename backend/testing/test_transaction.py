@@ -0,0 +1,110 @@
+import threading
+import anyio
+import pytest
+from psycopg2 import IntegrityError
+
+from testing import client
+
+from db.helpers import connect, connection_pool, disconnect, on_commit, run_blocking, savepoint, transaction
+from db.pool import PoolTimeoutError
+
+def add_keyword(title):
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO keywords (title) VALUES (%(title)s);", {"title": title})
+        conn.commit()
+    except IntegrityError as e:
+        conn.rollback()
+        raise e
+    finally:
+        disconnect(conn)
+
+def list_keywords():
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT title FROM keywords ORDER BY title;")
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        disconnect(conn)
+
+class TestUnitOfWork:
+    def test_helpers_share_one_connection(self, reset_db):
+        with transaction():
+            first = connect()
+            second = connect()
+            assert first is second
+            disconnect(second)
+            disconnect(first)
+
+    def test_commits_once_at_end(self, reset_db):
+        with transaction():
+            add_keyword("pizza")
+            add_keyword("pasta")
+
+        assert list_keywords() == ["pasta", "pizza"]
+
+    def test_rolls_back_everything_on_error(self, reset_db):
+        with pytest.raises(ValueError):
+            with transaction():
+                add_keyword("pizza")
+                raise ValueError("request failed")
+
+        assert not list_keywords()
+
+    def test_savepoint_recovers_from_failed_helper(self, reset_db):
+        with transaction():
+            add_keyword("pizza")
+
+            # A duplicate title fails but should not abort the rest of the unit of work
+            with pytest.raises(IntegrityError):
+                with savepoint():
+                    add_keyword("pizza")
+
+            add_keyword("pasta")
+
+        assert list_keywords() == ["pasta", "pizza"]
+
+    def test_on_commit_waits_for_commit(self, reset_db):
+        calls = []
+        with transaction():
+            on_commit(lambda: calls.append(list_keywords()))
+            add_keyword("pizza")
+            assert not calls
+
+        # The callback sees the committed state, using a connection of its own that it gives back
+        assert calls == [["pizza"]]
+        assert connection_pool.stats()["in_use"] == 0
+
+        with pytest.raises(ValueError):
+            with transaction():
+                on_commit(lambda: calls.append("rolled back"))
+                raise ValueError("request failed")
+
+        assert calls == [["pizza"]]
+
+    def test_run_blocking_joins_unit_of_work(self, reset_db):
+        async def add_keyword_off_loop():
+            # The helper runs on a worker thread but still belongs to the caller's unit of work
+            thread_id = await run_blocking(threading.get_ident)
+            assert thread_id != threading.get_ident()
+            await run_blocking(add_keyword, "pizza")
+
+        with pytest.raises(ValueError):
+            with transaction():
+                anyio.run(add_keyword_off_loop)
+                raise ValueError("request failed")
+
+        assert not list_keywords()
+
+    def test_routes_without_database_skip_the_pool(self, reset_db, monkeypatch):
+        def exhausted():
+            raise PoolTimeoutError("Database connection pool exhausted")
+
+        monkeypatch.setattr(connection_pool, "getconn", exhausted)
+
+        # Only routers that use the database wait on the pool
+        assert client.get("/").status_code == 200
+        assert client.get("/other/autocomplete_address", params={"query": "Ulm"}).status_code == 200
+        assert client.post("/auth/login/customer", json={"email": "a@b.com", "password": "pass"}).status_code == 503
@@ -1,8 +1,18 @@
 import json
-from datetime import timedelta
+import threading
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from db.db_types.db_request import AddressCreationRequest, CustomerCreationRequest
+from db.db_types.db_response import VoucherCountsResponse
+from db.helpers import connect, disconnect, transaction
+from db.helpers.customer import insert_customer
+from db.helpers.voucher import get_voucher_counts_by_ids
+from db.helpers.voucher_instance import claim_voucher_instance
 
 from testing.test_helpers import register_customer, register_eatery, accept_redemption_code, claim_voucher, \
-    create_voucher, get_redemption_code_details, redeem_voucher_instance, reject_redemption_code, view_customer_vouchers
+    create_voucher, get_redemption_code_details, redeem_voucher_instance, reject_redemption_code, view_customer_vouchers, \
+    view_voucher
 
 from testing.helpers import eatery_create_voucher, customer_claim_voucher, customer_redeem_voucher_instance, \
     compare_expiry_in_response, create_voucher_payload
@@ -26,6 +36,20 @@ class TestVoucherFlow:
         _, voucher_create_payload = create_voucher_payload(voucher_data["1"], eatery_id).values()
         eatery_create_voucher(eatery_header, voucher_create_payload)
 
+    def test_large_voucher_release(self, reset_db):
+        # Create an eatery
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        # Create a voucher with a large batch of instances
+        _, voucher_create_payload = create_voucher_payload(voucher_data["1"], eatery_id, 100).values()
+        voucher_id = eatery_create_voucher(eatery_header, voucher_create_payload)
+
+        # Every instance is released unclaimed
+        details = view_voucher(voucher_id).json()
+        assert details["total_quantity"] == 100
+        assert details["unclaimed_quantity"] == 100
+
     def test_fail_voucher_creation_0_quantity(self, reset_db):
         # Create an eatery
         _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
@@ -547,3 +571,91 @@ class TestVoucherFlowWithCustomerRoutes:
         assert voucher2["description"] == voucher_data["2"]["description"]
         assert voucher2["conditions"] == voucher_data["2"]["conditions"]
         compare_expiry_in_response(voucher2["expiry"], release2 + timedelta(days=30))
+
+def insert_test_customers(count):
+    """
+    Inserts customers straight into the database, skipping registration
+    """
+    address = AddressCreationRequest(
+        unit_number="", house_number="1", street_addr="Test Street", city="Sydney", state="NSW", county="Sydney",
+        country="Australia", postcode="2000", longitude=151.2, latitude=-33.8, formatted_str="1 Test Street"
+    )
+
+    return [insert_customer(CustomerCreationRequest(
+        first_name="Test", last_name=str(i), email=f"claimer{i}@test.com", phone=f"04000000{i:02}", password="hash",
+        address=address, date_joined=datetime.now(timezone.utc)
+    )) for i in range(count)]
+
+class TestConcurrentClaims:
+    @pytest.mark.parametrize("claimers, instances", [(8, 5), (3, 5)])
+    def test_parallel_claims(self, reset_db, claimers, instances):
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        _, voucher_create_payload = create_voucher_payload(voucher_data["1"], eatery_id, instances).values()
+        voucher_id = eatery_create_voucher(eatery_header, voucher_create_payload)
+
+        customer_ids = insert_test_customers(claimers)
+
+        # Every claimer fires at the same moment, each in its own transaction
+        barrier = threading.Barrier(claimers)
+        claimed = {}
+
+        def claim(customer_id):
+            barrier.wait()
+            with transaction():
+                claimed[customer_id] = claim_voucher_instance(voucher_id, customer_id)
+
+        threads = [threading.Thread(target=claim, args=(customer_id,)) for customer_id in customer_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Exactly min(claimers, instances) succeed and nobody shares an instance
+        instance_ids = [instance_id for instance_id in claimed.values() if instance_id is not None]
+        assert len(claimed) == claimers
+        assert len(instance_ids) == min(claimers, instances)
+        assert len(set(instance_ids)) == len(instance_ids)
+
+        details = view_voucher(voucher_id).json()
+        assert details["unclaimed_quantity"] == instances - len(instance_ids)
+
+class TestVoucherCounts:
+    def test_counts_follow_instance_status(self, reset_db):
+        _, eatery_access_token, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        eatery_header = {"Authorization": "bearer " + eatery_access_token}
+
+        _, voucher_create_payload = create_voucher_payload(voucher_data["1"], eatery_id, 20).values()
+        voucher_id = eatery_create_voucher(eatery_header, voucher_create_payload)
+
+        customer_ids = insert_test_customers(3)
+        with transaction():
+            for customer_id in customer_ids:
+                claim_voucher_instance(voucher_id, customer_id)
+
+        # Redeem one of the claimed instances
+        _, customer_access_token, customer_id = register_customer(register_data["customer"]["1"]).values()
+        customer_header = {"Authorization": "bearer " + customer_access_token}
+        voucher_instance_id = customer_claim_voucher(customer_id, voucher_id, customer_header)
+        redemption_code = customer_redeem_voucher_instance(voucher_instance_id, customer_header)
+        assert accept_redemption_code(redemption_code, eatery_header).status_code == 200
+
+        # Reserve one of the unclaimed instances, it no longer counts as claimable
+        conn = connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE voucher_instances SET status = 'reserved'
+                    WHERE id = (SELECT id FROM voucher_instances WHERE voucher = %(voucher)s AND status = 'unclaimed' LIMIT 1);
+                """, {"voucher": voucher_id})
+            conn.commit()
+        finally:
+            disconnect(conn)
+
+        counts = get_voucher_counts_by_ids([voucher_id, voucher_id + 1000])
+        assert counts[voucher_id] == VoucherCountsResponse(total=20, unclaimed=15, claimed=3, redeemed=1, reserved=1)
+        assert counts[voucher_id + 1000] == VoucherCountsResponse(total=0, unclaimed=0, claimed=0, redeemed=0, reserved=0)
+
+        assert view_voucher(voucher_id).json()["unclaimed_quantity"] == 15
@@ -0,0 +1,139 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from db.db_types.db_request import VoucherTemplateCreationRequest
+from db.helpers import connect, connection_pool, disconnect
+from db.helpers.voucher import get_vouchers_by_voucher_template, get_voucher_counts_by_ids
+from db.helpers.voucher_template import SCHEDULER_CHANNEL, get_voucher_template_schedules_by_ids, insert_voucher_template, \
+    notify_voucher_template_scheduled
+from db.lease import AdvisoryLease
+from functionality.voucher_scheduler import VoucherScheduler
+
+from testing.test_helpers import register_eatery
+
+# Load data from JSON file
+with open("testing/test_data.json", encoding="utf8") as file:
+    test_data = json.load(file)
+
+# Fetching test_data
+register_data = test_data["register_data"]
+
+# Kept apart from the real scheduler lease so a running scheduler doesn't get in the way
+TEST_LOCK = 0x74657374
+
+def make_lease():
+    return AdvisoryLease(TEST_LOCK, SCHEDULER_CHANNEL, **connection_pool.kwargs)
+
+def terminate_lease_holder():
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_terminate_backend(pid) FROM pg_locks WHERE locktype = 'advisory' AND objid = %(key)s;",
+                        {"key": TEST_LOCK})
+    finally:
+        conn.rollback()
+        disconnect(conn)
+
+def insert_template(eatery_id, release_date, release_size=5):
+    return insert_voucher_template(VoucherTemplateCreationRequest(
+        name="Scheduled",
+        description="Scheduled voucher",
+        conditions="None",
+        created=datetime.now(timezone.utc),
+        release_date=release_date,
+        release_schedule="weekly",
+        duration=timedelta(days=7),
+        release_size=release_size,
+        eatery=eatery_id
+    ))
+
+class TestVoucherScheduler:
+    def test_due_templates_released_together(self, reset_db):
+        *_, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        now = datetime.now(timezone.utc)
+        template_ids = [insert_template(eatery_id, now - timedelta(minutes=i), release_size=i + 1) for i in range(3)]
+
+        scheduler = VoucherScheduler()
+        scheduler.reset_scheduler()
+        scheduler.trigger_voucher_creation()
+
+        for i, template_id in enumerate(template_ids):
+            voucher_ids = get_vouchers_by_voucher_template(template_id)
+            assert len(voucher_ids) == 1
+            assert get_voucher_counts_by_ids(voucher_ids)[voucher_ids[0]].unclaimed == i + 1
+
+        # Weekly templates aren't due again yet
+        scheduler.trigger_voucher_creation()
+        assert all(len(get_vouchers_by_voucher_template(template_id)) == 1 for template_id in template_ids)
+
+    def test_thread_wakes_at_deadline(self, reset_db):
+        *_, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+
+        scheduler = VoucherScheduler()
+        scheduler.start()
+        try:
+            # Due well before the scheduler's longest sleep
+            template_id = insert_template(eatery_id, datetime.now(timezone.utc) + timedelta(seconds=1))
+            scheduler.add_voucher(template_id)
+            assert not get_vouchers_by_voucher_template(template_id)
+
+            deadline = time.monotonic() + 10
+            while not get_vouchers_by_voucher_template(template_id) and time.monotonic() < deadline:
+                time.sleep(0.1)
+        finally:
+            scheduler.stop()
+
+        assert len(get_vouchers_by_voucher_template(template_id)) == 1
+
+    def test_release_is_idempotent(self, reset_db):
+        *_, eatery_id = register_eatery(register_data["eatery"]["1"]).values()
+        release_date = datetime.now(timezone.utc) - timedelta(minutes=1)
+        template_id = insert_template(eatery_id, release_date, release_size=3)
+
+        # Two processes releasing the same batch, say either side of a lease handover
+        scheduler = VoucherScheduler()
+        for _ in range(2):
+            next_releases = scheduler._release_batch( # pylint: disable=protected-access
+                [(release_date, template_id)], get_voucher_template_schedules_by_ids([template_id]))
+            assert next_releases[template_id] == release_date + timedelta(weeks=1)
+
+        voucher_ids = get_vouchers_by_voucher_template(template_id)
+        assert len(voucher_ids) == 1
+        assert get_voucher_counts_by_ids(voucher_ids)[voucher_ids[0]].unclaimed == 3
+
+class TestSchedulerLease:
+    def test_single_holder_with_failover(self):
+        leader, follower = make_lease(), make_lease()
+        try:
+            assert leader.acquire()
+            assert not follower.acquire()
+            assert leader.renew()
+
+            # The leader's connection dies, as it would if its process crashed
+            terminate_lease_holder()
+            assert not leader.renew()
+            assert follower.acquire()
+
+            follower.release()
+            assert leader.acquire()
+        finally:
+            leader.release()
+            follower.release()
+
+    def test_leader_hears_new_templates(self):
+        lease = make_lease()
+        try:
+            assert lease.acquire()
+            notify_voucher_template_scheduled(42)
+
+            payloads = []
+            deadline = time.monotonic() + 5
+            while not payloads and time.monotonic() < deadline:
+                assert lease.renew()
+                payloads = lease.notifications()
+                time.sleep(0.05)
+
+            assert payloads == ["42"]
+        finally:
+            lease.release()